@@ -0,0 +1,336 @@
+import os
+import re
+import sys
+import time
+import logging
+import argparse
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+
+from db_pool import TimedSSCursor, get_pool
+from pagination import parse_filters, quote_identifier
+
+# pyarrow (and numpy, which it depends on) is optional: without it the
+# snapshot exporter and /api/analytics are unavailable, everything else works
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    np = pa = pc = pq = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = Path(os.environ.get("ANALYTICS_SNAPSHOT_DIR", "./snapshots"))
+# rows read from MariaDB and written as one Parquet row group
+SNAPSHOT_CHUNK_ROWS = 50000
+# a table changed by ingestion is re-exported at most this often, in seconds
+SNAPSHOT_INTERVAL = 30.0
+# snapshots kept open (memory-mapped) per worker process
+SNAPSHOT_CACHE_SIZE = 16
+
+AGGREGATIONS = {"count", "sum", "mean", "min", "max", "count_distinct"}
+DEFAULT_BINS = 20
+MAX_BINS = 1000
+MAX_GROUPS = 10000
+
+_INT_RE = re.compile(r"^(tinyint|smallint|mediumint|int|bigint)\b")
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+def available():
+    return pa is not None
+
+
+def snapshot_path(table, snapshot_dir=SNAPSHOT_DIR):
+    return Path(snapshot_dir) / f"{table}.parquet"
+
+
+def _arrow_type(sql_type):
+    sql_type = sql_type.lower()
+    if sql_type == "tinyint(1)":
+        return pa.bool_()
+    if _INT_RE.match(sql_type):
+        return pa.int64()
+    if sql_type.startswith(("float", "double", "decimal", "real")):
+        return pa.float64()
+    if sql_type == "date":
+        return pa.date32()
+    if sql_type.startswith(("datetime", "timestamp")):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def _arrow_schema(cursor, table):
+    cursor.execute(f"SHOW COLUMNS FROM {quote_identifier(table)}")
+    return pa.schema([pa.field(row[0], _arrow_type(row[1])) for row in cursor.fetchall()])
+
+
+def _record_batch(schema, rows):
+    columns = list(zip(*rows))
+    arrays = []
+    for field, values in zip(schema, columns):
+        # pymysql returns BOOLEAN (tinyint(1)) as 0/1 and DECIMAL as Decimal, which Arrow won't coerce
+        if pa.types.is_string(field.type):
+            values = [value if value is None or isinstance(value, str) else str(value) for value in values]
+        elif pa.types.is_boolean(field.type):
+            values = [None if value is None else bool(value) for value in values]
+        elif pa.types.is_floating(field.type):
+            values = [None if value is None else float(value) for value in values]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_snapshot(table, pool=None, snapshot_dir=SNAPSHOT_DIR, chunk_rows=SNAPSHOT_CHUNK_ROWS):
+    """Export `table` to <snapshot_dir>/<table>.parquet, replacing the previous snapshot atomically.
+
+    Rows are streamed off the server and written one row group at a time,
+    so memory use is bounded by `chunk_rows`.
+    """
+    if not available():
+        raise AnalyticsError("pyarrow is not installed")
+    pool = pool or get_pool()
+    path = snapshot_path(table, snapshot_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    rows_written = 0
+    entry = pool.acquire()
+    finished = False
+    try:
+        with entry.conn.cursor() as cursor:
+            schema = _arrow_schema(cursor, table)
+        cursor = entry.conn.cursor(TimedSSCursor)
+        cursor.execute(f"SELECT {', '.join(quote_identifier(f.name) for f in schema)} "
+                       f"FROM {quote_identifier(table)}")
+        with pq.ParquetWriter(str(tmp), schema, compression="zstd") as writer:
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                writer.write_batch(_record_batch(schema, rows))
+                rows_written += len(rows)
+        cursor.close()
+        finished = True
+    finally:
+        # an unread result set is still pending on the connection, see streaming.py
+        pool.release(entry, discard=not finished)
+        if not finished and tmp.exists():
+            tmp.unlink()
+    os.replace(tmp, path)
+    logger.info(f"Snapshot of '{table}' written: {rows_written} rows")
+    return rows_written
+
+
+class SnapshotRefresher:
+    """Re-exports tables marked dirty by the ingest stream, at most every `interval` seconds."""
+
+    def __init__(self, pool=None, snapshot_dir=SNAPSHOT_DIR, interval=SNAPSHOT_INTERVAL):
+        self.pool = pool
+        self.snapshot_dir = snapshot_dir
+        self.interval = interval
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def mark_dirty(self, tables):
+        with self._lock:
+            self._dirty.update(tables)
+
+    def refresh(self):
+        with self._lock:
+            tables, self._dirty = self._dirty, set()
+        for table in sorted(tables):
+            try:
+                write_snapshot(table, self.pool, self.snapshot_dir)
+            except Exception as e:
+                logger.error(f"Snapshot of '{table}' failed, retrying later: {e}")
+                self.mark_dirty([table])
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            self.refresh()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="snapshots", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.refresh()
+
+
+_snapshots = OrderedDict()  # path -> (mtime_ns, pyarrow.Table)
+_snapshots_lock = threading.Lock()
+
+
+def load_snapshot(table, snapshot_dir=SNAPSHOT_DIR):
+    # memory-mapped snapshot of `table`, reopened when the file was replaced; None if there is none
+    path = snapshot_path(table, snapshot_dir)
+    try:
+        mtime_ns = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None, None
+    key = str(path)
+    with _snapshots_lock:
+        cached = _snapshots.get(key)
+        if cached is not None and cached[0] == mtime_ns:
+            _snapshots.move_to_end(key)
+            return cached[1], mtime_ns
+    snapshot = pq.read_table(key, memory_map=True)
+    with _snapshots_lock:
+        _snapshots[key] = (mtime_ns, snapshot)
+        _snapshots.move_to_end(key)
+        while len(_snapshots) > SNAPSHOT_CACHE_SIZE:
+            _snapshots.popitem(last=False)
+    return snapshot, mtime_ns
+
+
+def _column(snapshot, name):
+    if name not in snapshot.column_names:
+        raise AnalyticsError(f"Unknown column '{name}'")
+    return snapshot.column(name)
+
+
+def _filter_mask(snapshot, filters):
+    mask = None
+    for column, op, value in filters:
+        data = _column(snapshot, column)
+        if op == "~":
+            condition = pc.starts_with(pc.cast(data, pa.string()), value)
+        else:
+            try:
+                scalar = pa.scalar(value).cast(data.type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                raise AnalyticsError(f"'{value}' is not a valid value for column '{column}'")
+            condition = pc.equal(data, scalar)
+        mask = condition if mask is None else pc.and_(mask, condition)
+    return mask
+
+
+def parse_aggregations(raw_aggs):
+    # agg=count, agg=sum:weight, agg=mean:temperature, ...
+    aggregations = []
+    for raw in raw_aggs or ["count"]:
+        func, _, column = raw.partition(":")
+        if func not in AGGREGATIONS:
+            raise AnalyticsError(f"Unsupported aggregation '{func}', use one of: {', '.join(sorted(AGGREGATIONS))}")
+        if func != "count" and not column:
+            raise AnalyticsError(f"Aggregation '{func}' needs a column, e.g. {func}:<column>")
+        aggregations.append((func, column or None))
+    return aggregations
+
+
+def _group_by(snapshot, keys, aggregations):
+    for key in keys:
+        _column(snapshot, key)
+    specs = []
+    renamed = {}
+    for func, column in aggregations:
+        if column is None:
+            # count of rows: count of the first key, nulls included
+            specs.append((keys[0], "count", pc.CountOptions(mode="all")))
+            renamed[f"{keys[0]}_count"] = "count"
+        else:
+            _column(snapshot, column)
+            specs.append((column, func))
+            # pyarrow names every aggregate <column>_<function>
+            renamed[f"{column}_{func}"] = f"{func}:{column}"
+    grouped = snapshot.group_by(keys).aggregate(specs)
+    if grouped.num_rows > MAX_GROUPS:
+        raise AnalyticsError(f"More than {MAX_GROUPS} groups, add filters or group by fewer columns")
+    return [{renamed.get(name, name): value for name, value in row.items()} for row in grouped.to_pylist()]
+
+
+def _totals(snapshot, aggregations):
+    totals = {}
+    for func, column in aggregations:
+        if column is None:
+            totals["count"] = snapshot.num_rows
+            continue
+        data = _column(snapshot, column)
+        value = getattr(pc, func)(data)
+        totals[f"{func}:{column}"] = value.as_py()
+    return totals
+
+
+def _histogram(snapshot, column, bins):
+    data = _column(snapshot, column)
+    if not (pa.types.is_integer(data.type) or pa.types.is_floating(data.type)):
+        raise AnalyticsError(f"Column '{column}' is not numeric")
+    values = pc.drop_null(data).to_numpy()
+    if len(values) == 0:
+        return {"column": column, "edges": [], "counts": []}
+    counts, edges = np.histogram(values, bins=bins)
+    return {"column": column, "edges": edges.tolist(), "counts": counts.tolist()}
+
+
+def query(table, args, snapshot_dir=SNAPSHOT_DIR):
+    """Filter, group-by and histogram over the columnar snapshot of `table`.
+
+    Query parameters: filter (as /api/data), group_by=<col>[,<col>...],
+    agg=count|<func>:<column> (repeatable), histogram=<column>, bins=<n>.
+    Only aggregated values are returned, never the rows themselves.
+    """
+    if not available():
+        raise AnalyticsError("pyarrow is not installed")
+    snapshot, mtime_ns = load_snapshot(table, snapshot_dir)
+    if snapshot is None:
+        return None
+    mask = _filter_mask(snapshot, parse_filters(args.getlist("filter")))
+    if mask is not None:
+        snapshot = snapshot.filter(mask)
+
+    result = {"table": table, "rows": snapshot.num_rows, "snapshotAt": mtime_ns / 1e9}
+    aggregations = parse_aggregations(args.getlist("agg"))
+    group_by = [key for key in (args.get("group_by") or "").split(",") if key]
+    if group_by:
+        result["groups"] = _group_by(snapshot, group_by, aggregations)
+    else:
+        result["totals"] = _totals(snapshot, aggregations)
+    if args.get("histogram"):
+        try:
+            bins = int(args.get("bins", DEFAULT_BINS))
+        except ValueError:
+            raise AnalyticsError("bins must be an integer")
+        if not 1 <= bins <= MAX_BINS:
+            raise AnalyticsError(f"bins must be between 1 and {MAX_BINS}")
+        result["histogram"] = _histogram(snapshot, args["histogram"], bins)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write columnar (Parquet) snapshots of the experiment tables")
+    parser.add_argument("tables", nargs="*", help="tables to export, default all")
+    parser.add_argument("--snapshot-dir", default=str(SNAPSHOT_DIR))
+    parser.add_argument("--watch", action="store_true", help=f"re-export all tables every {SNAPSHOT_INTERVAL:.0f}s")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if not available():
+        logger.error("pyarrow is not installed")
+        return 1
+    tables = args.tables
+    if not tables:
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SHOW TABLES")
+                tables = [row[0] for row in cursor.fetchall() if not row[0].startswith("_")]
+    while True:
+        for table in tables:
+            write_snapshot(table, snapshot_dir=args.snapshot_dir)
+        if not args.watch:
+            return 0
+        time.sleep(SNAPSHOT_INTERVAL)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
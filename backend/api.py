@@ -1,19 +1,33 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 from flask_restful import Api
-import elabapy
+from contextlib import ExitStack
 import json
-import base64
-from pathlib import Path
 import os
-import smtplib
+import time
 from email.message import EmailMessage
 import mimetypes
 import io
-import base64
 from datetime import date
 import pymysql
 import logging
-import json as _json
+from db_pool import get_pool, load_db_config
+from pagination import (PAGE_PARAMS, PaginationError, fetch_page, filter_clause,
+                        parse_filters, quote_identifier, table_columns)
+from streaming import STREAM_FORMATS, stream_query
+from join_engine import JOIN_PAGE_PARAMS, JoinError, join_page, join_query
+import registry
+from elab_client import elab_manager, run_concurrently
+from attachments import (AttachmentError, attachment_extension, data_uri_mimetype, decode_data_uri,
+                         json_attachment, peek)
+from search_index import DEFAULT_SEARCH_LIMIT, MAX_SEARCH_LIMIT, search
+from schema_migration import migrate_table, migration_history
+import analytics
+import validation
+import response_cache
+from response_cache import cached
+from json_encoding import COLUMNAR, ShapeError, json_response, parse_shape, shape_rows
+from mail_queue import MAIL_QUEUE_PATH, enqueue as enqueue_mail, job_status as mail_job_status, queue_stats
+import metrics
 # from watchdog.observers import Observer
 # from watchdog.events import FileSystemEventHandler
 
@@ -27,8 +41,7 @@ app.config['EMPIRF_SECRET_KEY'] = 'EPMIRF_SECURITY'
 # jwt = JWTManager(app)
 
 # Database configuration
-with open(os.path.join(os.path.dirname(__file__), 'conf', 'db_config.json'), 'r') as f:
-    db_config = _json.load(f)
+db_config = load_db_config()
 DB_HOST = db_config['DB_HOST']
 DB_PORT = db_config['DB_PORT']
 DB_USER = db_config['DB_USER']
@@ -38,6 +51,13 @@ DB_NAME = db_config['DB_NAME']
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
+# one JSON line per request: route, status, duration, DB time, rows and bytes
+timing_logger = logging.getLogger("timing")
+
+# ?profile=1 samples the request's stack when the X-Profile-Token header
+# matches PROFILE_TOKEN; the folded stacks are written to PROFILE_DIR
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "./profiles")
 
 # class DataHandler(FileSystemEventHandler):
 #     def __init__(self):
@@ -117,128 +137,74 @@ logger = logging.getLogger(__name__)
 #     observer.start()
 #     return observer
 
-# convert json form data to eLabFTW description list
-def findBase64(data, prevKey, emptyArray):
-
-    for key in data:
-
-        if isinstance(data[key], list) and (type(data[key]) is dict):
-            findBase64(data[key], prevKey+"-"+key, emptyArray)
-        elif isinstance(data[key], list):
-            for i in range(0, len(data[key])):
-                findBase64(data[key][i], key+"-"+str(i+1), emptyArray)
-        else:
-            if isinstance(data[key], str):
-                if data[key].startswith("data:") and ("base64" in data[key]):
-                    logger.info("found data")
-                    emptyArray.append({"key": key, "data": data[key]})
-
-    return emptyArray
-
-
-# find the value of requesterKeyword
-def findRequesterEmail(jsdata, requesterKeyword, result):
-    for key in jsdata:
-        if key == requesterKeyword:
-            result = jsdata[key]
-        if isinstance(jsdata[key], dict):
-            result = findRequesterEmail(jsdata[key], requesterKeyword, result)
-    return result
-
-
-# find the value of operator Keyword
-def findOperatorName(jsdata, operatorKeyword, result):
-    for key in jsdata:
-        if key == operatorKeyword:
-            result = jsdata[key]
-        if isinstance(jsdata[key], dict):
-            result = findOperatorName(jsdata[key], operatorKeyword, result)
-    return result
-
-
-# find the falue of requesterNameKeyword
-def findRequesterName(jsdata, requesterNameKeyword, result):
-    for key in jsdata:
-        if key == requesterNameKeyword:
-            result = jsdata[key]
-        if isinstance(jsdata[key], dict):
-            result = findRequesterName(
-                jsdata[key], requesterNameKeyword, result)
-    return result
-
-def map_json_type_to_sql(json_type):
-    type_mapping = {
-        "string": "VARCHAR(255)",
-        "number": "FLOAT",
-        "integer": "INT",
-        "boolean": "BOOLEAN",
-        "file upload(string)": "VARCHAR(255)",
-        "object": "JSON",
-        "array": "JSON"
-    }
-    return type_mapping.get(json_type, "VARCHAR(255)")
-
-def extract_properties(properties, parent_key=''):
-    items = {}
-    for key, value in properties.items():
-        # Adding parent property before the parameters under while separating with a _ 
-        # full_key = f"{parent_key}_{key}" if parent_key else key 
-        full_key = f"{key}" if parent_key else key
-        if value['type'] == 'object' and 'properties' in value:
-            items.update(extract_properties(value['properties'], full_key))
-        else:
-            items[full_key] = value
-    return items
-
-def create_table_from_schema(schema_name, schema_content):
-    # Parse the schema content to extract properties and types
-    # print('@@@@@@@@@@@@@@@ INSIDE CREATE @@@@@@@@@@@@@@@@@')
+def create_table_from_schema(schema_name, schema_content, dry_run=False):
+    # create the table, or ALTER it in place if it exists; existing rows are kept
     schema = json.loads(schema_content)
-    # print('@@@@@@@@@@@@@@@ Schema @@@@@@@@@@@@@@@@@',schema)
-    properties = schema.get("properties", {})
-    # print('@@@@@@@@@@@@@@@ PROPERTIES @@@@@@@@@@@@@@@@@',properties)
-    
-    # Extract all properties, including nested ones
-    flattened_properties = extract_properties(properties)
-    # print('@@@@@@@@@@@@@@@ Flattened Properties @@@@@@@@@@@@@@@@@', flattened_properties)
-
-    columns = []
-    for prop, details in flattened_properties.items():
-        column_type = map_json_type_to_sql(details.get("type", "string"))
-        columns.append(f"`{prop}` {column_type}")
-        
-    # Append documentLocation per default
-    columns.append("`documentlocation` VARCHAR(255)")
-
-    columns_str = ", ".join(columns)
-    drop_table_query = f"DROP TABLE IF EXISTS `{schema_name}`;"
-    logger.debug(f'DB QUERY: {drop_table_query}')
-    create_table_query = f"CREATE TABLE IF NOT EXISTS `{schema_name}` ({columns_str});"
-    logger.debug(f'DB QUERY: {create_table_query}')
-    
-
-    # Connect to the database and execute the query
-    try:
-        connection = pymysql.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        logger.info('CONNECTION TO DB IS SUCCESSFUL')
-    except pymysql.Error as e:
-        logger.error(f'Error connecting to MariaDB: {e}')
-    try:
-        with connection.cursor() as cursor:
-            cursor.execute(drop_table_query)
-            logger.info('DROP TABLE EXECUTED')
-            cursor.execute(create_table_query)
-        connection.commit()
-        logger.info('COMMIT SUCCESSFUL')
-    finally:
-        connection.close()
-        logger.info('CONNECTION IS CLOSED')
+    plan = migrate_table(schema_name, schema, dry_run)
+    logger.info(f"Migration of '{schema_name}': {len(plan['statements'])} statements, dry run: {dry_run}")
+    return plan
+
+
+@app.before_request
+def start_request_timing():
+    g.request_started = time.perf_counter()
+    metrics.begin_request()
+    g.profiler = None
+    if request.args.get("profile") == "1" and PROFILE_TOKEN \
+            and request.headers.get("X-Profile-Token") == PROFILE_TOKEN:
+        g.profiler = metrics.SamplingProfiler().start()
+
+
+@app.after_request
+def record_request_timing(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    stats = metrics.end_request() or {}
+    # the rule, not the path, so that tables and search strings don't each become a series
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    size = None if response.is_streamed else response.calculate_content_length()
+    metrics.observe("http_request_duration_seconds", elapsed,
+                    route=route, method=request.method, status=response.status_code)
+    if size is not None:
+        metrics.observe("http_response_bytes", size, route=route)
+    metrics.flush()
+
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        folded = profiler.stop()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{request.endpoint or 'unmatched'}.folded"
+        with open(os.path.join(PROFILE_DIR, name), "w") as f:
+            f.write(folded)
+        response.headers["X-Profile-File"] = name
+
+    timing_logger.info(json.dumps({
+        "method": request.method,
+        "route": route,
+        "path": request.path,
+        "status": response.status_code,
+        "ms": round(elapsed * 1000, 2),
+        "db_ms": round(stats.get("db_seconds", 0.0) * 1000, 2),
+        "db_queries": stats.get("db_queries", 0),
+        "rows": stats.get("rows", 0),
+        "bytes": size,
+        "cache": response.headers.get("X-Cache"),
+    }))
+    return response
+
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=["GET"])
+def get_metrics():
+    live = {}
+    if os.path.exists(MAIL_QUEUE_PATH):
+        try:
+            live["mail_queue_pending"], live["mail_queue_lag_seconds"] = queue_stats()
+        except Exception as e:
+            logger.warning(f"Mail queue stats unavailable: {e}")
+    return Response(metrics.render(live), mimetype="text/plain; version=0.0.4")
 
 
 # @app.route('/')
@@ -250,35 +216,24 @@ def check_mode():
     # check if online, and get list of schemas used in job request workflows
     listSchemas = []
     listSubmitText = []
-    try:
-        with open("./conf/jobrequest-conf.json", "r") as fi:
-            f = fi.read()
-            f = json.loads(f)
-            emailconf_list = f["confList"]
-            for element in emailconf_list:
-                listSchemas.append(element["completeSchemaTitle"])
-                listSchemas.append(element["requestSchemaTitle"])
-                listSubmitText.append(element["submitButtonText"])
-                listSubmitText.append(element["submitButtonText"])
-        return {"message": "connection is a success", "jobRequestSchemaList": listSchemas, "submitButtonText": listSubmitText}
-    except Exception as e:
-        return {"message": "connection is a success", "jobRequestSchemaList": listSchemas, "submitButtonText": listSubmitText}
+    conf = registry.jobrequest_conf.get()
+    if conf is not None:
+        for element in conf["confList"]:
+            listSchemas.append(element["completeSchemaTitle"])
+            listSchemas.append(element["requestSchemaTitle"])
+            listSubmitText.append(element.get("submitButtonText"))
+            listSubmitText.append(element.get("submitButtonText"))
+    return {"message": "connection is a success", "jobRequestSchemaList": listSchemas, "submitButtonText": listSubmitText}
 
 
-# get schemas from backend
+# get schemas from backend, served from the registry and revalidated with ETag/If-None-Match
 @app.route('/api/get_schemas', methods=["GET"])
 def get_schemas():
-    list_of_schemas = {"schemaName": [""], "schema": [None]}
-    filelist = list(Path('./schemas').glob('**/*.json'))
-    for i in range(0, len(filelist)):
-        file = filelist[i]
-        file = open(str(file), 'r', encoding='utf-8')
-        filename = str(file.name).replace("schemas\\", "")
-        filename = filename.replace("schemas/", "")  # for linux, maybe
-        content = file.read()
-        list_of_schemas["schema"].append(content)
-        list_of_schemas["schemaName"].append(filename)
-    return list_of_schemas
+    prepared = registry.schemas.get()
+    response = Response(prepared.body, mimetype='application/json')
+    response.set_etag(prepared.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 @app.route('/api/save_schema', methods=["POST"])
 def save_schema():
@@ -303,146 +258,166 @@ def save_schema():
             
             # Convert the updated schema dictionary back to JSON
             updated_schema_content = json.dumps(schema_dict, indent=2)
-            with open(f"./schemas/{schema_name}.json", "w", encoding="utf-8") as file:
+            # a dry run only reports the statements the save would execute
+            dry_run = bool(data.get("dryRun")) or request.args.get("dry_run") in ("1", "true")
+            if dry_run:
+                plan = create_table_from_schema(schema_name, updated_schema_content, dry_run=True)
+                return {"message": f"Dry run for schema '{schema_name}'", "migration": plan}, 200
+            # Create or migrate the corresponding table in the database, the schema
+            # file is only replaced once that succeeded
+            plan = create_table_from_schema(schema_name, updated_schema_content)
+            schema_path = f"./schemas/{schema_name}.json"
+            with open(f"{schema_path}.tmp", "w", encoding="utf-8") as file:
                 file.write(updated_schema_content)
-                # Create the corresponding table in the database
-                logger.info('CREATE IS CALLED')
-                create_table_from_schema(schema_name, updated_schema_content)
-            return {"message": f"Schema '{schema_name}' saved successfully"}, 200
+            os.replace(f"{schema_path}.tmp", schema_path)
+            registry.schemas.invalidate()
+            response_cache.versions.invalidate()
+            return {"message": f"Schema '{schema_name}' saved successfully", "migration": plan}, 200
         except Exception as e:
             return {"error": str(e)}, 500
     else:
         return {"error": "Schema name or content not provided"}, 400
 
+# API Endpoint: Get the migrations applied to a table
+@app.route("/api/schema_migrations/<string:table>", methods=["GET"])
+def get_schema_migrations(table):
+    try:
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                history = migration_history(cursor, table)
+        return jsonify(history)
+    except Exception as e:
+        return jsonify({"error": f"Error retrieving migrations of table {table}: {str(e)}"}), 500
+
 # API Endpoint: Get list of tables
 @app.route("/api/tables", methods=["GET"])
+@cached()
 def get_tables():
-    connection = None
-    try:
-        connection = pymysql.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        logger.info('CONNECTION TO DB IS SUCCESSFUL')
-    except pymysql.Error as e:
-        logger.error(f'Error connecting to MariaDB: {e}')
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("SHOW TABLES")
-            tables = [table[0] for table in cursor.fetchall()]
-            return jsonify(tables)
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SHOW TABLES")
+                # _schema_migrations, _table_versions: internal bookkeeping
+                tables = [table[0] for table in cursor.fetchall() if not table[0].startswith("_")]
+        return jsonify(tables)
     except Exception as e:
         return jsonify({"error": f"Error retrieving tables: {str(e)}"}), 500
 
 # API Endpoint: Get data from a specific table
 @app.route("/api/data/<string:table>", methods=["GET"])
+@cached("table")
 def get_table_data(table):
+    # streaming export: ?format=ndjson|csv, optionally narrowed with filter=
+    fmt = request.args.get("format")
+    if fmt:
+        if fmt not in STREAM_FORMATS:
+            return jsonify({"error": f"Unsupported format '{fmt}', use one of: {', '.join(STREAM_FORMATS)}"}), 400
+        try:
+            filters = parse_filters(request.args.getlist("filter"))
+            with get_pool().connection() as connection:
+                with connection.cursor() as cursor:
+                    columns = table_columns(cursor, table)
+            for column, _, _ in filters:
+                if column not in columns:
+                    raise PaginationError(f"Unknown filter column '{column}'")
+            where, params = filter_clause(filters)
+            query = f"SELECT * FROM {quote_identifier(table)}"
+            if where:
+                query += " WHERE " + " AND ".join(where)
+            return stream_query(query, params, fmt, table)
+        except PaginationError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": f"Error exporting data from table {table}: {str(e)}"}), 500
+
+    # ?shape=columnar: {"columns": [...], "rows": [[...], ...]} instead of a dict per row
     try:
-        connection = pymysql.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        logger.info('CONNECTION TO DB IS SUCCESSFUL')
-    except pymysql.Error as e:
-        logger.error(f'Error connecting to MariaDB: {e}')
+        shape = parse_shape(request.args)
+    except ShapeError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # paged mode: ?limit=&cursor=&order_by=[-]col&filter=col:value&count=exact
+    if PAGE_PARAMS.intersection(request.args.keys()):
+        try:
+            with get_pool().connection() as connection:
+                with connection.cursor() as cursor:
+                    page = fetch_page(cursor, table, request.args)
+            return json_response(page, shape=shape)
+        except PaginationError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": f"Error retrieving data from table {table}: {str(e)}"}), 500
+
     try:
-        with connection.cursor() as cursor:
-            query = f"SELECT * FROM `{table}`"
-            cursor.execute(query)
-            results = cursor.fetchall()
-            columns = [desc[0] for desc in cursor.description]
-            data = [dict(zip(columns, row)) for row in results]
-            return jsonify(data)
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                query = f"SELECT * FROM `{table}`"
+                cursor.execute(query)
+                results = cursor.fetchall()
+                columns = [desc[0] for desc in cursor.description]
+        if shape == COLUMNAR:
+            return json_response({"columns": columns, "rows": results}, shape=shape)
+        return json_response(shape_rows(columns, results, shape)["data"])
     except Exception as e:
         return jsonify({"error": f"Error retrieving data from table {table}: {str(e)}"}), 500
 
 # API Endpoint: Get column information of a table
 @app.route("/api/columns/<string:table>", methods=["GET"])
+@cached("table")
 def get_columns(table):
     try:
-        connection = pymysql.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        logger.info('CONNECTION TO DB IS SUCCESSFUL')
-    except pymysql.Error as e:
-        logger.error(f'Error connecting to MariaDB: {e}')
-    try:
-        with connection.cursor() as cursor:
-            query = f"DESCRIBE `{table}`"
-            cursor.execute(query)
-            results = cursor.fetchall()
-            columns = [
-                {"name": col[0], "type": col[1], "nullable": col[2] == "YES",
-                 "key": col[3], "default": col[4], "extra": col[5]}
-                for col in results
-            ]
-            return jsonify(columns)
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                query = f"DESCRIBE `{table}`"
+                cursor.execute(query)
+                results = cursor.fetchall()
+        columns = [
+            {"name": col[0], "type": col[1], "nullable": col[2] == "YES",
+             "key": col[3], "default": col[4], "extra": col[5]}
+            for col in results
+        ]
+        return jsonify(columns)
     except Exception as e:
         return jsonify({"error": f"Error retrieving column info for table {table}: {str(e)}"}), 500
 
+# API Endpoint: Aggregates over the columnar snapshot of a table
+# ?filter=col:value, ?group_by=col1,col2, ?agg=count|sum:col|mean:col|..., ?histogram=col&bins=N
+@app.route("/api/analytics/<string:table>", methods=["GET"])
+def get_analytics(table):
+    if not analytics.available():
+        return jsonify({"error": "Analytics are not available, pyarrow is not installed"}), 501
+    try:
+        result = analytics.query(table, request.args)
+    except (analytics.AnalyticsError, PaginationError) as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"Error computing analytics for table {table}: {str(e)}"}), 500
+    if result is None:
+        return jsonify({"error": f"No snapshot of table {table}, run analytics.py or the ingest watcher with --snapshots"}), 404
+    return jsonify(result)
+
 # API Endpoint: Search for a string in all tables
+# optional: ?tables=table1,table2 to restrict the search, ?limit=N for the number of hits
 @app.route("/api/search/<string:search_string>", methods=["GET"])
+@cached()
 def search_tables(search_string):
+    tables = [t for t in request.args.get("tables", "").split(",") if t] or None
     try:
-        connection = pymysql.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME
-        )
-        logger.info('CONNECTION TO DB IS SUCCESSFUL')
-    except pymysql.Error as e:
-        logger.error(f'Error connecting to MariaDB: {e}')
+        limit = max(1, min(int(request.args.get("limit", DEFAULT_SEARCH_LIMIT)), MAX_SEARCH_LIMIT))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
     try:
-        with connection.cursor() as cursor:
-            cursor.execute("SHOW TABLES")
-            tables = [table[0] for table in cursor.fetchall()]
-            search_results = []
-
-            for table in tables:
-                cursor.execute(f"DESCRIBE `{table}`")
-                columns = [col[0] for col in cursor.fetchall()]
-
-                if not columns:
-                    continue
-
-                query = f"SELECT * FROM `{table}` WHERE CONCAT_WS(' ', {', '.join(columns)}) LIKE %s"
-                cursor.execute(query, (f"%{search_string}%",))
-                results = cursor.fetchall()
-
-                for row in results:
-                    search_results.append({"table": table, "data": dict(zip(columns, row))})
-
-            return jsonify(search_results)
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                search_results = search(cursor, search_string, tables, limit)
+        return jsonify(search_results)
     except Exception as e:
         return jsonify({"error": f"Error searching tables: {str(e)}"}), 500
 
 # API Endpoint: Perform LEFT JOIN on two tables
+# optional: columns1=/columns2= to project columns, limit=/cursor= for paging, format=ndjson|csv to stream
 @app.route("/api/left-join", methods=["GET"])
 def left_join():
-    try:
-        connection = pymysql.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            database=DB_NAME,
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        logger.info('CONNECTION TO DB IS SUCCESSFUL')
-    except pymysql.Error as e:
-        logger.error(f'Error connecting to MariaDB: {e}')
     table1 = request.args.get("table1")
     table2 = request.args.get("table2")
     column1 = request.args.get("column1")
@@ -452,40 +427,35 @@ def left_join():
     if not all([table1, table2, column1, column2]):
         return jsonify({"error": "Missing parameters: table1, table2, column1, column2"}), 400
 
+    fmt = request.args.get("format")
+    if fmt and fmt not in STREAM_FORMATS:
+        return jsonify({"error": f"Unsupported format '{fmt}', use one of: {', '.join(STREAM_FORMATS)}"}), 400
+
     try:
-        with connection.cursor() as cursor:
-            # 1. SELECT all from table A (experiments)
-            cursor.execute(f"SELECT * FROM `{table1}`")
-            table_a_data = cursor.fetchall()
-
-            # 2. SELECT all from table B (conditions)
-            cursor.execute(f"SELECT * FROM `{table2}`")
-            table_b_data = cursor.fetchall()
-
-            # Build lookup for Table B
-            b_lookup = {row[column2]: row for row in table_b_data}
-
-            # 4. Merge Table A with Table B based on sample_id
-            merged_data = []
-            for a_row in table_a_data:
-                sample_id = a_row[column1]
-                b_row = b_lookup.get(sample_id, {})
-
-                # Prefix B fields to avoid conflict
-                b_row_prefixed = {f"{k}_condition": v for k, v in b_row.items() if k != column2}
-                # Merge rows: Table A + Table B (prefixed)
-                merged_row = {**a_row, **b_row_prefixed}
-                merged_data.append(merged_row)
-
-            if merged_data:
-                columns = list(merged_data[0].keys())
-            else:
-                columns = []
-            return jsonify({
-                "columns": columns,
-                "data": merged_data
-            })
-            # return jsonify(results)
+        shape = parse_shape(request.args)
+    except ShapeError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with get_pool().connection() as connection:
+            with connection.cursor() as cursor:
+                if fmt:
+                    query, params, _ = join_query(cursor, table1, table2, column1, column2, request.args)
+                elif JOIN_PAGE_PARAMS.intersection(request.args.keys()):
+                    return json_response(join_page(cursor, table1, table2, column1, column2, request.args),
+                                         shape=shape)
+                else:
+                    query, params, columns = join_query(cursor, table1, table2, column1, column2, request.args)
+                    cursor.execute(query, params)
+                    rows = cursor.fetchall()
+        # streaming export: the join runs in MariaDB and rows are sent as they arrive
+        if fmt:
+            return stream_query(query, params, fmt, f"{table1}_{table2}")
+        result = {"columns": columns}
+        result.update(shape_rows(columns, rows, shape))
+        return json_response(result, shape=shape)
+    except (JoinError, PaginationError) as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": f"Error performing LEFT JOIN: {str(e)}"}), 500
 
@@ -520,10 +490,7 @@ def get_tags():
     elabURL = request.form['eLabURL']
     token = request.form['eLabToken']
     # create elab manager
-    elabURL = '{}/api/v1/'.format(elabURL)
-    elabURL = elabURL.replace('//api', '/api')
-    manager = elabapy.Manager(
-        endpoint=elabURL, token=token)
+    manager = elab_manager(elabURL, token)
     all_tags = manager.get_tags()
 
     return json.dumps(all_tags)
@@ -544,40 +511,38 @@ def create_experiment():
     jsschema = json.loads(jsschema)
     jsschema_title = jsschema["title"]
 
+    # refuse the submission before anything is created in eLabFTW
+    error = validation.validate(validation.compile_schema(jsschema), jsdata, f"Submission for '{jsschema_title}'")
+    if error is not None:
+        return jsonify({"responseText": f"The form data does not match the schema: {error}", "message": "invalid"}), 400
+
     # create experiment in eLabFtw
-    elabURL = '{}/api/v1/'.format(elabURL)
-    elabURL = elabURL.replace('//api', '/api')
-    manager = elabapy.Manager(
-        endpoint=elabURL, token=token)
+    manager = elab_manager(elabURL, token)
     response = manager.create_experiment()
 
     logger.info(f"response: {response}")
 
+    # everything below only needs the experiment id and is sent concurrently
+    calls = []
+
     # create the experiment body which is the description list attained by converting the jsdata
 
     # update the experiment
     params = {"title": title, "body": body}
-    manager.post_experiment(response['id'], params)
+    calls.append((manager.post_experiment, response['id'], params))
 
-    # upload the schema
-    with open('temp-files//json_schema.json', 'w') as outfile:
-        outfile.write(json.dumps(jsschema))
-    with open('temp-files//json_schema.json') as file:
-        file_param = {'file': file}
-        manager.upload_to_experiment(response['id'], file_param)
+    # upload the schema, straight from memory
+    file_param = {'file': json_attachment('json_schema.json', jsschema)}
+    calls.append((manager.upload_to_experiment, response['id'], file_param))
 
     # upload form data/jsdata
-    with open('temp-files//json_data.json', 'w') as outfile:
-        outfile.write(json.dumps(jsdata))
-    with open('temp-files//json_data.json') as file:
-        file_param = {'file': file}
-        manager.upload_to_experiment(response['id'], file_param)
-
-    # now if tags is not empty then add tags to this experiment id one by one
-    if len(tags) != 0:
-        for i in tags:
-            params = {'tag': i['tag']}
-            manager.add_tag_to_experiment(response['id'], params)
+    file_param = {'file': json_attachment('json_data.json', jsdata)}
+    calls.append((manager.upload_to_experiment, response['id'], file_param))
+
+    # now if tags is not empty then add tags to this experiment id
+    for i in tags:
+        params = {'tag': i['tag']}
+        calls.append((manager.add_tag_to_experiment, response['id'], params))
 
     """ to append the body
     params = {"bodyappend": "appended text<br>"}
@@ -585,66 +550,46 @@ def create_experiment():
     """
 
     # now check if there are file data in jsdata, if there is then upload it
-    collected_data = findBase64(jsdata, "start", [])
-    file = open("./mime-types-extensions.json",
-                'r', encoding='utf-8')
-    mimeExtensions = file.read()
-    file.close()
+    form_fields = registry.form_extractor.get().extract(jsdata)
+    collected_data = form_fields.attachments
     fileNames = []
-    mimeExtensions = json.loads(mimeExtensions)
-    for item in collected_data:
-        mimeType = item["data"].split(";")[0].replace("data:", "")
-        extension = list(mimeExtensions.keys())[
-            list(mimeExtensions.values()).index(mimeType)]
-        fileNames.append(item["key"]+extension)
-        _, encoded = item["data"].split(",", 1)
-        binary_data = base64.b64decode(encoded)
-        with open("./temp-files/"+item["key"]+extension, "wb") as fh:
-            fh.write(binary_data)
-        with open("temp-files//"+item["key"]+extension, "r+b") as fh:
-            file_param = {'file': fh}
-            manager.upload_to_experiment(response['id'], file_param)
+    with ExitStack() as buffers:
+        for item in collected_data:
+            # decoded into a per-request spooled buffer, nothing is written to the shared temp-files dir
+            try:
+                fh = buffers.enter_context(decode_data_uri(item["data"]))
+            except AttachmentError as e:
+                logger.warning(f"Skipping attachment '{item['key']}': {e}")
+                continue
+            extension = attachment_extension(data_uri_mimetype(item["data"]), peek(fh))
+            fileNames.append(item["key"]+extension)
+            file_param = {'file': (item["key"]+extension, fh)}
+            calls.append((manager.upload_to_experiment, response['id'], file_param))
+        run_concurrently(calls)
     logger.info(f"fileNames: {fileNames}")
 
-    # now delete everything in temp-files directory
-    dir = './temp-files'
-    for f in os.listdir(dir):
-        if f != ".placeholder":
-            os.remove(os.path.join(dir, f))
-
     # check if this process is related to job request workflow, if yes then send an e-mail notif to the requester
     try:
-        with open("./conf/jobrequest-conf.json", "r") as fi:
-            f = fi.read()
-            f = json.loads(f)
-            email_conf = ""
-            for element in f["confList"]:
-                if element["completeSchemaTitle"] == jsschema_title or element["requestSchemaTitle"] == jsschema_title:
-                    email_conf = element
-            # finish the process if not related to job request workflow
-            if email_conf == "":
-                return {"responseText": f"Created experiment with id {response['id']}.", "message": "success", "experimentId": response['id']}
-
-            requesterEmail = findRequesterEmail(
-                jsdata, email_conf["requesterEmailKeyword"], "")
-
-            # sending the emails
-            s = smtplib.SMTP_SSL(email_conf["smtp"])
-
-            # PREPARE msg for APPLICANT
-            msg = EmailMessage()
-            msg['From'] = email_conf["from"]
-            msg['To'] = requesterEmail
-            msg['Subject'] = email_conf["requestAcceptedSubject"]
-
-            header = email_conf["requestAcceptedHeaderText"]
-            html = header+body
-
-            msg.set_content(html, subtype="html")
-
-            s.send_message(msg)
-            logger.info("applicant email is valid")
-            del msg
+        email_conf = registry.find_jobrequest_conf(jsschema_title)
+        # finish the process if not related to job request workflow
+        if email_conf is None:
+            return {"responseText": f"Created experiment with id {response['id']}.", "message": "success", "experimentId": response['id']}
+
+        requesterEmail = form_fields.values.get(email_conf["requesterEmailKeyword"], "")
+
+        # PREPARE msg for APPLICANT
+        msg = EmailMessage()
+        msg['From'] = email_conf["from"]
+        msg['To'] = requesterEmail
+        msg['Subject'] = email_conf["requestAcceptedSubject"]
+
+        header = email_conf["requestAcceptedHeaderText"]
+        html = header+body
+
+        msg.set_content(html, subtype="html")
+
+        # delivered by the mail_queue worker, the request does not wait for SMTP
+        enqueue_mail(email_conf["smtp"], [msg])
     except Exception as e:
         logger.warning("No job request configuration was found. Skipping.")
 
@@ -662,101 +607,99 @@ def submit_job_request():
     jsdata = json.loads(jsdata)
     jsschema = json.loads(jsschema)
 
+    error = validation.validate(validation.compile_schema(jsschema), jsdata, f"Job request for '{jsschema.get('title')}'")
+    if error is not None:
+        return {"response": 400, "responseText": f"The form data does not match the schema: {error}"}
+
     try:
-        with open("./conf/jobrequest-conf.json", "r") as fi:
-            f = fi.read()
-
-            # find the right conf based on the schema title
-            f = json.loads(f)
-            email_conf = {}
-            for element in f["confList"]:
-                if element["completeSchemaTitle"] == jsschema["title"] or element["requestSchemaTitle"] == jsschema["title"]:
-                    email_conf = element
-
-            requesterEmail = findRequesterEmail(
-                jsdata, email_conf["requesterEmailKeyword"], "")
-            operatorName = findOperatorName(
-                jsdata, email_conf["operatorNameKeyword"], "")
-            operatorName_ = operatorName.replace(" ", "_")
-            operatorEmail = ""
-            responsiblePersonEmail = email_conf["responsibleOperatorEmail"]
-
-            for key in email_conf["operators"]:
-                if key == operatorName_:
-                    operatorEmail = email_conf["operators"][operatorName_]
-
-            #print("smtp:", email_conf["smtp"])
-            #print("operator:", operatorEmail)
-            #print("requester:", requesterEmail)
-            #print("responsible:", responsiblePersonEmail)
-
-            # sending the emails
-            s = smtplib.SMTP_SSL(email_conf["smtp"])
-
-            # PREPARE msg1 for APPLICANT
-            msg1 = EmailMessage()
-            msg1['From'] = email_conf["from"]
-            msg1['To'] = requesterEmail
-            msg1['Subject'] = email_conf["confirmationEmailSubject"]
-
-            header1 = email_conf["confirmationHeaderText"]
-            html1 = header1+body
-
-            msg1.set_content(html1, subtype="html")
-
-            # PREPARE msg2 for OPERATOR
-            msg2 = EmailMessage()
-            msg2['From'] = email_conf["from"]
-            msg2['To'] = "{0}, {1}".format(
-                operatorEmail, responsiblePersonEmail)
-            msg2['Subject'] = email_conf["requestReceivedEmailSubject"]
-
-            header2 = email_conf["requestReceivedHeaderText"]
-            html2 = header2+body
-
-            msg2.set_content(html2, subtype="html")
-
-            # create json attachments
-            for i in range(0, 2):
-                data = ""
-                if i == 0:
-                    data = jsdata
-                    fileName = "form_data"
-                else:
-                    data = jsschema
-                    fileName = "schema"
-
-                f = json.dumps(data, indent=2).encode('utf-8')
-                f_byte_arr = io.BytesIO()
-                f_byte_arr.write(f)
-                f_byte_arr.seek(0)
-                binary_data = f_byte_arr.read()
-                # Guess MIME type or use 'application/octet-stream'
-                maintype, _, subtype = (mimetypes.guess_type("{0}_{1}.json".format(
-                    fileName, dateToday))[0] or 'application/octet-stream').partition("/")
-                # Add as attachment
-                msg1.add_attachment(binary_data, maintype=maintype, subtype=subtype,
-                                    filename="{0}_{1}.json".format(fileName, dateToday))
-                msg2.add_attachment(binary_data, maintype=maintype, subtype=subtype,
-                                    filename="{0}_{1}.json".format(fileName, dateToday))
-
-            # now send the emails to both requester and operator (and responsible person)
-            try:
-                s.send_message(msg1)
-                s.send_message(msg2)
-                logger.info("applicant email is valid")
-                del msg1
-                del msg2
-                return {"response": 200, "responseText": "Your request has been submitted."}
-            except Exception as e:
-                del msg1
-                del msg2
-                logger.error(e)
-                return {"response": 500, "responseText": "Something went wrong"}
+        # find the right conf based on the schema title
+        email_conf = registry.find_jobrequest_conf(jsschema["title"])
+        if email_conf is None:
+            raise KeyError(f"no job request configuration for schema '{jsschema['title']}'")
+
+        form_fields = registry.form_extractor.get().extract(jsdata)
+        requesterEmail = form_fields.values.get(email_conf["requesterEmailKeyword"], "")
+        operatorName = form_fields.values.get(email_conf["operatorNameKeyword"], "")
+        operatorName_ = operatorName.replace(" ", "_")
+        operatorEmail = ""
+        responsiblePersonEmail = email_conf["responsibleOperatorEmail"]
+
+        for key in email_conf["operators"]:
+            if key == operatorName_:
+                operatorEmail = email_conf["operators"][operatorName_]
+
+        #print("smtp:", email_conf["smtp"])
+        #print("operator:", operatorEmail)
+        #print("requester:", requesterEmail)
+        #print("responsible:", responsiblePersonEmail)
+
+        # PREPARE msg1 for APPLICANT
+        msg1 = EmailMessage()
+        msg1['From'] = email_conf["from"]
+        msg1['To'] = requesterEmail
+        msg1['Subject'] = email_conf["confirmationEmailSubject"]
+
+        header1 = email_conf["confirmationHeaderText"]
+        html1 = header1+body
+
+        msg1.set_content(html1, subtype="html")
+
+        # PREPARE msg2 for OPERATOR
+        msg2 = EmailMessage()
+        msg2['From'] = email_conf["from"]
+        msg2['To'] = "{0}, {1}".format(
+            operatorEmail, responsiblePersonEmail)
+        msg2['Subject'] = email_conf["requestReceivedEmailSubject"]
+
+        header2 = email_conf["requestReceivedHeaderText"]
+        html2 = header2+body
+
+        msg2.set_content(html2, subtype="html")
+
+        # create json attachments
+        for i in range(0, 2):
+            data = ""
+            if i == 0:
+                data = jsdata
+                fileName = "form_data"
+            else:
+                data = jsschema
+                fileName = "schema"
+
+            f = json.dumps(data, indent=2).encode('utf-8')
+            f_byte_arr = io.BytesIO()
+            f_byte_arr.write(f)
+            f_byte_arr.seek(0)
+            binary_data = f_byte_arr.read()
+            # Guess MIME type or use 'application/octet-stream'
+            maintype, _, subtype = (mimetypes.guess_type("{0}_{1}.json".format(
+                fileName, dateToday))[0] or 'application/octet-stream').partition("/")
+            # Add as attachment
+            msg1.add_attachment(binary_data, maintype=maintype, subtype=subtype,
+                                filename="{0}_{1}.json".format(fileName, dateToday))
+            msg2.add_attachment(binary_data, maintype=maintype, subtype=subtype,
+                                filename="{0}_{1}.json".format(fileName, dateToday))
+
+        # queue the emails to both requester and operator (and responsible person),
+        # the mail_queue worker delivers them with retries
+        try:
+            job_id = enqueue_mail(email_conf["smtp"], [msg1, msg2])
+            return {"response": 200, "responseText": "Your request has been submitted.", "jobId": job_id}
+        except Exception as e:
+            logger.error(e)
+            return {"response": 500, "responseText": "Something went wrong"}
 
     except Exception as e:
         logger.error(e)
         return {"response": 500, "responseText": "List of operators are not available in the server."}
 
+
+@app.route('/api/job_status/<string:job_id>', methods=['GET'])
+def get_job_status(job_id):
+    status = mail_job_status(job_id)
+    if status is None:
+        return jsonify({"error": f"Unknown job {job_id}"}), 404
+    return jsonify(status)
+
 # if __name__ == "__main__":
 #    app.run(debug=True, host="0.0.0.0", port=5000)
@@ -0,0 +1,134 @@
+import io
+import json
+import base64
+import logging
+import binascii
+import mimetypes
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# decoded attachments stay in memory up to this size, larger ones spill to a private temp file
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+# base64 characters decoded per step, must be a multiple of 4
+DECODE_CHUNK_CHARS = 4 * 256 * 1024
+
+MIME_EXTENSIONS_PATH = './mime-types-extensions.json'
+DEFAULT_EXTENSION = '.bin'
+# types that say nothing about the content, the data is sniffed instead
+GENERIC_MIMETYPES = {'', 'application/octet-stream', 'application/unknown', 'binary/octet-stream'}
+# bytes read from the start of a decoded attachment for sniffing
+SNIFF_BYTES = 16
+# (offset, signature, mimetype)
+MAGIC_NUMBERS = (
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'II*\x00', 'image/tiff'),
+    (0, b'MM\x00*', 'image/tiff'),
+    (0, b'BM', 'image/bmp'),
+    (8, b'WEBP', 'image/webp'),
+    (0, b'%PDF-', 'application/pdf'),
+    (0, b'\x1f\x8b', 'application/x-gzip'),
+    (0, b'PK\x03\x04', 'application/zip'),
+)
+# containers of other formats (docx, xlsx, ...), they never override a declared type
+CONTAINER_MIMETYPES = {'application/zip'}
+
+
+class AttachmentError(ValueError):
+    pass
+
+
+def json_attachment(filename, data):
+    # (filename, file object) tuple, as accepted by requests' files= parameter
+    return filename, io.BytesIO(json.dumps(data).encode('utf-8'))
+
+
+def _load_extension_index(path=MIME_EXTENSIONS_PATH):
+    # mimetype -> extension; the first extension listed for a type wins, as before
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            extensions = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not load {path}, using the mimetypes module only: {e}")
+        return {}
+    index = {}
+    for extension, mimetype in extensions.items():
+        index.setdefault(mimetype.lower(), extension)
+    return index
+
+
+EXTENSION_INDEX = _load_extension_index()
+
+
+def data_uri_mimetype(data_uri):
+    # "data:image/png;base64,...." -> "image/png"
+    return data_uri.split(";", 1)[0].replace("data:", "", 1)
+
+
+def sniff_mimetype(head):
+    # mimetype recognised from the first bytes of a file, or None
+    for offset, signature, mimetype in MAGIC_NUMBERS:
+        if head[offset:offset + len(signature)] == signature:
+            return mimetype
+    return None
+
+
+def _known_extension(mimetype):
+    return EXTENSION_INDEX.get(mimetype) or mimetypes.guess_extension(mimetype)
+
+
+def attachment_extension(mimetype, head=b''):
+    """File extension for an attachment, e.g. ".png"; never fails.
+
+    The declared type is looked up in the prebuilt index, then in the
+    mimetypes module. Content recognised from `head` replaces a generic,
+    unknown or contradicting declared type.
+    """
+    mimetype = mimetype.strip().lower()
+    sniffed = sniff_mimetype(head)
+    if sniffed is not None and sniffed != mimetype:
+        if (mimetype in GENERIC_MIMETYPES or not _known_extension(mimetype)
+                or sniffed not in CONTAINER_MIMETYPES):
+            logger.info(f"Attachment declared as '{mimetype}' looks like '{sniffed}'")
+            mimetype = sniffed
+    return _known_extension(mimetype) or DEFAULT_EXTENSION
+
+
+def peek(fileobj, size=SNIFF_BYTES):
+    # first bytes of a seekable file, position left at the start
+    head = fileobj.read(size)
+    fileobj.seek(0)
+    return head
+
+
+def decode_data_uri(data_uri, spool_max_size=SPOOL_MAX_SIZE, chunk_chars=DECODE_CHUNK_CHARS):
+    """Decode the base64 payload of a data URI into a rewound SpooledTemporaryFile.
+
+    The payload is decoded in slices, so no second full-size copy of the
+    file is built in memory; beyond `spool_max_size` the bytes go to an
+    anonymous temp file owned by this request only.
+    """
+    header, sep, _ = data_uri.partition(",")
+    if not sep or ";base64" not in header:
+        raise AttachmentError("not a base64 data URI")
+    start = len(header) + 1
+    out = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+    # MIME-wrapped payloads contain line breaks: whitespace is dropped and the
+    # characters short of a 4-char quantum are carried into the next slice
+    carry = ""
+    try:
+        for offset in range(start, len(data_uri), chunk_chars):
+            piece = carry + "".join(data_uri[offset:offset + chunk_chars].split())
+            usable = len(piece) - len(piece) % 4
+            out.write(base64.b64decode(piece[:usable]))
+            carry = piece[usable:]
+        if carry:
+            out.write(base64.b64decode(carry))
+    except (binascii.Error, ValueError) as e:
+        out.close()
+        raise AttachmentError(f"invalid base64 payload: {e}")
+    out.seek(0)
+    return out
@@ -0,0 +1,588 @@
+"""Reproducible benchmark of the ingest pipeline and the read API.
+
+    python benchmark.py run --start-mariadb --rows 100000 --output before.json
+    python benchmark.py compare before.json after.json
+
+`run` generates synthetic records for schemas in ./schemas, sorts them
+(rawData -> data_sorted), bulk-ingests them into a throwaway MariaDB and
+drives the read endpoints under concurrent load. The report holds latency
+percentiles, throughput and peak RSS of every phase as JSON. The same
+--seed and --rows give the same records, so two runs differ only by code.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import base64
+import shutil
+import socket
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+from pathlib import Path
+from urllib.parse import quote
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent
+DEFAULT_SCHEMAS = ("plasma-mds", "all-types")
+DEFAULT_WORKDIR = Path("./bench-data")
+# records per data file directory, rawData/<table>/<shard>/
+SHARD_SIZE = 10000
+GENERATE_CHUNK = 2000
+# string values are made of these synthetic words, so search terms and filters hit
+VOCABULARY_SIZE = 4096
+_SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pla", "sma", "ion", "tor", "gen", "dus", "fer")
+RSS_INTERVAL = 0.2
+API_SCENARIOS = ("get_schemas", "data", "search", "left_join")
+MARIADB_IMAGE = "mariadb:10.8"
+
+
+# synthetic records
+
+def vocabulary(seed):
+    rng = random.Random(f"vocabulary:{seed}")
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _fake_string(rng, prop, words):
+    fmt = prop.get("format")
+    if fmt == "date":
+        return f"20{rng.randint(10, 29)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    if fmt == "date-time":
+        return f"20{rng.randint(10, 29)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00Z"
+    if fmt == "email":
+        return f"{rng.choice(words)}@{rng.choice(words)}.org"
+    if fmt in ("uri", "iri"):
+        return f"https://{rng.choice(words)}.org/{rng.choice(words)}"
+    if fmt == "uuid":
+        return "%08x-%04x-4%03x-a%03x-%012x" % (rng.getrandbits(32), rng.getrandbits(16), rng.getrandbits(12),
+                                                rng.getrandbits(12), rng.getrandbits(48))
+    if prop.get("contentEncoding") == "base64":
+        payload = bytes(rng.getrandbits(8) for _ in range(48))
+        return "data:application/octet-stream;base64," + base64.b64encode(payload).decode()
+    value = " ".join(rng.choice(words) for _ in range(rng.randint(1, 6)))
+    while len(value) < prop.get("minLength", 0):
+        value += " " + rng.choice(words)
+    if "maxLength" in prop:
+        value = value[:prop["maxLength"]]
+    return value
+
+
+def fake_value(rng, prop, words, depth=0):
+    """A random value valid for the JSON schema `prop` (the subset schemas here use)."""
+    if not isinstance(prop, dict):
+        return None
+    if prop.get("enum"):
+        return rng.choice(prop["enum"])
+    kind = prop.get("type", "string")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "string")
+    if kind == "object":
+        return {key: fake_value(rng, sub, words, depth + 1) for key, sub in prop.get("properties", {}).items()}
+    if kind == "array":
+        items = prop.get("items") or {"type": "string"}
+        low = prop.get("minItems", 0)
+        if depth > 3 and not low:
+            return []
+        return [fake_value(rng, items, words, depth + 1) for _ in range(rng.randint(low, max(low, prop.get("maxItems", 3))))]
+    if kind == "integer":
+        low = prop.get("minimum", 0)
+        return rng.randint(low, prop.get("maximum", low + 100000))
+    if kind == "number":
+        low = prop.get("minimum", 0.0)
+        return round(rng.uniform(low, prop.get("maximum", low + 1000.0)), 4)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return _fake_string(rng, prop, words)
+
+
+def record_identifier(table, index):
+    return f"{table}-{index:09d}"
+
+
+def fake_record(table, schema, index, seed, words):
+    # depends only on (seed, table, index), so chunking does not change the dataset
+    rng = random.Random(f"{seed}:{table}:{index}")
+    record = fake_value(rng, schema, words)
+    record["SchemaID"] = table
+    record["Identifier"] = record_identifier(table, index)
+    return record
+
+
+def _generate_chunk(table, schema, start, stop, raw_dir, seed):
+    words = vocabulary(seed)
+    for index in range(start, stop):
+        shard = Path(raw_dir) / table / f"{index // SHARD_SIZE:05d}"
+        shard.mkdir(parents=True, exist_ok=True)
+        with open(shard / f"{record_identifier(table, index)}.json", "w", encoding="utf-8") as f:
+            json.dump(fake_record(table, schema, index, seed, words), f)
+    return stop - start
+
+
+def load_schema(table):
+    with open(BACKEND_DIR / "schemas" / f"{table}.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _data_files(directory):
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith(".json"):
+                yield os.path.join(root, name)
+
+
+# measurement
+
+def _rss_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _process_tree(root):
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # the command name may hold spaces, the fields after it don't
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    tree, todo = [], [root]
+    while todo:
+        pid = todo.pop()
+        tree.append(pid)
+        todo.extend(children.get(pid, ()))
+    return tree
+
+
+class RssSampler:
+    """Peak resident memory of a process and all its descendants (Linux /proc)."""
+
+    def __init__(self, pid=None, interval=RSS_INTERVAL):
+        self.pid = pid or os.getpid()
+        self.interval = interval
+        self.peak = 0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            self.peak = max(self.peak, sum(_rss_bytes(pid) for pid in _process_tree(self.pid)))
+            if self._stopping.wait(self.interval):
+                return
+
+    def __enter__(self):
+        if os.path.isdir("/proc"):
+            self._thread = threading.Thread(target=self._run, name="rss", daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+        return False
+
+
+def percentile(sorted_values, pct):
+    # nearest-rank
+    if not sorted_values:
+        return None
+    rank = max(1, min(len(sorted_values), math.ceil(pct / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def latency_summary(latencies, elapsed):
+    latencies = sorted(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+
+# throwaway database
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mariadb(workdir, timeout=120):
+    # disposable container, removed on stop; returns (db config path, container name)
+    import pymysql
+    port = _free_port()
+    name = f"adamant-bench-{os.getpid()}"
+    subprocess.run(["docker", "run", "-d", "--rm", "--name", name, "-p", f"127.0.0.1:{port}:3306",
+                    "-e", "MARIADB_ROOT_PASSWORD=bench", "-e", "MARIADB_DATABASE=adamant_bench",
+                    MARIADB_IMAGE], check=True, stdout=subprocess.DEVNULL)
+    conf = {"DB_HOST": "127.0.0.1", "DB_PORT": port, "DB_USER": "root", "DB_PASSWORD": "bench",
+            "DB_NAME": "adamant_bench"}
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            pymysql.connect(host=conf["DB_HOST"], port=port, user="root", password="bench",
+                            database=conf["DB_NAME"]).close()
+            break
+        except pymysql.MySQLError:
+            if time.monotonic() > deadline:
+                stop_mariadb(name)
+                raise RuntimeError(f"MariaDB container {name} did not come up in {timeout}s")
+            time.sleep(1)
+    path = Path(workdir) / "db_config.json"
+    with open(path, "w") as f:
+        json.dump(conf, f)
+    logger.info(f"Started MariaDB in container {name} on port {port}")
+    return path, name
+
+
+def stop_mariadb(name):
+    subprocess.run(["docker", "stop", name], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+# phases
+
+def phase_generate(tables, args, raw_dir):
+    started = time.perf_counter()
+    with RssSampler() as rss, ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = []
+        for table in tables:
+            shutil.rmtree(Path(raw_dir) / table, ignore_errors=True)
+            schema = load_schema(table)
+            for start in range(0, args.rows, GENERATE_CHUNK):
+                futures.append(executor.submit(_generate_chunk, table, schema, start,
+                                               min(start + GENERATE_CHUNK, args.rows), str(raw_dir), args.seed))
+        records = sum(future.result() for future in futures)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Generated {records} records in {elapsed:.1f}s")
+    return {"records": records, "seconds": round(elapsed, 3), "peak_rss_bytes": rss.peak}
+
+
+def phase_sort(tables, args, raw_dir, sorted_dir):
+    import sorter
+    for table in tables:
+        shutil.rmtree(Path(sorted_dir) / table, ignore_errors=True)
+    started = time.perf_counter()
+    files = 0
+    with RssSampler() as rss:
+        for table in tables:
+            files += len(sorter.sort_files(_data_files(Path(raw_dir) / table), sorted_dir,
+                                           args.sort_link, args.sort_workers))
+    elapsed = time.perf_counter() - started
+    logger.info(f"Sorted {files} files in {elapsed:.1f}s")
+    return {"files": files, "seconds": round(elapsed, 3),
+            "files_per_second": round(files / elapsed, 1) if elapsed else None, "peak_rss_bytes": rss.peak}
+
+
+def phase_ingest(tables, args, sorted_dir):
+    from db_pool import get_pool
+    from ingest import Ingester
+    from pagination import quote_identifier
+    from schema_migration import migrate_table
+
+    # start from empty tables, rows are only upserted on unique keys
+    with get_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            for table in tables:
+                cursor.execute(f"DROP TABLE IF EXISTS {quote_identifier(table)}")
+        connection.commit()
+    for table in tables:
+        migrate_table(table, load_schema(table))
+
+    ingester = Ingester(workers=args.workers)
+    started = time.perf_counter()
+    rows = 0
+    with RssSampler() as rss, ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for table in tables:
+            paths = sorted(_data_files(Path(sorted_dir) / table))
+            rows += ingester.ingest_table(table, paths, executor)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Ingested {rows} rows in {elapsed:.1f}s")
+    return {"rows": rows, "seconds": round(elapsed, 3),
+            "rows_per_second": round(rows / elapsed, 1) if elapsed else None, "peak_rss_bytes": rss.peak}
+
+
+def _string_column(table):
+    # a string column of the table and the vocabulary it was filled from
+    from table_generator import DOCUMENT_LOCATION_COLUMN, table_spec
+    for column in table_spec(load_schema(table)).columns:
+        if column.sql_type.startswith(("VARCHAR", "TEXT")) and column.name not in (DOCUMENT_LOCATION_COLUMN, "SchemaID"):
+            return column.name
+    return None
+
+
+def _request_factory(scenario, tables, words, join):
+    # rng -> path of one request of `scenario`
+    if scenario == "get_schemas":
+        return lambda rng: "/api/get_schemas"
+    if scenario == "search":
+        return lambda rng: f"/api/search/{quote(rng.choice(words))}?limit=100"
+    if scenario == "data":
+        columns = {table: _string_column(table) for table in tables}
+
+        def data_path(rng):
+            table = rng.choice(tables)
+            path = f"/api/data/{quote(table)}?limit=100"
+            if columns[table]:
+                path += f"&filter={quote(columns[table])}~{quote(rng.choice(words))}"
+            return path
+        return data_path
+    if scenario == "left_join":
+        table1, column1, table2, column2 = join
+        path = (f"/api/left-join?table1={quote(table1)}&table2={quote(table2)}"
+                f"&column1={quote(column1)}&column2={quote(column2)}&limit=100")
+        return lambda rng: path
+    raise ValueError(f"Unknown scenario '{scenario}'")
+
+
+def run_scenario(base_url, make_path, concurrency, duration, seed):
+    latencies, statuses, cache_hits, sizes = [], {}, [0], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(worker):
+        rng = random.Random(f"{seed}:client:{worker}")
+        session = requests.Session()
+        local = []
+        while time.monotonic() < deadline:
+            path = make_path(rng)
+            started = time.perf_counter()
+            try:
+                response = session.get(base_url + path, timeout=300)
+                body = response.content
+                status = response.status_code
+            except requests.RequestException:
+                status, body, response = "error", b"", None
+            local.append(time.perf_counter() - started)
+            with lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                sizes[0] += len(body)
+                if response is not None and response.headers.get("X-Cache") == "HIT":
+                    cache_hits[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    result = latency_summary(latencies, elapsed)
+    result.update({
+        "statuses": statuses,
+        "errors": sum(count for status, count in statuses.items() if not status.startswith("2")),
+        "cache_hit_ratio": round(cache_hits[0] / len(latencies), 3) if latencies else None,
+        "mean_response_bytes": round(sizes[0] / len(latencies)) if latencies else None,
+    })
+    return result
+
+
+def start_server(args):
+    port = _free_port()
+    env = dict(os.environ, GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_WORKERS=str(args.server_workers),
+               ADAMANT_WORKER_CLASS=args.worker_class)
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api:app"],
+                               cwd=str(BACKEND_DIR), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API server exited with status {process.returncode}")
+        try:
+            requests.get(base_url + "/api/check_mode", timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("API server did not come up in 60s")
+
+
+def phase_api(tables, args):
+    words = vocabulary(args.seed)
+    join = None
+    if "left_join" in args.scenarios:
+        if args.join:
+            left, _, right = args.join.partition("=")
+            join = (*left.rsplit(".", 1), *right.rsplit(".", 1))
+        else:
+            # left join the first table onto the last on their first string columns
+            join = (tables[0], _string_column(tables[0]), tables[-1], _string_column(tables[-1]))
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process, base_url = start_server(args)
+    try:
+        results = {}
+        with RssSampler(process.pid if process else os.getpid()) as rss:
+            for scenario in args.scenarios:
+                make_path = _request_factory(scenario, tables, words, join)
+                # one warm-up round so pools and caches are in their steady state
+                run_scenario(base_url, make_path, args.concurrency, min(2.0, args.duration), args.seed + 1)
+                results[scenario] = run_scenario(base_url, make_path, args.concurrency, args.duration, args.seed)
+                logger.info(f"{scenario}: {results[scenario]['throughput_rps']} req/s, "
+                            f"p50 {results[scenario]['p50_ms']}ms, p99 {results[scenario]['p99_ms']}ms")
+        # the server's memory if it was started here, otherwise the load generator's
+        results["peak_rss_bytes"] = rss.peak
+        return results
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=str(BACKEND_DIR), capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    raw_dir, sorted_dir = workdir / "rawData", workdir / "data_sorted"
+    container = None
+    # set before db_pool is imported by the phases, and inherited by the API server
+    if args.start_mariadb:
+        db_config, container = start_mariadb(workdir)
+        os.environ["DB_CONFIG_PATH"] = str(db_config.resolve())
+    elif args.db_config:
+        os.environ["DB_CONFIG_PATH"] = str(Path(args.db_config).resolve())
+
+    report = {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "tables": args.tables,
+            "rows_per_table": args.rows,
+            "seed": args.seed,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "server_workers": args.server_workers,
+            "worker_class": args.worker_class,
+            "sort_link": args.sort_link,
+        },
+    }
+    try:
+        if "ingest" in args.phases:
+            from db_pool import load_db_config
+            db_name = load_db_config()["DB_NAME"]
+            if "bench" not in db_name and not args.allow_any_db:
+                raise SystemExit(f"Refusing to drop and reload tables in database '{db_name}': use --start-mariadb, "
+                                 "a database with 'bench' in its name, or --allow-any-db")
+        if "generate" in args.phases:
+            report["generate"] = phase_generate(args.tables, args, raw_dir)
+        if "sort" in args.phases:
+            report["sort"] = phase_sort(args.tables, args, raw_dir, sorted_dir)
+        if "ingest" in args.phases:
+            report["ingest"] = phase_ingest(args.tables, args, sorted_dir)
+        if "api" in args.phases:
+            report["api"] = phase_api(args.tables, args)
+    finally:
+        if container is not None:
+            stop_mariadb(container)
+    return report
+
+
+def _numbers(report, prefix=""):
+    # flattened numeric leaves, e.g. "api.search.p99_ms"
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _numbers(value, name + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and not name.startswith("meta."):
+            yield name, value
+
+
+def compare(old, new):
+    old_numbers, new_numbers = dict(_numbers(old)), dict(_numbers(new))
+    lines = [f"{'metric':<45} {'old':>14} {'new':>14} {'change':>9}"]
+    for name in sorted(set(old_numbers) | set(new_numbers)):
+        a, b = old_numbers.get(name), new_numbers.get(name)
+        change = f"{(b - a) / a * 100:+.1f}%" if a and b is not None else ""
+        lines.append(f"{name:<45} {'' if a is None else a:>14} {'' if b is None else b:>14} {change:>9}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and the read API on synthetic data")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="generate data, load it and measure")
+    run_parser.add_argument("--tables", nargs="+", default=list(DEFAULT_SCHEMAS), help="schemas in ./schemas to use")
+    run_parser.add_argument("--rows", type=int, default=10000, help="records per table")
+    run_parser.add_argument("--seed", type=int, default=1)
+    run_parser.add_argument("--workdir", default=str(DEFAULT_WORKDIR), help="generated rawData and data_sorted")
+    run_parser.add_argument("--phases", default="generate,sort,ingest,api",
+                            help="comma separated subset of generate,sort,ingest,api")
+    run_parser.add_argument("--workers", type=int, default=os.cpu_count(), help="generator and parser processes")
+    run_parser.add_argument("--sort-link", default="symlink", choices=["symlink", "hardlink", "copy"],
+                            help="how sorted entries refer to raw files")
+    run_parser.add_argument("--sort-workers", type=int, default=8, help="sorter threads")
+    run_parser.add_argument("--start-mariadb", action="store_true", help=f"run a disposable {MARIADB_IMAGE} container")
+    run_parser.add_argument("--db-config", help="db_config.json of an existing throwaway database")
+    run_parser.add_argument("--allow-any-db", action="store_true", help="allow a database without 'bench' in its name")
+    run_parser.add_argument("--url", help="benchmark this running API instead of starting one")
+    run_parser.add_argument("--server-workers", type=int, default=4)
+    run_parser.add_argument("--worker-class", default="sync", choices=["sync", "gevent"])
+    run_parser.add_argument("--scenarios", default=",".join(API_SCENARIOS),
+                            help=f"comma separated subset of {','.join(API_SCENARIOS)}")
+    run_parser.add_argument("--join", help="left join as table1.column1=table2.column2")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="concurrent API clients")
+    run_parser.add_argument("--duration", type=float, default=10.0, help="seconds per API scenario")
+    run_parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    compare_parser = commands.add_parser("compare", help="compare two reports")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.command == "compare":
+        with open(args.old) as f_old, open(args.new) as f_new:
+            print(compare(json.load(f_old), json.load(f_new)))
+        return 0
+
+    args.phases = [phase for phase in args.phases.split(",") if phase]
+    args.scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+    report = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+        logger.info(f"Report written to {args.output}")
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
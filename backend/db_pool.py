@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import pymysql
+import pymysql.cursors
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# DB_CONFIG_PATH points a process at another database, e.g. the benchmark's
+DB_CONFIG_PATH = os.environ.get("DB_CONFIG_PATH", os.path.join(os.path.dirname(__file__), 'conf', 'db_config.json'))
+
+# Pool defaults, can be overridden per deployment in conf/db_config.json
+# or by environment variables of the same name (which win)
+POOL_DEFAULTS = {
+    "POOL_SIZE": 10,            # max open connections per worker process
+    "POOL_TIMEOUT": 10,         # seconds to wait for a free connection
+    "POOL_IDLE_TIMEOUT": 300,   # close connections idle for longer than this
+    "POOL_MAX_LIFETIME": 3600,  # recycle connections older than this
+    "POOL_PING_INTERVAL": 30,   # ping connections idle for longer than this before reuse
+}
+
+# connection settings of the default conf/db_config.json that environment
+# variables of the same name override; a file given in DB_CONFIG_PATH is used as is
+CONNECTION_KEYS = ("DB_HOST", "DB_PORT", "DB_USER", "DB_PASSWORD", "DB_NAME")
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+def load_db_config(path=DB_CONFIG_PATH):
+    with open(path, 'r') as f:
+        conf = json.load(f)
+    # the deployment's .env and the compose files set these
+    for key in CONNECTION_KEYS:
+        if key in os.environ and "DB_CONFIG_PATH" not in os.environ:
+            conf[key] = int(os.environ[key]) if key == "DB_PORT" else os.environ[key]
+    return conf
+
+
+class _TimedCursorMixin:
+    # feeds the db_seconds histogram and the per-request DB totals; with the
+    # default buffered cursor the result set is transferred inside execute()
+    def execute(self, query, args=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, args)
+        finally:
+            metrics.record_db("query", time.perf_counter() - start)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        metrics.record_db("fetch", time.perf_counter() - start, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(size)
+        metrics.record_db("fetch", time.perf_counter() - start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        metrics.record_db("fetch", time.perf_counter() - start, len(rows))
+        return rows
+
+
+class TimedCursor(_TimedCursorMixin, pymysql.cursors.Cursor):
+    pass
+
+
+class TimedSSCursor(_TimedCursorMixin, pymysql.cursors.SSCursor):
+    """Unbuffered cursor, rows are read off the server as they are fetched."""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """Bounded, thread-safe pool of pymysql connections.
+
+    Idle connections are kept in a LIFO stack so the hot ones get reused and
+    the cold ones age out through the idle timeout.
+    """
+
+    def __init__(self, connect_kwargs, max_size=10, timeout=10, idle_timeout=300,
+                 max_lifetime=3600, ping_interval=30):
+        self.connect_kwargs = connect_kwargs
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.ping_interval = ping_interval
+        self._idle = deque()
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    @property
+    def size(self):
+        return self._size
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def _open(self):
+        start = time.perf_counter()
+        conn = pymysql.connect(cursorclass=TimedCursor, **self.connect_kwargs)
+        elapsed = time.perf_counter() - start
+        metrics.record_db("connect", elapsed)
+        logger.debug(f"New DB connection in {elapsed * 1000:.1f}ms")
+        return _PooledConnection(conn)
+
+    def _close(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+
+    def _expired(self, entry, now):
+        return now - entry.created_at > self.max_lifetime
+
+    def _evict_idle_locked(self, now):
+        # oldest idle connections sit at the left end of the deque
+        while self._idle and (now - self._idle[0].last_used > self.idle_timeout
+                              or self._expired(self._idle[0], now)):
+            entry = self._idle.popleft()
+            self._size -= 1
+            self._close(entry)
+
+    def _healthy(self, entry, now):
+        if self._expired(entry, now):
+            return False
+        if now - entry.last_used > self.ping_interval:
+            try:
+                entry.conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            entry = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolExhaustedError("connection pool is closed")
+                    now = time.monotonic()
+                    self._evict_idle_locked(now)
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        # reserve a slot, the connection is opened outside the lock
+                        self._size += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise PoolExhaustedError(
+                            f"no free DB connection after {self.timeout}s (pool size {self.max_size})")
+                    self._cond.wait(remaining)
+
+            if entry is None:
+                try:
+                    return self._open()
+                except Exception:
+                    self._discard_slot()
+                    raise
+
+            if self._healthy(entry, time.monotonic()):
+                return entry
+            # stale connection, drop it and try again
+            self._close(entry)
+            self._discard_slot()
+
+    def _discard_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def release(self, entry, discard=False):
+        if not discard:
+            try:
+                # never hand over an open transaction to the next user
+                entry.conn.rollback()
+            except Exception:
+                discard = True
+        if discard or self._closed:
+            self._close(entry)
+            self._discard_slot()
+            return
+        entry.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        entry = self.acquire()
+        discard = False
+        try:
+            yield entry.conn
+        except (pymysql.err.OperationalError, pymysql.err.InterfaceError):
+            # the connection itself may be broken, don't put it back
+            discard = True
+            raise
+        finally:
+            self.release(entry, discard=discard)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._close(self._idle.pop())
+                self._size -= 1
+            self._cond.notify_all()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # one pool per process: a pool inherited through fork (gunicorn --preload)
+    # shares sockets with the parent and must not be reused
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            conf = load_db_config()
+            settings = {key: type(default)(os.environ.get(key, conf.get(key, default)))
+                        for key, default in POOL_DEFAULTS.items()}
+            _pool = ConnectionPool(
+                connect_kwargs=dict(
+                    host=conf['DB_HOST'],
+                    port=conf['DB_PORT'],
+                    user=conf['DB_USER'],
+                    password=conf['DB_PASSWORD'],
+                    database=conf['DB_NAME'],
+                ),
+                max_size=settings["POOL_SIZE"],
+                timeout=settings["POOL_TIMEOUT"],
+                idle_timeout=settings["POOL_IDLE_TIMEOUT"],
+                max_lifetime=settings["POOL_MAX_LIFETIME"],
+                ping_interval=settings["POOL_PING_INTERVAL"],
+            )
+            _pool_pid = pid
+    return _pool
+
+
+@atexit.register
+def _close_pool():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
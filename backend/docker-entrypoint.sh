@@ -0,0 +1,16 @@
+#!/bin/bash
+
+# Runs the job request mail worker next to the container's command (gunicorn
+# by default); the API only queues the e-mails. Set MAIL_WORKERS=0 where the
+# worker runs in a container of its own, as in docker-compose.machine1.yml.
+if [ "${MAIL_WORKERS:-1}" -gt 0 ]; then
+    (
+        while true; do
+            python mail_queue.py --workers "${MAIL_WORKERS:-1}"
+            echo "mail worker exited with status $?, restarting in 5s" >&2
+            sleep 5
+        done
+    ) &
+fi
+
+exec "$@"
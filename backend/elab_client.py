@@ -0,0 +1,135 @@
+import os
+import time
+import logging
+import threading
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import elabapy
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# concurrent eLabFTW calls per worker process
+UPLOAD_WORKERS = 8
+REQUEST_TIMEOUT = (10, 300)  # connect, read
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5  # seconds, doubled on every attempt
+# the request did not reach eLabFTW's application, so it is safe to repeat
+RETRY_STATUSES = (502, 503)
+# repeating these has the same effect as sending them once; a repeated POST or
+# PATCH that eLabFTW had already processed would add a second upload or tag
+IDEMPOTENT_VERBS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+_sessions = {}
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def elab_endpoint(elabURL):
+    elabURL = '{}/api/v1/'.format(elabURL)
+    return elabURL.replace('//api', '/api')
+
+
+def get_session(endpoint, token):
+    # one keep-alive session per eLabFTW endpoint and token, shared by all requests of this worker
+    key = (os.getpid(), endpoint, token)
+    session = _sessions.get(key)
+    if session is None:
+        with _lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=UPLOAD_WORKERS)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'Authorization': token})
+                _sessions[key] = session
+    return session
+
+
+def get_executor():
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='elab')
+                _executor_pid = pid
+    return _executor
+
+
+def _not_sent(error):
+    # the connection could not be opened, so nothing of the request went out
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0] if error.args else None, 'reason', None)
+    return isinstance(reason, NewConnectionError)
+
+
+def _rewind(files):
+    # a retried upload must send the file from the start again
+    for value in files.values():
+        fileobj = value[1] if isinstance(value, tuple) else value
+        if hasattr(fileobj, 'seek'):
+            fileobj.seek(0)
+
+
+class PooledManager(elabapy.Manager):
+    """elabapy.Manager whose requests go through a pooled keep-alive session, with retries."""
+
+    def send_req(self, url, params={}, verb='GET', binary=False, param_name='data'):
+        session = get_session(self.endpoint, self.token)
+        url = urljoin(self.endpoint, url)
+        kwargs = {param_name: params, 'verify': self.verify, 'proxies': self.proxies,
+                  'timeout': REQUEST_TIMEOUT}
+        idempotent = verb.upper() in IDEMPOTENT_VERBS
+        for attempt in range(MAX_RETRIES + 1):
+            if param_name == 'files' and attempt:
+                _rewind(params)
+            try:
+                with metrics.timer("elab_request_duration_seconds", method=verb):
+                    req = session.request(verb, url, **kwargs)
+            except requests.ConnectionError as e:
+                if attempt == MAX_RETRIES or not (idempotent or _not_sent(e)):
+                    raise
+                logger.warning(f'eLabFTW {verb} {url} failed ({e}), retrying')
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+                continue
+            if req.status_code in RETRY_STATUSES and idempotent and attempt < MAX_RETRIES:
+                logger.warning(f'eLabFTW {verb} {url} returned {req.status_code}, retrying')
+                time.sleep(RETRY_BACKOFF * 2 ** attempt)
+                continue
+            break
+
+        if not req.ok:
+            req.raise_for_status()
+        # 204 No Content
+        if req.status_code == 204:
+            return True
+        if binary:
+            return req.content
+        return req.json()
+
+
+def elab_manager(elabURL, token):
+    return PooledManager(endpoint=elab_endpoint(elabURL), token=token)
+
+
+def run_concurrently(calls):
+    """Run independent (function, *args) calls on the shared executor.
+
+    Waits for all of them, so buffers passed in can be closed afterwards,
+    and re-raises the first failure. Returns the results in call order.
+    """
+    futures = [get_executor().submit(call[0], *call[1:]) for call in calls]
+    wait(futures)
+    for future in futures:
+        if future.exception() is not None:
+            raise future.exception()
+    return [future.result() for future in futures]
@@ -0,0 +1,62 @@
+from collections import namedtuple
+
+# conf entries whose values name form keys we need to read
+KEYWORD_FIELDS = ("requesterEmailKeyword", "operatorNameKeyword", "requesterNameKeyword")
+
+FormFields = namedtuple("FormFields", ["values", "attachments"])
+
+
+def conf_keywords(conf):
+    # every form key any job request configuration asks for
+    keywords = set()
+    for element in (conf or {}).get("confList", []):
+        for field in KEYWORD_FIELDS:
+            if isinstance(element.get(field), str):
+                keywords.add(element[field])
+    return keywords
+
+
+def is_base64_data_uri(value):
+    return value.startswith("data:") and "base64" in value
+
+
+class FormExtractor:
+    """Collects keyword values and base64 data URIs from submitted form data in one pass.
+
+    The walk is iterative, so depth is not limited by the recursion limit,
+    and every node is visited once however many keywords are wanted.
+    Keyword values are taken from nested objects but not from array
+    entries; if a key occurs more than once the last one in document order
+    wins. Data URIs are found anywhere and reported under their own key,
+    suffixed with the index of each enclosing array entry ("files_0",
+    "files_1", ...); a key repeated elsewhere is numbered too, so the
+    attachment names derived from it stay unique.
+    """
+
+    def __init__(self, keywords=()):
+        self.keywords = frozenset(keywords)
+
+    def extract(self, data):
+        values = {}
+        attachments = []
+        names = set()
+        # (key, value, array index suffix); children are pushed reversed to keep document order
+        stack = [(None, data, "")]
+        while stack:
+            key, value, suffix = stack.pop()
+            if key in self.keywords and not suffix:
+                values[key] = value
+            if isinstance(value, dict):
+                stack.extend((k, v, suffix) for k, v in reversed(list(value.items())))
+            elif isinstance(value, list):
+                stack.extend((key, v, f"{suffix}_{i}") for i, v in reversed(list(enumerate(value))))
+            elif isinstance(value, str) and key is not None and is_base64_data_uri(value):
+                base = name = key + suffix
+                # the same key in different objects
+                n = 0
+                while name in names:
+                    n += 1
+                    name = f"{base}_{n}"
+                names.add(name)
+                attachments.append({"key": name, "data": value})
+        return FormFields(values, attachments)
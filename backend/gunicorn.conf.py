@@ -0,0 +1,26 @@
+# gunicorn settings for api:app, start with: gunicorn -c gunicorn.conf.py api:app
+#
+# ADAMANT_WORKER_CLASS=gevent switches to the async serving mode: gevent patches
+# sockets, so pymysql, requests (eLabFTW) and smtplib yield while they wait on
+# the network and one worker keeps many requests in flight. The routes and
+# their behaviour are the same Flask app in both modes.
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 4))
+worker_class = os.environ.get("ADAMANT_WORKER_CLASS", "sync")
+# concurrent requests per gevent worker
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 500))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+# the app is imported in each worker after gevent patched it; the DB pool is per process anyway
+preload_app = False
+# MariaDB connections all workers together may open. The server allows 151
+# (max_connections) by default; the rest is left to the ingester, watchers,
+# mail worker and admin sessions. Raise both together.
+db_connection_budget = int(os.environ.get("DB_CONNECTION_BUDGET", 100))
+
+if worker_class == "gevent":
+    # requests in flight wait for a pooled MariaDB connection, so allow more of
+    # them, as many as each worker's share of the budget
+    os.environ.setdefault("POOL_SIZE", str(max(1, db_connection_budget // workers)))
+    os.environ.setdefault("POOL_TIMEOUT", "30")
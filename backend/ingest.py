@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import logging
+import argparse
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import registry
+import validation
+from db_pool import get_pool
+from manifest import Manifest
+from pagination import quote_identifier
+from response_cache import bump_table_versions
+from sorter import document_location
+from table_generator import DOCUMENT_LOCATION_COLUMN, load_table_spec
+
+logger = logging.getLogger(__name__)
+
+DATA_SORTED_DIR = Path('./data_sorted')
+BATCH_SIZE = 500
+# files handed to a pool worker at once
+PARSE_CHUNK_SIZE = 64
+# column matched against the file name when a record is deleted
+IDENTIFIER_COLUMN = "Identifier"
+# SHOW COLUMNS "Extra" values of columns that cannot be inserted into
+SKIPPED_EXTRA = ("AUTO_INCREMENT", "GENERATED")
+
+
+def flatten_record(data, leaves=None):
+    # leaf values keyed by their own name, like extract_properties() names the columns
+    if leaves is None:
+        leaves = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flatten_record(value, leaves)
+        else:
+            leaves[key] = value
+    return leaves
+
+
+def _sql_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+def _value_at(data, key_path):
+    for key in key_path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def read_row(path, columns, key_paths=None, table=None):
+    """Parse one JSON record into a row tuple for `columns`, or None if unreadable.
+
+    A column with a key path in `key_paths` (as laid out by table_generator)
+    is read from that path. Otherwise top-level keys are used as they are
+    and other columns are looked up among the leaves of the document.
+    With `table`, the record is first validated against the schema of that
+    name and quarantined instead if it does not match.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Skipping {path}: {e}")
+        return None
+    if not isinstance(data, dict):
+        logger.warning(f"Skipping {path}: not a JSON object")
+        return None
+    if table is not None:
+        error = validation.validate(registry.validators.get().get(table), data, path)
+        if error is not None:
+            validation.quarantine(path, table, error)
+            return None
+        validation.release(path, table)
+    if DOCUMENT_LOCATION_COLUMN in columns and DOCUMENT_LOCATION_COLUMN not in data:
+        # sorted entries link to the raw file instead of carrying the path inside
+        data[DOCUMENT_LOCATION_COLUMN] = document_location(path)
+    leaves = None
+    row = []
+    for i, column in enumerate(columns):
+        if key_paths and key_paths[i]:
+            value = _value_at(data, key_paths[i])
+        elif column in data:
+            value = data[column]
+        else:
+            if leaves is None:
+                leaves = flatten_record(data)
+            value = leaves.get(column)
+        row.append(_sql_value(value))
+    return tuple(row)
+
+
+def upsert_query(table, columns):
+    cols = ", ".join(quote_identifier(col) for col in columns)
+    placeholders = ", ".join(["%s"] * len(columns))
+    updates = ", ".join(f"{quote_identifier(col)}=VALUES({quote_identifier(col)})" for col in columns)
+    # pymysql rewrites executemany() of this statement into multi-row INSERTs
+    return (f"INSERT INTO {quote_identifier(table)} ({cols}) VALUES ({placeholders}) "
+            f"ON DUPLICATE KEY UPDATE {updates}")
+
+
+class Ingester:
+    """Loads sorted JSON records (data_sorted/<schema_id>/<identifier>.json) into MariaDB.
+
+    Files are parsed in a process pool and written with batched, parameterized
+    INSERT ... ON DUPLICATE KEY UPDATE statements, one transaction per batch.
+    """
+
+    def __init__(self, pool=None, batch_size=BATCH_SIZE, workers=None):
+        self.pool = pool or get_pool()
+        self.batch_size = batch_size
+        self.workers = workers
+        self._columns = {}
+        self._key_paths = {}
+
+    def columns(self, table):
+        # writable column names of `table`, cached; None if the table does not exist
+        if table not in self._columns:
+            with self.pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute("SHOW TABLES LIKE %s", (table,))
+                    if cursor.fetchone() is None:
+                        return None
+                    cursor.execute(f"SHOW COLUMNS FROM {quote_identifier(table)}")
+                    # the auto-increment key and generated columns are filled in by MariaDB
+                    self._columns[table] = [row[0] for row in cursor.fetchall()
+                                            if not any(word in row[5].upper() for word in SKIPPED_EXTRA)]
+        return self._columns[table]
+
+    def key_paths(self, table):
+        # document key path of every column, from the table's schema; None where unknown
+        if table not in self._key_paths:
+            spec = load_table_spec(table)
+            by_name = {column.name: column.path for column in spec.columns} if spec else {}
+            self._key_paths[table] = tuple(by_name.get(column) for column in self.columns(table) or ())
+        return self._key_paths[table]
+
+    def forget_table(self, table=None):
+        # drop cached column lists after a schema change
+        if table is None:
+            self._columns.clear()
+            self._key_paths.clear()
+        else:
+            self._columns.pop(table, None)
+            self._key_paths.pop(table, None)
+
+    def _write_batches(self, table, columns, rows):
+        query = upsert_query(table, columns)
+        written = 0
+        batch = []
+        with self.pool.connection() as connection:
+            for row in rows:
+                if row is None:
+                    continue
+                batch.append(row)
+                if len(batch) >= self.batch_size:
+                    written += self._flush(connection, table, query, batch)
+                    batch = []
+            if batch:
+                written += self._flush(connection, table, query, batch)
+        return written
+
+    def _flush(self, connection, table, query, batch):
+        try:
+            with connection.cursor() as cursor:
+                cursor.executemany(query, batch)
+                # cached API responses of this table are stale from this commit on
+                bump_table_versions(cursor, [table])
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        return len(batch)
+
+    def ingest_table(self, table, paths, executor=None):
+        columns = self.columns(table)
+        if not columns:
+            logger.warning(f"Table '{table}' not found in database or has no columns, skipping {len(paths)} files")
+            return 0
+        # records are validated in the parser processes, a chunk of files at a time
+        parse = partial(read_row, columns=tuple(columns), key_paths=self.key_paths(table), table=table)
+        if executor is None or len(paths) < PARSE_CHUNK_SIZE:
+            rows = map(parse, paths)
+        else:
+            rows = executor.map(parse, paths, chunksize=PARSE_CHUNK_SIZE)
+        written = self._write_batches(table, columns, rows)
+        logger.info(f"Upserted {written} records into '{table}'")
+        return written
+
+    def ingest_files(self, paths, executor=None):
+        # the parent directory of every file names its table
+        by_table = {}
+        for path in paths:
+            path = Path(path)
+            by_table.setdefault(path.parent.name, []).append(path)
+        return sum(self.ingest_table(table, table_paths, executor)
+                   for table, table_paths in by_table.items())
+
+    def delete_files(self, paths):
+        by_table = {}
+        for path in paths:
+            path = Path(path)
+            by_table.setdefault(path.parent.name, []).append(path.stem)
+        deleted = 0
+        for table, identifiers in by_table.items():
+            columns = self.columns(table)
+            if not columns or IDENTIFIER_COLUMN.lower() not in (col.lower() for col in columns):
+                logger.warning(f"Table '{table}' has no {IDENTIFIER_COLUMN} column, cannot delete {len(identifiers)} records")
+                continue
+            with self.pool.connection() as connection:
+                with connection.cursor() as cursor:
+                    for start in range(0, len(identifiers), self.batch_size):
+                        chunk = identifiers[start:start + self.batch_size]
+                        cursor.execute(
+                            f"DELETE FROM {quote_identifier(table)} WHERE {quote_identifier(IDENTIFIER_COLUMN)} "
+                            f"IN ({', '.join(['%s'] * len(chunk))})", chunk)
+                        deleted += cursor.rowcount
+                    bump_table_versions(cursor, [table])
+                connection.commit()
+        return deleted
+
+    def ingest_directory(self, data_dir=DATA_SORTED_DIR):
+        data_dir = Path(data_dir)
+        total = 0
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for table_dir in sorted(p for p in data_dir.iterdir() if p.is_dir()):
+                paths = sorted(table_dir.glob('*.json'))
+                if paths:
+                    total += self.ingest_table(table_dir.name, paths, executor)
+        return total
+
+    def sync_directory(self, data_dir, manifest):
+        """Apply only what changed in `data_dir` since the last run recorded in `manifest`."""
+        data_dir = Path(data_dir).resolve()
+        changed, deleted = manifest.diff(data_dir)
+        logger.info(f"{len(changed)} new or changed, {len(deleted)} deleted files since last run")
+        if deleted:
+            self.delete_files(deleted)
+            manifest.forget(deleted)
+        total = 0
+        if changed:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                by_table = {}
+                for path in changed:
+                    by_table.setdefault(Path(path).parent.name, []).append(path)
+                for table, paths in sorted(by_table.items()):
+                    total += self.ingest_table(table, paths, executor)
+                    # files of a missing table stay unrecorded, so they load once it exists,
+                    # and so do quarantined ones, so they load once they or their schema are fixed
+                    if self.columns(table):
+                        manifest.record([path for path in paths if not validation.is_quarantined(path, table)])
+        return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk load data_sorted/<schema_id>/*.json into MariaDB")
+    parser.add_argument("data_dir", nargs="?", default=str(DATA_SORTED_DIR))
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="parser processes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="rows per INSERT transaction")
+    parser.add_argument("--manifest", help="only load files changed since the run recorded in this SQLite manifest")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    ingester = Ingester(batch_size=args.batch_size, workers=args.workers)
+    if args.manifest:
+        total = ingester.sync_directory(args.data_dir, Manifest(args.manifest))
+    else:
+        total = ingester.ingest_directory(args.data_dir)
+    logger.info(f"Initial insertion complete: {total} records")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import logging
+
+from json_encoding import parse_shape, shape_rows
+from pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, PaginationError, cursor_offset, decode_cursor,
+                        encode_cursor, quote_identifier, seek_clause, table_indexes)
+
+logger = logging.getLogger(__name__)
+
+# fields of the right-hand table are suffixed to avoid clashing with the left one
+JOIN_SUFFIX = "_condition"
+# TEXT/BLOB columns can only be indexed on a prefix
+INDEX_PREFIX_LENGTH = 255
+
+# query parameters that switch /api/left-join into paged mode
+JOIN_PAGE_PARAMS = {"limit", "cursor"}
+
+# (table, column) pairs known to lead an index, per worker process
+_indexed_join_columns = set()
+
+
+class JoinError(ValueError):
+    pass
+
+
+def _describe(cursor, table):
+    cursor.execute(f"DESCRIBE {quote_identifier(table)}")
+    return {row[0]: row[1].lower() for row in cursor.fetchall()}
+
+
+def ensure_join_index(cursor, table, column, column_type):
+    """Make sure `column` leads an index of `table`, adding one online if needed."""
+    if (table, column) in _indexed_join_columns:
+        return
+    _, indexed = table_indexes(cursor, table)
+    if column not in indexed:
+        index_name = f"ix_join_{column}"[:64]
+        key = quote_identifier(column)
+        if "text" in column_type or "blob" in column_type:
+            key += f"({INDEX_PREFIX_LENGTH})"
+        # InnoDB builds secondary indexes in place and picks the least restrictive lock
+        query = f"ALTER TABLE {quote_identifier(table)} ADD INDEX {quote_identifier(index_name)} ({key})"
+        logger.info(f'DB QUERY: {query}')
+        cursor.execute(query)
+    _indexed_join_columns.add((table, column))
+
+
+def _projection(raw, available, table):
+    if not raw:
+        return list(available)
+    columns = [col for col in raw.split(",") if col]
+    unknown = [col for col in columns if col not in available]
+    if unknown:
+        raise JoinError(f"Unknown columns in {table}: {', '.join(unknown)}")
+    return columns
+
+
+def _plan(cursor, table1, table2, column1, column2, args):
+    types_a = _describe(cursor, table1)
+    types_b = _describe(cursor, table2)
+    if column1 not in types_a:
+        raise JoinError(f"Unknown column '{column1}' in {table1}")
+    if column2 not in types_b:
+        raise JoinError(f"Unknown column '{column2}' in {table2}")
+
+    columns_a = _projection(args.get("columns1"), types_a, table1)
+    columns_b = [col for col in _projection(args.get("columns2"), types_b, table2) if col != column2]
+
+    # the lookup side needs the index; the left side only for ordering
+    ensure_join_index(cursor, table2, column2, types_b[column2])
+    ensure_join_index(cursor, table1, column1, types_a[column1])
+    return columns_a, columns_b, list(types_a)
+
+
+def _select_list(columns_a, columns_b):
+    select = [f"a.{quote_identifier(col)}" for col in columns_a]
+    select += [f"b.{quote_identifier(col)} AS {quote_identifier(col + JOIN_SUFFIX)}" for col in columns_b]
+    return ", ".join(select), columns_a + [col + JOIN_SUFFIX for col in columns_b]
+
+
+def _join_sql(select, left_source, table2, column1, column2):
+    return (f"SELECT {select} FROM {left_source} a "
+            f"LEFT JOIN {quote_identifier(table2)} b "
+            f"ON a.{quote_identifier(column1)} = b.{quote_identifier(column2)}")
+
+
+def join_query(cursor, table1, table2, column1, column2, args):
+    """SQL for the complete LEFT JOIN, returned as (query, params, output columns)."""
+    columns_a, columns_b, _ = _plan(cursor, table1, table2, column1, column2, args)
+    select, output_columns = _select_list(columns_a, columns_b)
+    query = _join_sql(select, quote_identifier(table1), table2, column1, column2)
+    return query, (), output_columns
+
+
+def join_page(cursor, table1, table2, column1, column2, args):
+    """One page of the LEFT JOIN of `table1` and `table2`.
+
+    A page holds `limit` rows of table1 together with all of their matches in
+    table2, so one-to-many groups are never split across pages. Pages of
+    table1 are addressed by a keyset cursor on its primary key, or by offset
+    when it has none.
+    """
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise PaginationError("limit must be an integer")
+    if limit < 1:
+        raise PaginationError("limit must be positive")
+    limit = min(limit, MAX_PAGE_SIZE)
+    cursor_token = args.get("cursor")
+    position = decode_cursor(cursor_token) if cursor_token else None
+
+    columns_a, columns_b, all_columns_a = _plan(cursor, table1, table2, column1, column2, args)
+    primary_key, _ = table_indexes(cursor, table1)
+    # the cursor is built from the primary key, so it is always selected
+    columns_a = [col for col in primary_key if col not in columns_a] + columns_a
+    select, output_columns = _select_list(columns_a, columns_b)
+
+    left = quote_identifier(table1)
+    if primary_key:
+        order_sql = ", ".join(quote_identifier(col) for col in primary_key)
+        where_sql, params = "", []
+        if position is not None:
+            last_key = position.get("k")
+            if not isinstance(last_key, list) or len(last_key) != len(primary_key):
+                raise PaginationError("Invalid cursor")
+            seek_sql, params = seek_clause(primary_key, last_key, False)
+            where_sql = f" WHERE {seek_sql}"
+        left_source = f"(SELECT * FROM {left}{where_sql} ORDER BY {order_sql} LIMIT %s)"
+        params = params + [limit]
+        outer_order = ", ".join(f"a.{quote_identifier(col)}" for col in primary_key)
+    else:
+        offset = cursor_offset(position)
+        # column1 alone is not unique: every other column breaks its ties, so
+        # the order is the same on every request and pages neither overlap nor skip
+        order_columns = [column1] + [col for col in all_columns_a if col != column1]
+        order_sql = ", ".join(quote_identifier(col) for col in order_columns)
+        left_source = f"(SELECT * FROM {left} ORDER BY {order_sql} LIMIT %s OFFSET %s)"
+        params = [limit, offset]
+        outer_order = ", ".join(f"a.{quote_identifier(col)}" for col in order_columns)
+
+    query = _join_sql(select, left_source, table2, column1, column2) + f" ORDER BY {outer_order}"
+    logger.debug(f'DB QUERY: {query}')
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+
+    next_cursor = None
+    if rows:
+        if primary_key:
+            last = dict(zip(output_columns, rows[-1]))
+            last_key = [last[col] for col in primary_key]
+            seek_sql, seek_params = seek_clause(primary_key, last_key, False)
+            cursor.execute(f"SELECT 1 FROM {left} WHERE {seek_sql} LIMIT 1", seek_params)
+            if cursor.fetchone() is not None:
+                next_cursor = encode_cursor({"k": last_key})
+        else:
+            cursor.execute(f"SELECT 1 FROM {left} LIMIT 1 OFFSET %s", (offset + limit,))
+            if cursor.fetchone() is not None:
+                next_cursor = encode_cursor({"o": offset + limit})
+
+    result = {"columns": output_columns}
+    result.update(shape_rows(output_columns, rows, parse_shape(args)))
+    result.update({
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+        "limit": limit,
+    })
+    return result
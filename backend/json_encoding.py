@@ -0,0 +1,110 @@
+import os
+import json
+import base64
+import decimal
+import datetime
+import logging
+
+from flask import Response
+from werkzeug.http import http_date
+
+# orjson is optional, the stdlib encoder is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# ?shape= of row data: a dict per row, or one column header plus row arrays.
+# Records are encoded exactly as Flask's jsonify did, columnar with the fast encoder
+RECORDS = "records"
+COLUMNAR = "columnar"
+SHAPES = (RECORDS, COLUMNAR)
+
+
+class ShapeError(ValueError):
+    pass
+
+
+def parse_shape(args):
+    shape = args.get("shape") or RECORDS
+    if shape not in SHAPES:
+        raise ShapeError(f"Unsupported shape '{shape}', use one of: {', '.join(SHAPES)}")
+    return shape
+
+
+def shape_rows(columns, rows, shape):
+    # {"data": [{col: value}, ...]} or {"rows": [[value, ...], ...]} to merge into a response
+    if shape == COLUMNAR:
+        return {"rows": rows}
+    return {"data": [dict(zip(columns, row)) for row in rows]}
+
+
+def _default(value):
+    # types pymysql returns that JSON has no native form for
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (bytes, bytearray)):
+        try:
+            return value.decode("utf-8")
+        except UnicodeDecodeError:
+            return base64.b64encode(value).decode("ascii")
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        # TIME columns
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        # SET columns
+        return sorted(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _flask_default(value):
+    # as Flask's jsonify: RFC 822 dates and Decimal as a string
+    if isinstance(value, datetime.date):
+        return http_date(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return _default(value)
+
+
+def flask_dumps(payload):
+    # byte for byte what jsonify sends: sorted keys, ASCII only, compact, trailing newline
+    return (json.dumps(payload, default=_flask_default, sort_keys=True, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def _stdlib_dumps(payload):
+    return json.dumps(payload, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def _orjson_dumps(payload):
+    # dates, datetimes and tuples are handled natively, the rest goes through _default
+    return orjson.dumps(payload, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+ENCODERS = {"json": _stdlib_dumps}
+if orjson is not None:
+    ENCODERS["orjson"] = _orjson_dumps
+
+JSON_ENCODER = os.environ.get("JSON_ENCODER", "orjson" if orjson is not None else "json")
+if JSON_ENCODER not in ENCODERS:
+    logger.warning(f"JSON encoder '{JSON_ENCODER}' is not available, using the stdlib encoder")
+    JSON_ENCODER = "json"
+dumps = ENCODERS[JSON_ENCODER]
+
+
+def register_encoder(name, encode):
+    # encode(payload) -> bytes; selected with JSON_ENCODER=<name>
+    global dumps
+    ENCODERS[name] = encode
+    if name == JSON_ENCODER:
+        dumps = encode
+
+
+def json_response(payload, status=200, shape=RECORDS):
+    # the default shape keeps the wire format clients already parse; the fast
+    # encoder and its ISO 8601 dates come with the opt-in columnar shape
+    encode = dumps if shape == COLUMNAR else flask_dumps
+    return Response(encode(payload), status=status, mimetype="application/json")
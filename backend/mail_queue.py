@@ -0,0 +1,308 @@
+import os
+import sys
+import time
+import uuid
+import email
+import socket
+import sqlite3
+import smtplib
+import logging
+import argparse
+import multiprocessing
+from email import policy
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+MAIL_QUEUE_PATH = os.environ.get("MAIL_QUEUE_PATH", "./mail-queue.sqlite")
+
+MAX_ATTEMPTS = 6
+RETRY_BACKOFF = 30  # seconds, doubled on every attempt
+# messages claimed by a worker that died are handed out again after this many seconds
+CLAIM_TIMEOUT = 600
+# messages sent over one SMTP connection per round
+BATCH_SIZE = 50
+POLL_INTERVAL = 1.0
+# a worker records that it is alive at most this often
+HEARTBEAT_INTERVAL = 10
+# job_status warns when no worker has been alive for this long
+WORKER_STALE_SECONDS = 60
+# pooled SMTP connections unused for this long are closed
+SMTP_IDLE_TIMEOUT = 60
+SMTP_TIMEOUT = 30
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def _connect(path=MAIL_QUEUE_PATH):
+    db = sqlite3.connect(path, timeout=30, isolation_level=None)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS messages ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+        " job_id TEXT NOT NULL,"
+        " smtp TEXT NOT NULL,"
+        " payload BLOB NOT NULL,"
+        " status TEXT NOT NULL,"
+        " attempts INTEGER NOT NULL DEFAULT 0,"
+        " next_attempt REAL NOT NULL,"
+        " claimed_at REAL,"
+        " created REAL NOT NULL,"
+        " last_error TEXT)")
+    db.execute("CREATE INDEX IF NOT EXISTS ix_messages_due ON messages (status, next_attempt)")
+    db.execute("CREATE INDEX IF NOT EXISTS ix_messages_job ON messages (job_id)")
+    db.execute("CREATE TABLE IF NOT EXISTS workers (name TEXT PRIMARY KEY, seen REAL NOT NULL)")
+    return db
+
+
+def enqueue(smtp_host, messages, path=MAIL_QUEUE_PATH):
+    """Store `messages` (EmailMessage) for delivery through `smtp_host`, return the job id."""
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    db = _connect(path)
+    try:
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany(
+                "INSERT INTO messages (job_id, smtp, payload, status, next_attempt, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, smtp_host, msg.as_bytes(), QUEUED, now, now) for msg in messages])
+    finally:
+        db.close()
+    logger.info(f"Queued {len(messages)} e-mails as job {job_id}")
+    return job_id
+
+
+def job_status(job_id, path=MAIL_QUEUE_PATH):
+    # overall status of a job, or None if unknown
+    db = _connect(path)
+    try:
+        rows = db.execute(
+            "SELECT status, attempts, last_error FROM messages WHERE job_id = ? ORDER BY id",
+            (job_id,)).fetchall()
+        seen = db.execute("SELECT MAX(seen) FROM workers").fetchone()[0]
+    finally:
+        db.close()
+    if not rows:
+        return None
+    statuses = {row[0] for row in rows}
+    if statuses == {SENT}:
+        status = SENT
+    elif FAILED in statuses:
+        status = FAILED
+    elif SENDING in statuses or SENT in statuses:
+        status = SENDING
+    else:
+        status = QUEUED
+    result = {
+        "jobId": job_id,
+        "status": status,
+        "messages": [{"status": s, "attempts": a, "error": e} for s, a, e in rows],
+        "workerLastSeen": None if seen is None else round(time.time() - seen, 1),
+    }
+    if status in (QUEUED, SENDING) and (seen is None or time.time() - seen > WORKER_STALE_SECONDS):
+        # accepted, but nothing is delivering the queue
+        result["warning"] = "No mail worker is running, the e-mails will be sent once one is started"
+    return result
+
+
+def queue_stats(path=MAIL_QUEUE_PATH):
+    # (messages not yet sent or failed, age in seconds of the oldest of them)
+    db = _connect(path)
+    try:
+        pending, oldest = db.execute(
+            "SELECT COUNT(*), MIN(created) FROM messages WHERE status IN (?, ?)", (QUEUED, SENDING)).fetchone()
+    finally:
+        db.close()
+    return pending, (time.time() - oldest if oldest is not None else 0.0)
+
+
+class SMTPPool:
+    """Keeps one open SMTP_SSL connection per host and reuses it between batches."""
+
+    def __init__(self, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._connections = {}  # host -> (smtp, last used)
+
+    def get(self, host):
+        entry = self._connections.pop(host, None)
+        if entry is not None:
+            smtp, _ = entry
+            try:
+                if smtp.noop()[0] == 250:
+                    return smtp
+            except smtplib.SMTPException:
+                pass
+            except OSError:
+                pass
+            self._quit(smtp)
+        return smtplib.SMTP_SSL(host, timeout=SMTP_TIMEOUT)
+
+    def put_back(self, host, smtp):
+        self._connections[host] = (smtp, time.monotonic())
+
+    def discard(self, smtp):
+        self._quit(smtp)
+
+    def close_idle(self):
+        now = time.monotonic()
+        for host, (smtp, last_used) in list(self._connections.items()):
+            if now - last_used > self.idle_timeout:
+                del self._connections[host]
+                self._quit(smtp)
+
+    def close(self):
+        for smtp, _ in self._connections.values():
+            self._quit(smtp)
+        self._connections.clear()
+
+    @staticmethod
+    def _quit(smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            try:
+                smtp.close()
+            except Exception:
+                pass
+
+
+class MailWorker:
+
+    def __init__(self, path=MAIL_QUEUE_PATH, batch_size=BATCH_SIZE):
+        self.db = _connect(path)
+        self.batch_size = batch_size
+        self.smtp = SMTPPool()
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._last_heartbeat = 0.0
+
+    def heartbeat(self):
+        now = time.time()
+        if now - self._last_heartbeat < HEARTBEAT_INTERVAL:
+            return
+        self._last_heartbeat = now
+        with self.db:
+            self.db.execute(
+                "INSERT INTO workers (name, seen) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET seen = excluded.seen",
+                (self.name, now))
+            # workers that stopped long ago
+            self.db.execute("DELETE FROM workers WHERE seen < ?", (now - 24 * 3600,))
+
+    def claim(self):
+        # atomically take up to batch_size due messages of one SMTP host
+        now = time.time()
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            # messages of a crashed worker go back to the queue
+            self.db.execute(
+                "UPDATE messages SET status = ? WHERE status = ? AND claimed_at < ?",
+                (QUEUED, SENDING, now - CLAIM_TIMEOUT))
+            row = self.db.execute(
+                "SELECT smtp FROM messages WHERE status = ? AND next_attempt <= ? "
+                "ORDER BY next_attempt LIMIT 1", (QUEUED, now)).fetchone()
+            if row is None:
+                return None, []
+            host = row[0]
+            rows = self.db.execute(
+                "SELECT id, payload, attempts FROM messages "
+                "WHERE status = ? AND next_attempt <= ? AND smtp = ? ORDER BY id LIMIT ?",
+                (QUEUED, now, host, self.batch_size)).fetchall()
+            self.db.executemany(
+                "UPDATE messages SET status = ?, claimed_at = ? WHERE id = ?",
+                [(SENDING, now, row[0]) for row in rows])
+        return host, rows
+
+    def _finish(self, message_id, attempts, error=None):
+        with self.db:
+            if error is None:
+                self.db.execute(
+                    "UPDATE messages SET status = ?, attempts = ?, last_error = NULL WHERE id = ?",
+                    (SENT, attempts, message_id))
+            elif attempts >= MAX_ATTEMPTS:
+                self.db.execute(
+                    "UPDATE messages SET status = ?, attempts = ?, last_error = ? WHERE id = ?",
+                    (FAILED, attempts, error, message_id))
+                logger.error(f"Giving up on e-mail {message_id} after {attempts} attempts: {error}")
+            else:
+                delay = RETRY_BACKOFF * 2 ** (attempts - 1)
+                self.db.execute(
+                    "UPDATE messages SET status = ?, attempts = ?, last_error = ?, next_attempt = ? WHERE id = ?",
+                    (QUEUED, attempts, error, time.time() + delay, message_id))
+                logger.warning(f"E-mail {message_id} failed, retrying in {delay}s: {error}")
+
+    def send_batch(self, host, rows):
+        try:
+            smtp = self.smtp.get(host)
+        except (smtplib.SMTPException, OSError) as e:
+            for message_id, _, attempts in rows:
+                self._finish(message_id, attempts + 1, f"connect: {e}")
+            return
+        for i, (message_id, payload, attempts) in enumerate(rows):
+            msg = email.message_from_bytes(payload, policy=policy.default)
+            try:
+                with metrics.timer("smtp_send_duration_seconds"):
+                    smtp.send_message(msg)
+            except smtplib.SMTPRecipientsRefused as e:
+                # the connection is fine, only this message is bad
+                self._finish(message_id, attempts + 1, str(e))
+                continue
+            except (smtplib.SMTPException, OSError) as e:
+                # connection is unusable: fail this one, release the rest for a retry
+                self.smtp.discard(smtp)
+                self._finish(message_id, attempts + 1, str(e))
+                for rest_id, _, rest_attempts in rows[i + 1:]:
+                    self._finish(rest_id, rest_attempts + 1, "connection lost")
+                return
+            self._finish(message_id, attempts + 1)
+        self.smtp.put_back(host, smtp)
+        logger.info(f"Sent {len(rows)} e-mails via {host}")
+
+    def run_once(self):
+        self.heartbeat()
+        host, rows = self.claim()
+        if rows:
+            self.send_batch(host, rows)
+        self.smtp.close_idle()
+        metrics.flush()
+        return len(rows)
+
+    def run(self, stop=None):
+        try:
+            while stop is None or not stop.is_set():
+                if not self.run_once():
+                    time.sleep(POLL_INTERVAL)
+        finally:
+            self.smtp.close()
+
+
+def _worker_main(path, batch_size):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    MailWorker(path, batch_size).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deliver queued job request e-mails")
+    parser.add_argument("--queue", default=MAIL_QUEUE_PATH, help="SQLite queue file")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    _connect(args.queue).close()
+    if args.workers == 1:
+        _worker_main(args.queue, args.batch_size)
+        return 0
+    processes = [multiprocessing.Process(target=_worker_main, args=(args.queue, args.batch_size))
+                 for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """SQLite record of the files a pipeline stage has processed.
+
+    Stores path, size, mtime and content hash. diff() compares a directory
+    against it; content is only hashed when size or mtime moved, so an
+    unchanged tree costs one stat() per file.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sha256 TEXT NOT NULL)")
+        self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def _entries_under(self, root):
+        prefix = os.path.join(str(root), "")
+        rows = self._db.execute(
+            "SELECT path, size, mtime_ns, sha256 FROM files WHERE substr(path, 1, ?) = ?",
+            (len(prefix), prefix))
+        return {path: (size, mtime_ns, sha256) for path, size, mtime_ns, sha256 in rows}
+
+    def diff(self, root, suffix=".json"):
+        """Return (changed, deleted) paths under `root` relative to the manifest."""
+        with self._lock:
+            known = self._entries_under(root)
+        changed = []
+        touched = []
+        for dirpath, _, files in os.walk(root):
+            for name in files:
+                if not name.endswith(suffix):
+                    continue
+                path = os.path.join(dirpath, name)
+                entry = known.pop(path, None)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+                    continue
+                if entry is not None and entry[0] == stat.st_size:
+                    # touched but maybe not modified, e.g. by rsync or a re-copy
+                    try:
+                        digest = file_hash(path)
+                    except FileNotFoundError:
+                        continue
+                    if digest == entry[2]:
+                        touched.append((stat.st_size, stat.st_mtime_ns, path))
+                        continue
+                changed.append(path)
+        if touched:
+            with self._lock:
+                self._db.executemany("UPDATE files SET size = ?, mtime_ns = ? WHERE path = ?", touched)
+                self._db.commit()
+        # whatever is left was not found on disk
+        return changed, sorted(known)
+
+    def record(self, paths):
+        rows = []
+        for path in paths:
+            path = str(path)
+            try:
+                stat = os.stat(path)
+                rows.append((path, stat.st_size, stat.st_mtime_ns, file_hash(path)))
+            except FileNotFoundError:
+                continue
+        with self._lock:
+            self._db.executemany(
+                "INSERT INTO files (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns, "
+                "sha256 = excluded.sha256", rows)
+            self._db.commit()
+
+    def forget(self, paths):
+        with self._lock:
+            self._db.executemany("DELETE FROM files WHERE path = ?", [(str(path),) for path in paths])
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
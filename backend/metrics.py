@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# with gunicorn every worker keeps its own metrics; when METRICS_DIR is set they
+# are written there and /metrics adds up the files of all processes of the host
+METRICS_DIR = os.environ.get("METRICS_DIR")
+FLUSH_INTERVAL = 1.0
+# files of processes that stopped this long ago are ignored
+STALE_SECONDS = 24 * 3600
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+_lock = threading.Lock()
+# name -> {"type", "help", "buckets"}
+_meta = {}
+# (name, sorted label items) -> value, or [bucket counts..., +Inf count, sum] for histograms
+_values = {}
+_last_flush = 0.0
+
+# per-request totals, filled by the DB layer while a request is handled
+_request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def _register(name, kind, help_text, buckets=None):
+    _meta.setdefault(name, {"type": kind, "help": help_text, "buckets": buckets})
+
+
+def counter(name, help_text):
+    _register(name, "counter", help_text)
+
+
+def gauge(name, help_text):
+    _register(name, "gauge", help_text)
+
+
+def histogram(name, help_text, buckets=LATENCY_BUCKETS):
+    _register(name, "histogram", help_text, tuple(buckets))
+
+
+def _key(name, labels):
+    return name, tuple(sorted((labels or {}).items()))
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _values[key] = _values.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _values[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    buckets = _meta[name]["buckets"]
+    key = _key(name, labels)
+    with _lock:
+        entry = _values.get(key)
+        if entry is None:
+            entry = _values[key] = [0] * (len(buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(buckets, value)] += 1
+        entry[-1] += value
+
+
+class timer:
+    """Context manager observing the elapsed seconds into a histogram."""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+def begin_request():
+    stats = {"db_seconds": 0.0, "db_queries": 0, "rows": 0}
+    _request_stats.set(stats)
+    return stats
+
+
+def end_request():
+    stats = _request_stats.get()
+    _request_stats.set(None)
+    return stats
+
+
+def record_db(phase, seconds, rows=0):
+    observe("db_seconds", seconds, phase=phase)
+    if rows:
+        inc("db_rows_returned_total", rows)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["db_seconds"] += seconds
+        stats["rows"] += rows
+        if phase == "query":
+            stats["db_queries"] += 1
+
+
+def _snapshot():
+    with _lock:
+        return [[name, list(labels), value[:] if isinstance(value, list) else value]
+                for (name, labels), value in _values.items()]
+
+
+def flush(force=False):
+    # write this process's metrics to METRICS_DIR, at most once per FLUSH_INTERVAL
+    global _last_flush
+    if not METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    _last_flush = now
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    tmp = path + ".tmp"
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump({"meta": _meta, "values": _snapshot()}, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics to {METRICS_DIR}: {e}")
+
+
+def _collect():
+    # (meta, values) of this process, or added up over all processes in METRICS_DIR
+    if not METRICS_DIR:
+        return _meta, {(name, labels): value for name, labels, value in
+                       ((n, tuple(map(tuple, l)), v) for n, l, v in _snapshot())}
+    flush(force=True)
+    meta = dict(_meta)
+    totals = {}
+    cutoff = time.time() - STALE_SECONDS
+    for name in os.listdir(METRICS_DIR):
+        path = os.path.join(METRICS_DIR, name)
+        if not name.endswith(".json"):
+            continue
+        try:
+            if os.stat(path).st_mtime < cutoff:
+                continue
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric, info in data["meta"].items():
+            meta.setdefault(metric, info)
+        for metric, labels, value in data["values"]:
+            key = (metric, tuple(map(tuple, labels)))
+            if meta[metric]["type"] == "gauge":
+                # the same gauge set by several processes isn't a sum
+                totals[key] = max(totals.get(key, value), value)
+            elif isinstance(value, list):
+                current = totals.get(key)
+                totals[key] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return meta, totals
+
+
+def _labels(items, extra=()):
+    items = list(items) + list(extra)
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + "}"
+
+
+def render(live=None):
+    """All metrics in the Prometheus text exposition format.
+
+    `live` maps gauge names to values read at scrape time; they are reported
+    as they are instead of being stored in this process.
+    """
+    meta, values = _collect()
+    for name, value in (live or {}).items():
+        values[(name, ())] = value
+    by_name = defaultdict(list)
+    for (name, labels), value in values.items():
+        by_name[name].append((labels, value))
+    lines = []
+    for name in sorted(by_name):
+        info = meta[name]
+        lines.append(f"# HELP {name} {info['help']}")
+        lines.append(f"# TYPE {name} {info['type']}")
+        for labels, value in sorted(by_name[name], key=lambda item: item[0]):
+            if info["type"] != "histogram":
+                lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(info["buckets"]) + ["+Inf"], value[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {value[-1]}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+# metrics shared by the API, the DB pool and the background workers
+histogram("http_request_duration_seconds", "Time to handle a request, by route")
+histogram("http_response_bytes", "Size of response bodies, by route", SIZE_BUCKETS)
+histogram("db_seconds", "MariaDB time by phase: connect, query (execute) and fetch")
+counter("db_rows_returned_total", "Rows fetched from MariaDB")
+histogram("elab_request_duration_seconds", "eLabFTW API calls, by HTTP method")
+histogram("smtp_send_duration_seconds", "Time to hand one e-mail to the SMTP server")
+gauge("watcher_pending_files", "Files waiting in a watcher queue, by stage")
+gauge("watcher_lag_seconds", "Age of the oldest file event waiting in a watcher queue, by stage")
+gauge("mail_queue_pending", "E-mails queued or being sent")
+gauge("mail_queue_lag_seconds", "Age of the oldest e-mail waiting to be sent")
+counter("replication_files_total", "Files written or deleted by the replication receiver, by action")
+counter("replication_bytes_total", "Compressed bytes received from the replication source")
+histogram("replication_apply_seconds", "Time to apply one replicated batch")
+gauge("replication_seq", "Last source journal seq applied by the replication receiver")
+
+
+class SamplingProfiler:
+    """Samples the call stack of one thread and produces folded stacks.
+
+    The output ("frame;frame;frame count" per line) is what flamegraph.pl,
+    speedscope and most flame graph viewers read. Under gevent the sampled
+    OS thread also runs the other requests of the worker.
+    """
+
+    def __init__(self, thread_id=None, interval=0.005):
+        # real OS thread primitives even when gevent has patched threading: under
+        # gevent threading.get_ident() is the greenlet's id, never a key of sys._current_frames()
+        self._start_new_thread, self._sleep, get_ident, self._allocate_lock = _original_thread_primitives()
+        self.thread_id = thread_id or get_ident()
+        self.interval = interval
+        self.samples = defaultdict(int)
+        self._running = False
+        self._stopped = None
+
+    def _sample(self):
+        try:
+            while self._running:
+                frame = sys._current_frames().get(self.thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.samples[";".join(reversed(stack))] += 1
+                self._sleep(self.interval)
+        finally:
+            self._stopped.release()
+
+    def start(self):
+        # held while the sampler runs, stop() waits for it so samples is no longer written to
+        self._stopped = self._allocate_lock()
+        self._stopped.acquire()
+        self._running = True
+        self._start_new_thread(self._sample, ())
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._stopped is not None:
+            self._stopped.acquire()
+            self._stopped = None
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.samples.items())) + "\n"
+
+
+def _original_thread_primitives():
+    # (start_new_thread, sleep, get_ident, allocate_lock) of the OS, not gevent's
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched("threading"):
+            return (monkey.get_original("_thread", "start_new_thread"), monkey.get_original("time", "sleep"),
+                    monkey.get_original("_thread", "get_ident"), monkey.get_original("_thread", "allocate_lock"))
+    except ImportError:
+        pass
+    import _thread
+    return _thread.start_new_thread, time.sleep, _thread.get_ident, _thread.allocate_lock
@@ -0,0 +1,306 @@
+import json
+import base64
+import logging
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from json_encoding import parse_shape, shape_rows
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# query parameters that switch /api/data/<table> into paged mode
+PAGE_PARAMS = {"limit", "cursor", "order_by", "filter", "count"}
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def quote_identifier(name):
+    return "`" + str(name).replace("`", "``") + "`"
+
+
+# key values JSON has no type for are tagged, so they are bound back as the
+# same type and compare equal to the column value in seek_clause
+_CURSOR_TAGS = {
+    "$datetime": datetime.datetime.fromisoformat,
+    "$date": datetime.date.fromisoformat,
+    "$time": lambda value: datetime.timedelta(microseconds=int(value)),
+    "$decimal": Decimal,
+    "$bytes": lambda value: base64.b64decode(value.encode("ascii"), validate=True),
+}
+
+
+def _encode_value(value):
+    # datetime before date: it is a subclass
+    if isinstance(value, datetime.datetime):
+        return {"$datetime": value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {"$date": value.isoformat()}
+    if isinstance(value, datetime.timedelta):
+        # pymysql returns TIME columns as timedelta
+        return {"$time": str(value // datetime.timedelta(microseconds=1))}
+    if isinstance(value, Decimal):
+        return {"$decimal": str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {"$bytes": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, list):
+        return [_encode_value(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _encode_value(item) for key, item in value.items()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, list):
+        return [_decode_value(item) for item in value]
+    if isinstance(value, dict):
+        if len(value) == 1:
+            tag, raw = next(iter(value.items()))
+            if tag in _CURSOR_TAGS:
+                if not isinstance(raw, str):
+                    raise ValueError(f"invalid {tag} value")
+                return _CURSOR_TAGS[tag](raw)
+        return {key: _decode_value(item) for key, item in value.items()}
+    return value
+
+
+def encode_cursor(payload):
+    raw = json.dumps(_encode_value(payload), default=str, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        position = _decode_value(json.loads(base64.urlsafe_b64decode(padded.encode("ascii"))))
+    except (ValueError, TypeError, InvalidOperation, UnicodeError):
+        raise PaginationError("Invalid cursor")
+    # well-formed base64 JSON can still be any value, encode_cursor() only writes objects
+    if not isinstance(position, dict):
+        raise PaginationError("Invalid cursor")
+    return position
+
+
+def cursor_offset(position):
+    # row offset of an offset-paged cursor, 0 for the first page
+    offset = position.get("o", 0) if position else 0
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise PaginationError("Invalid cursor")
+    return offset
+
+
+def table_columns(cursor, table):
+    cursor.execute(f"DESCRIBE {quote_identifier(table)}")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def table_indexes(cursor, table):
+    # returns the primary key columns (in order) and the set of columns that
+    # lead an index, i.e. the columns a keyset seek can start from
+    cursor.execute(f"SHOW INDEX FROM {quote_identifier(table)}")
+    primary_key = {}
+    indexed = set()
+    for row in cursor.fetchall():
+        # Table, Non_unique, Key_name, Seq_in_index, Column_name, ...
+        key_name, seq, column = row[2], row[3], row[4]
+        if key_name == "PRIMARY":
+            primary_key[seq] = column
+        if seq == 1:
+            indexed.add(column)
+    return [primary_key[seq] for seq in sorted(primary_key)], indexed
+
+
+def parse_filters(raw_filters):
+    # filter=<column>:<value> -> exact match
+    # filter=<column>~<value> -> prefix match (can still use an index)
+    filters = []
+    for raw in raw_filters:
+        positions = [pos for pos in (raw.find(":"), raw.find("~")) if pos > 0]
+        if not positions:
+            raise PaginationError(f"Invalid filter '{raw}', expected column:value or column~prefix")
+        pos = min(positions)
+        filters.append((raw[:pos], raw[pos], raw[pos + 1:]))
+    return filters
+
+
+def parse_page_args(args):
+    try:
+        limit = int(args.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise PaginationError("limit must be an integer")
+    if limit < 1:
+        raise PaginationError("limit must be positive")
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    order_by = args.get("order_by") or None
+    descending = False
+    if order_by and order_by.startswith("-"):
+        descending = True
+        order_by = order_by[1:]
+
+    cursor = args.get("cursor")
+    return {
+        "limit": limit,
+        "order_by": order_by,
+        "descending": descending,
+        "filters": parse_filters(args.getlist("filter")),
+        "cursor": decode_cursor(cursor) if cursor else None,
+        "exact_count": args.get("count") == "exact",
+    }
+
+
+def filter_clause(filters):
+    clauses = []
+    params = []
+    for column, op, value in filters:
+        if op == ":":
+            clauses.append(f"{quote_identifier(column)} = %s")
+            params.append(value)
+        else:
+            escaped = value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            clauses.append(f"{quote_identifier(column)} LIKE %s")
+            params.append(escaped + "%")
+    return clauses, params
+
+
+def seek_clause(key_columns, last_values, descending):
+    # Lexicographic "row comes after (v0, v1, ...)" condition, written out as
+    # an OR chain so the optimizer can turn it into an index range scan.
+    # Only the leading (user chosen) column may be NULL; the rest is the primary key.
+    # MariaDB sorts NULLs first ascending and last descending.
+    op = "<" if descending else ">"
+
+    def rest(i):
+        col = quote_identifier(key_columns[i])
+        if i == len(key_columns) - 1:
+            return f"{col} {op} %s", [last_values[i]]
+        sql, params = rest(i + 1)
+        return f"({col} {op} %s OR ({col} = %s AND {sql}))", [last_values[i], last_values[i]] + params
+
+    col = quote_identifier(key_columns[0])
+    if len(key_columns) == 1:
+        tail_sql, tail_params = "FALSE", []
+    else:
+        tail_sql, tail_params = rest(1)
+    if last_values[0] is None:
+        if descending:
+            return f"({col} IS NULL AND {tail_sql})", tail_params
+        return f"(({col} IS NULL AND {tail_sql}) OR {col} IS NOT NULL)", tail_params
+    if len(key_columns) == 1:
+        sql, params = f"({col} {op} %s", [last_values[0]]
+    else:
+        sql = f"({col} {op} %s OR ({col} = %s AND {tail_sql})"
+        params = [last_values[0], last_values[0]] + tail_params
+    if descending:
+        sql += f" OR {col} IS NULL"
+    return sql + ")", params
+
+
+def _estimate_total(cursor, table, select_sql, where_params, filtered, exact):
+    if exact:
+        cursor.execute(f"SELECT COUNT(*) {select_sql}", where_params)
+        return cursor.fetchone()[0], False
+    if not filtered:
+        cursor.execute(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table,))
+        row = cursor.fetchone()
+        return (row[0] if row else None), True
+    # let the optimizer estimate the filtered row count
+    cursor.execute(f"EXPLAIN SELECT * {select_sql}", where_params)
+    description = [desc[0] for desc in cursor.description]
+    plan = cursor.fetchone()
+    if plan is None or "rows" not in description:
+        return None, True
+    return plan[description.index("rows")], True
+
+
+def fetch_page(cursor, table, args):
+    """Fetch one page of `table` according to the request query `args`.
+
+    Pages are addressed by an opaque cursor holding the sort key of the last
+    row returned (keyset/seek pagination), so every page costs an index range
+    scan of `limit` rows regardless of its position. Tables without a primary
+    key fall back to offset paging.
+    """
+    page = parse_page_args(args)
+    columns = table_columns(cursor, table)
+    primary_key, indexed = table_indexes(cursor, table)
+
+    for column, _, _ in page["filters"]:
+        if column not in columns:
+            raise PaginationError(f"Unknown filter column '{column}'")
+    if page["order_by"] and page["order_by"] not in columns:
+        raise PaginationError(f"Unknown order_by column '{page['order_by']}'")
+
+    where, where_params = filter_clause(page["filters"])
+    from_sql = f"FROM {quote_identifier(table)}"
+    base_where = list(where)
+    params = list(where_params)
+    direction = "DESC" if page["descending"] else "ASC"
+    offset = None
+
+    if primary_key:
+        order_column = page["order_by"] or primary_key[0]
+        if order_column not in indexed:
+            raise PaginationError(
+                f"order_by must be an indexed column: {', '.join(sorted(indexed))}")
+        key_columns = [order_column] + [col for col in primary_key if col != order_column]
+        if page["cursor"] is not None:
+            last_values = page["cursor"].get("k")
+            if not isinstance(last_values, list) or len(last_values) != len(key_columns):
+                raise PaginationError("Cursor does not match the requested ordering")
+            seek_sql, seek_params = seek_clause(key_columns, last_values, page["descending"])
+            where.append(seek_sql)
+            params.extend(seek_params)
+        order_sql = ", ".join(f"{quote_identifier(col)} {direction}" for col in key_columns)
+    else:
+        # no stable unique key to seek on
+        key_columns = []
+        offset = cursor_offset(page["cursor"])
+        order_column = page["order_by"]
+        order_sql = f"{quote_identifier(order_column)} {direction}" if order_column else ""
+
+    select_sql = from_sql + (" WHERE " + " AND ".join(where) if where else "")
+    query = f"SELECT * {select_sql}"
+    if order_sql:
+        query += f" ORDER BY {order_sql}"
+    query += " LIMIT %s" if offset is None else " LIMIT %s OFFSET %s"
+    params.append(page["limit"] + 1)
+    if offset is not None:
+        params.append(offset)
+
+    logger.debug(f'DB QUERY: {query}')
+    cursor.execute(query, params)
+    rows = cursor.fetchall()
+    result_columns = [desc[0] for desc in cursor.description]
+
+    has_more = len(rows) > page["limit"]
+    rows = rows[:page["limit"]]
+    next_cursor = None
+    if has_more:
+        if offset is None:
+            last = dict(zip(result_columns, rows[-1]))
+            next_cursor = encode_cursor({"k": [last[col] for col in key_columns]})
+        else:
+            next_cursor = encode_cursor({"o": offset + page["limit"]})
+
+    base_select = from_sql + (" WHERE " + " AND ".join(base_where) if base_where else "")
+    total, is_estimate = _estimate_total(
+        cursor, table, base_select, where_params, bool(base_where), page["exact_count"])
+
+    result = {"columns": result_columns}
+    result.update(shape_rows(result_columns, rows, parse_shape(args)))
+    result.update({
+        "next_cursor": next_cursor,
+        "has_more": has_more,
+        "order_by": ("-" if page["descending"] else "") + order_column if order_column else None,
+        "limit": page["limit"],
+        "total": total,
+        "total_is_estimate": is_estimate,
+    })
+    return result
@@ -0,0 +1,145 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+import validation
+from form_fields import FormExtractor, conf_keywords
+
+logger = logging.getLogger(__name__)
+
+SCHEMAS_DIR = Path('./schemas')
+JOBREQUEST_CONF_PATH = Path('./conf/jobrequest-conf.json')
+
+# how often the files are stat()ed for changes, in seconds
+POLL_INTERVAL = 2.0
+
+_MISSING = object()
+
+
+class WatchedFiles:
+    """Value derived from a set of files, rebuilt only when one of them changes.
+
+    Changes are detected by polling (path, mtime, size) of the files, at most
+    once per `poll_interval`, so a request normally costs a dict lookup.
+    """
+
+    def __init__(self, list_files, load, poll_interval=POLL_INTERVAL):
+        self.list_files = list_files
+        self.load = load
+        self.poll_interval = poll_interval
+        self._value = _MISSING
+        self._signature = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def _stat_signature(self):
+        signature = []
+        for path in self.list_files():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            signature.append((str(path), stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
+    def get(self):
+        now = time.monotonic()
+        if self._value is not _MISSING and now - self._checked < self.poll_interval:
+            return self._value
+        with self._lock:
+            if self._value is _MISSING or now - self._checked >= self.poll_interval:
+                signature = self._stat_signature()
+                if signature != self._signature or self._value is _MISSING:
+                    self._value = self.load([Path(entry[0]) for entry in signature])
+                    self._signature = signature
+                self._checked = time.monotonic()
+            return self._value
+
+    def invalidate(self):
+        # force a stat() check on the next access, e.g. after we wrote one of the files
+        self._checked = float("-inf")
+
+
+class PreparedResponse:
+    """JSON body serialized once, with the ETag to answer conditional requests."""
+
+    def __init__(self, payload):
+        self.payload = payload
+        self.body = json.dumps(payload).encode('utf-8')
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+
+def _list_schema_files():
+    return sorted(SCHEMAS_DIR.glob('**/*.json'))
+
+
+def _load_schemas(paths):
+    list_of_schemas = {"schemaName": [""], "schema": [None]}
+    for path in paths:
+        try:
+            content = path.read_text(encoding='utf-8')
+            json.loads(content)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping invalid schema {path}: {e}")
+            continue
+        list_of_schemas["schema"].append(content)
+        list_of_schemas["schemaName"].append(path.relative_to(SCHEMAS_DIR).as_posix())
+    logger.info(f"Loaded {len(list_of_schemas['schema']) - 1} schemas")
+    return PreparedResponse(list_of_schemas)
+
+
+def _load_validators(paths):
+    # schema name (file name without .json, which is also the table name) -> Validator
+    validators = {}
+    for path in paths:
+        try:
+            schema = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            continue
+        validators[path.relative_to(SCHEMAS_DIR).as_posix()[:-len(".json")]] = validation.compile_schema(schema)
+    return validators
+
+
+def _list_jobrequest_conf():
+    return [JOBREQUEST_CONF_PATH]
+
+
+def _load_jobrequest_conf(paths):
+    if not paths:
+        return None
+    try:
+        conf = json.loads(paths[0].read_text())
+        for element in conf["confList"]:
+            if "completeSchemaTitle" not in element or "requestSchemaTitle" not in element:
+                raise KeyError("confList entries need completeSchemaTitle and requestSchemaTitle")
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Invalid job request configuration {paths[0]}: {e}")
+        return None
+    return conf
+
+
+def _load_form_extractor(paths):
+    return FormExtractor(conf_keywords(_load_jobrequest_conf(paths)))
+
+
+schemas = WatchedFiles(_list_schema_files, _load_schemas)
+# unchanged schemas keep their compiled validator across reloads
+validators = WatchedFiles(_list_schema_files, _load_validators)
+jobrequest_conf = WatchedFiles(_list_jobrequest_conf, _load_jobrequest_conf)
+# looks up every keyword of the job request configuration in one walk of the form data
+form_extractor = WatchedFiles(_list_jobrequest_conf, _load_form_extractor)
+
+
+def find_jobrequest_conf(schema_title):
+    # the job request configuration entry for a schema title, or None
+    conf = jobrequest_conf.get()
+    if conf is None:
+        return None
+    match = None
+    for element in conf["confList"]:
+        if element["completeSchemaTitle"] == schema_title or element["requestSchemaTitle"] == schema_title:
+            match = element
+    return match
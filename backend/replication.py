@@ -0,0 +1,650 @@
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import shlex
+import signal
+import sqlite3
+import struct
+import logging
+import argparse
+import threading
+import subprocess
+from pathlib import Path, PurePosixPath
+
+import sorter
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# a path is sent once no event arrived for it during this many seconds
+DEBOUNCE_SECONDS = 0.2
+# files and uncompressed bytes per batch frame
+MAX_BATCH = 1000
+BATCH_BYTES = 8 << 20
+# larger files are sent in chunks, and a broken transfer resumes at the last chunk
+CHUNK_BYTES = 4 << 20
+COMPRESS_LEVEL = 6
+# an idle sender says it's alive this often; the receiver reconnects after 3 missed beats
+HEARTBEAT_SECONDS = 30.0
+# wait between reconnects, doubled up to the maximum while the source is unreachable
+RECONNECT_SECONDS = 1.0
+MAX_RECONNECT_SECONDS = 60.0
+PROTOCOL_VERSION = 1
+REMOTE_SCRIPT = os.environ.get("REPLICATION_REMOTE_SCRIPT", "~/adamant/backend/replication.py")
+REMOTE_PYTHON = os.environ.get("REPLICATION_REMOTE_PYTHON", "python3")
+
+# frame kinds; the receiver only ever sends HELLO
+HELLO = b"S"      # receiver: {"version", "epoch", "seq", "indexed", "partial"}
+WELCOME = b"W"    # sender: {"epoch", "from", "index"}
+BATCH = b"B"      # sender: compressed header + contents of small files and deletions
+CHUNK = b"C"      # sender: compressed header + part of one large file
+INDEX = b"I"      # sender: compressed list of every file, after a full transfer
+READY = b"R"      # sender: {"seq"}, caught up with the journal
+HEARTBEAT = b"H"  # sender: nothing changed
+
+_FRAME = struct.Struct("!cI")
+_LENGTH = struct.Struct("!I")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def _read_exact(reader, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = reader.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def read_frame(reader):
+    # (kind, payload), or (None, None) once the peer closed the connection
+    header = _read_exact(reader, _FRAME.size)
+    if header is None:
+        return None, None
+    kind, size = _FRAME.unpack(header)
+    payload = _read_exact(reader, size) if size else b""
+    if payload is None:
+        raise ProtocolError("connection closed inside a frame")
+    return kind, payload
+
+
+def write_frame(writer, kind, payload=b""):
+    writer.write(_FRAME.pack(kind, len(payload)))
+    if payload:
+        writer.write(payload)
+    writer.flush()
+
+
+def _pack(header, data=b"", level=COMPRESS_LEVEL):
+    encoded = json.dumps(header).encode("utf-8")
+    return zlib.compress(_LENGTH.pack(len(encoded)) + encoded + data, level)
+
+
+def _unpack(payload):
+    raw = zlib.decompress(payload)
+    size = _LENGTH.unpack_from(raw)[0]
+    header = json.loads(raw[_LENGTH.size:_LENGTH.size + size])
+    return header, memoryview(raw)[_LENGTH.size + size:]
+
+
+class Journal:
+    """SQLite change journal of a directory, kept on the source host.
+
+    Every file gets the sequence number of its last change; deleted files
+    stay as tombstones. A receiver that has applied everything up to seq N
+    only needs the rows after N, however large the tree is. The epoch
+    changes when the journal is recreated, which forces a full transfer.
+    """
+
+    def __init__(self, path, root, suffix=".json"):
+        self.path = str(path)
+        self.root = Path(root).resolve()
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, seq INTEGER NOT NULL, size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL, deleted INTEGER NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS files_seq ON files (seq)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._db.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('epoch', ?)", (uuid.uuid4().hex,))
+        self._db.commit()
+        self.epoch = self._db.execute("SELECT value FROM meta WHERE key = 'epoch'").fetchone()[0]
+
+    def relative(self, path):
+        return Path(path).relative_to(self.root).as_posix()
+
+    def _stat(self, rel):
+        # (size, mtime_ns) of the file, following symlinks into rawData; None if it's gone
+        try:
+            stat = os.stat(self.root / rel)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _apply(self, known, observed):
+        # give a new seq to every path whose state differs from its journal row
+        rows = []
+        for rel, stat in observed:
+            row = known.get(rel)
+            if stat is None:
+                if row is not None and not row[2]:
+                    rows.append((rel, row[0], row[1], 1))
+            elif row is None or row[2] or (row[0], row[1]) != stat:
+                rows.append((rel, stat[0], stat[1], 0))
+        if not rows:
+            return 0
+        with self._lock:
+            seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM files").fetchone()[0]
+            self._db.executemany(
+                "INSERT INTO files (path, seq, size, mtime_ns, deleted) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(path) DO UPDATE SET seq = excluded.seq, size = excluded.size, "
+                "mtime_ns = excluded.mtime_ns, deleted = excluded.deleted",
+                [(rel, seq + i, size, mtime_ns, deleted)
+                 for i, (rel, size, mtime_ns, deleted) in enumerate(rows, 1)])
+            self._db.commit()
+        return len(rows)
+
+    def _known(self, paths=None):
+        with self._lock:
+            if paths is None:
+                rows = self._db.execute("SELECT path, size, mtime_ns, deleted FROM files").fetchall()
+            else:
+                rows = []
+                for rel in paths:
+                    rows += self._db.execute(
+                        "SELECT path, size, mtime_ns, deleted FROM files WHERE path = ?", (rel,)).fetchall()
+        return {rel: (size, mtime_ns, deleted) for rel, size, mtime_ns, deleted in rows}
+
+    def scan(self):
+        """Bring the journal up to date with the tree; one stat() per file."""
+        known = self._known()
+        observed = []
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(self.suffix):
+                    rel = self.relative(os.path.join(root, name))
+                    observed.append((rel, self._stat(rel)))
+        seen = {rel for rel, _ in observed}
+        observed += [(rel, None) for rel in known if rel not in seen]
+        return self._apply(known, observed)
+
+    def update(self, paths):
+        # journal the current state of changed paths (relative to the root)
+        paths = sorted(set(paths))
+        return self._apply(self._known(paths), [(rel, self._stat(rel)) for rel in paths])
+
+    def changes(self, after, page=MAX_BATCH):
+        # (path, seq, deleted) of every change after `after`, in order
+        while True:
+            with self._lock:
+                rows = self._db.execute(
+                    "SELECT path, seq, deleted FROM files WHERE seq > ? ORDER BY seq LIMIT ?",
+                    (after, page)).fetchall()
+            yield from rows
+            if len(rows) < page:
+                return
+            after = rows[-1][1]
+
+    def last_seq(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM files").fetchone()[0]
+
+    def live_paths(self):
+        with self._lock:
+            return [rel for rel, in self._db.execute("SELECT path FROM files WHERE deleted = 0")]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class _Batch:
+
+    def __init__(self):
+        self.items = []
+        self.data = []
+        self.size = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, rel, data, mtime_ns, location):
+        self.items.append({"p": rel, "n": len(data), "m": mtime_ns, "l": location})
+        self.data.append(data)
+        self.size += len(data)
+
+    def delete(self, rel):
+        self.items.append({"p": rel, "d": 1})
+
+    def full(self):
+        return len(self.items) >= MAX_BATCH or self.size >= BATCH_BYTES
+
+
+class Sender:
+    """Source side: streams journal changes of `root` to one receiver.
+
+    After the receiver's HELLO it sends everything journaled since the
+    receiver's last applied seq, then watches the tree and sends each
+    settled burst of events as one compressed batch. While nothing changes
+    it blocks, apart from a heartbeat every HEARTBEAT_SECONDS.
+    """
+
+    def __init__(self, root, journal, debounce=DEBOUNCE_SECONDS, level=COMPRESS_LEVEL):
+        self.root = Path(root).resolve()
+        self.journal = journal
+        self.debounce = debounce
+        self.level = level
+        self.seq = 0
+        self._stopping = threading.Event()
+        self._queue = None
+
+    def _send_batch(self, writer, batch, seq):
+        if batch:
+            write_frame(writer, BATCH, _pack({"seq": seq, "items": batch.items}, b"".join(batch.data), self.level))
+        return _Batch()
+
+    def _send_chunks(self, writer, rel, seq, path, partial):
+        offset = 0
+        with open(path, "rb") as f:
+            mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+            if partial and partial.get("p") == rel and partial.get("s") == seq and partial.get("m") == mtime_ns:
+                offset = partial.get("o", 0)
+                logger.info(f"Resuming {rel} at byte {offset}")
+            f.seek(offset)
+            location = sorter.document_location(path)
+            while True:
+                data = f.read(CHUNK_BYTES)
+                last = len(data) < CHUNK_BYTES
+                write_frame(writer, CHUNK, _pack(
+                    {"p": rel, "s": seq, "o": offset, "m": mtime_ns, "l": location, "e": last}, data, self.level))
+                offset += len(data)
+                if last:
+                    return
+
+    def send_changes(self, writer, after, full=False, partial=None):
+        """Send every journal change after seq `after`; returns the last seq sent."""
+        batch = _Batch()
+        seq = after
+        for rel, seq, deleted in self.journal.changes(after):
+            path = self.root / rel
+            if deleted:
+                # a full transfer ends with the index instead
+                if not full:
+                    batch.delete(rel)
+            else:
+                try:
+                    if os.stat(path).st_size > CHUNK_BYTES:
+                        batch = self._send_batch(writer, batch, seq - 1)
+                        self._send_chunks(writer, rel, seq, path, partial)
+                        continue
+                    with open(path, "rb") as f:
+                        data = f.read()
+                        mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+                    batch.add(rel, data, mtime_ns, sorter.document_location(path))
+                except (FileNotFoundError, NotADirectoryError):
+                    # removed since it was journaled; its own event updates the journal
+                    batch.delete(rel)
+            if batch.full():
+                batch = self._send_batch(writer, batch, seq)
+        self._send_batch(writer, batch, seq)
+        return seq
+
+    def _watch_input(self, reader):
+        # the receiver sends nothing after HELLO: end of input means it's gone
+        while reader.read(4096):
+            pass
+        self.stop()
+
+    def serve(self, reader, writer, once=False):
+        kind, payload = read_frame(reader)
+        if kind != HELLO:
+            raise ProtocolError(f"expected HELLO, got {kind!r}")
+        hello = json.loads(payload)
+        if hello.get("version") != PROTOCOL_VERSION:
+            raise ProtocolError(f"unsupported protocol version {hello.get('version')}")
+
+        observer = None
+        if not once:
+            # not with `once`: a daemon thread still blocked reading stdin makes
+            # interpreter shutdown abort with "_enter_buffered_busy"
+            threading.Thread(target=self._watch_input, args=(reader,), daemon=True).start()
+            from watchdog.observers import Observer
+            from watcher import EventQueue, _QueueingHandler
+            self._queue = EventQueue(debounce=self.debounce)
+            observer = Observer()
+            observer.schedule(_QueueingHandler(self._queue, self.journal.suffix), str(self.root), recursive=True)
+            # watch first, then scan, so nothing falls between the two
+            observer.start()
+        try:
+            changed = self.journal.scan()
+            logger.info(f"Journal of {self.root} has {changed} new changes")
+            full = hello.get("epoch") != self.journal.epoch
+            after = 0 if full else hello.get("seq", 0)
+            index = full or not hello.get("indexed")
+            write_frame(writer, WELCOME, json.dumps(
+                {"epoch": self.journal.epoch, "from": after, "index": index}).encode("utf-8"))
+            self.seq = self.send_changes(writer, after, full, None if full else hello.get("partial"))
+            if index:
+                write_frame(writer, INDEX, zlib.compress(
+                    json.dumps(self.journal.live_paths()).encode("utf-8"), self.level))
+            write_frame(writer, READY, json.dumps({"seq": self.seq}).encode("utf-8"))
+            logger.info(f"Caught up to seq {self.seq}")
+            while not once and not self._stopping.is_set():
+                events = self._queue.take_ready(MAX_BATCH, timeout=HEARTBEAT_SECONDS)
+                if self._stopping.is_set():
+                    break
+                if not events:
+                    write_frame(writer, HEARTBEAT)
+                    continue
+                self.journal.update(self.journal.relative(path) for path, _ in events)
+                self.seq = self.send_changes(writer, self.seq)
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def stop(self, *_):
+        self._stopping.set()
+        if self._queue is not None:
+            self._queue.close()
+
+
+class CommandConnection:
+    """Runs the sender as a child process and talks to it over its stdin/stdout.
+
+    With an ssh command this is one persistent, encrypted connection to the
+    source host; with a local command it stands in for one in tests.
+    """
+
+    def __init__(self, argv):
+        self.argv = argv
+        self.process = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        self.reader = self.process.stdout
+        self.writer = self.process.stdin
+
+    def abort(self):
+        # unblocks a read waiting on a connection that went silent
+        self.process.kill()
+
+    def close(self):
+        for stream in (self.writer, self.reader):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def ssh_command(host, source, script=REMOTE_SCRIPT, python=REMOTE_PYTHON):
+    # the remote shell expands ~ in the script and source paths
+    return ["ssh", "-o", "BatchMode=yes", "-o", "ServerAliveInterval=15", "-o", "ServerAliveCountMax=3",
+            host, f"{python} {script} send {source}"]
+
+
+class Receiver:
+    """Target side: applies the sender's frames to `dest` and remembers how far it got.
+
+    Files are written next to their target and renamed into place, with the
+    source mtime, so ingestion never sees half a file. The state file holds
+    the journal epoch, the last applied seq and the progress of a chunked
+    file; a new connection continues from there.
+    """
+
+    def __init__(self, dest, state_path=None, suffix=".json"):
+        self.dest = Path(dest)
+        self.state_path = Path(state_path or f"{self.dest}.replication-state.json")
+        self.suffix = suffix
+        self.state = self._load_state()
+        self._last_frame = time.monotonic()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable replication state {self.state_path}: {e}")
+        return {"epoch": None, "seq": 0, "indexed": False, "partial": None}
+
+    def _save_state(self):
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.state_path)
+        metrics.set_gauge("replication_seq", self.state["seq"])
+
+    def _target(self, rel):
+        parts = PurePosixPath(rel).parts
+        if not parts or rel.startswith("/") or any(part in (".", "..") for part in parts):
+            raise ProtocolError(f"refusing path '{rel}'")
+        return self.dest.joinpath(*parts)
+
+    @staticmethod
+    def _part(target):
+        # not ending in the suffix, so watchers ignore it until the rename
+        return target.with_name(f".{target.name}.part")
+
+    @staticmethod
+    def _set_location(target, location):
+        path = Path(str(target) + sorter.LOCATION_SUFFIX)
+        if location is None:
+            if os.path.lexists(path):
+                path.unlink()
+            return
+        tmp = path.with_name(f".{path.name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(location)
+        os.replace(tmp, path)
+
+    def _commit(self, part, target, mtime_ns, location):
+        os.utime(part, ns=(mtime_ns, mtime_ns))
+        # sorted entries on the source are symlinks into rawData: keep where they point
+        self._set_location(target, location)
+        os.replace(part, target)
+
+    def _write(self, target, data, mtime_ns, location):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        part = self._part(target)
+        with open(part, "wb") as f:
+            f.write(data)
+        self._commit(part, target, mtime_ns, location)
+
+    def _remove(self, target):
+        if os.path.lexists(target):
+            target.unlink()
+        self._set_location(target, None)
+
+    def _apply_batch(self, payload):
+        with metrics.timer("replication_apply_seconds"):
+            header, body = _unpack(payload)
+            pos = 0
+            for item in header["items"]:
+                target = self._target(item["p"])
+                if item.get("d"):
+                    self._remove(target)
+                    metrics.inc("replication_files_total", action="delete")
+                    continue
+                self._write(target, body[pos:pos + item["n"]], item["m"], item["l"])
+                pos += item["n"]
+                metrics.inc("replication_files_total", action="upsert")
+            self.state["seq"] = header["seq"]
+            self._save_state()
+
+    def _apply_chunk(self, payload):
+        header, data = _unpack(payload)
+        target = self._target(header["p"])
+        target.parent.mkdir(parents=True, exist_ok=True)
+        part = self._part(target)
+        with open(part, "r+b" if header["o"] and part.exists() else "wb") as f:
+            f.truncate(header["o"])
+            f.seek(header["o"])
+            f.write(data)
+        if not header["e"]:
+            self.state["partial"] = {"p": header["p"], "s": header["s"], "o": header["o"] + len(data),
+                                     "m": header["m"]}
+            self._save_state()
+            return
+        self._commit(part, target, header["m"], header["l"])
+        metrics.inc("replication_files_total", action="upsert")
+        self.state.update(seq=header["s"], partial=None)
+        self._save_state()
+
+    def _apply_index(self, payload):
+        # after a full transfer: remove whatever the source doesn't have
+        live = set(json.loads(zlib.decompress(payload)))
+        removed = 0
+        for root, _, files in os.walk(self.dest):
+            for name in files:
+                path = Path(root) / name
+                if name.endswith(self.suffix) and path.relative_to(self.dest).as_posix() not in live:
+                    self._remove(path)
+                    removed += 1
+        self.state["indexed"] = True
+        self._save_state()
+        logger.info(f"Full transfer done, removed {removed} files the source doesn't have")
+
+    def _hello(self):
+        partial = self.state.get("partial")
+        if partial and partial["s"] <= self.state.get("seq", 0):
+            partial = None
+        if partial:
+            # resume from what actually reached the disk
+            part = self._part(self._target(partial["p"]))
+            partial = dict(partial, o=min(partial["o"], part.stat().st_size)) if part.exists() else None
+        return json.dumps({"version": PROTOCOL_VERSION, "epoch": self.state.get("epoch"),
+                           "seq": self.state.get("seq", 0), "indexed": self.state.get("indexed", False),
+                           "partial": partial}).encode("utf-8")
+
+    def _watch_heartbeat(self, connection, done):
+        while not done.wait(HEARTBEAT_SECONDS):
+            if time.monotonic() - self._last_frame > 3 * HEARTBEAT_SECONDS:
+                logger.warning("No data from the source, reconnecting")
+                connection.abort()
+                return
+
+    def session(self, connection, once=False):
+        """Apply frames until the connection ends (or, with `once`, until caught up)."""
+        self.dest.mkdir(parents=True, exist_ok=True)
+        write_frame(connection.writer, HELLO, self._hello())
+        self._last_frame = time.monotonic()
+        done = threading.Event()
+        threading.Thread(target=self._watch_heartbeat, args=(connection, done), daemon=True).start()
+        try:
+            while True:
+                kind, payload = read_frame(connection.reader)
+                if kind is None:
+                    raise ConnectionError("source closed the connection")
+                self._last_frame = time.monotonic()
+                metrics.inc("replication_bytes_total", _FRAME.size + len(payload))
+                if kind == BATCH:
+                    self._apply_batch(payload)
+                elif kind == CHUNK:
+                    self._apply_chunk(payload)
+                elif kind == WELCOME:
+                    welcome = json.loads(payload)
+                    if welcome["epoch"] != self.state.get("epoch"):
+                        logger.info("New source journal, transferring everything")
+                        self.state = {"epoch": welcome["epoch"], "seq": 0, "indexed": False, "partial": None}
+                    self.state["seq"] = welcome["from"]
+                    self._save_state()
+                elif kind == INDEX:
+                    self._apply_index(payload)
+                elif kind == READY:
+                    self.state["seq"] = json.loads(payload)["seq"]
+                    self._save_state()
+                    logger.info(f"Up to date with the source at seq {self.state['seq']}")
+                    if once:
+                        return
+                elif kind != HEARTBEAT:
+                    raise ProtocolError(f"unknown frame {kind!r}")
+                metrics.flush()
+        finally:
+            done.set()
+
+    def run(self, connect, once=False):
+        # reconnects with growing pauses until stopped; `connect` returns a new connection
+        wait = RECONNECT_SECONDS
+        while True:
+            connection = connect()
+            started = time.monotonic()
+            try:
+                self.session(connection, once)
+                if once:
+                    return 0
+            except (ConnectionError, ProtocolError, OSError, ValueError, zlib.error) as e:
+                logger.error(f"Replication interrupted: {e}")
+            finally:
+                connection.close()
+            if once:
+                return 1
+            # a connection that worked for a while starts the backoff over
+            if time.monotonic() - started > MAX_RECONNECT_SECONDS:
+                wait = RECONNECT_SECONDS
+            logger.info(f"Reconnecting in {wait:.0f}s")
+            time.sleep(wait)
+            wait = min(wait * 2, MAX_RECONNECT_SECONDS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replicate data_sorted from the source host as it changes")
+    commands = parser.add_subparsers(dest="command", required=True)
+    send = commands.add_parser("send", help="source side, speaks the protocol on stdin/stdout")
+    send.add_argument("source", nargs="?", default=str(sorter.DATA_SORTED_DIR))
+    send.add_argument("--journal", default=os.environ.get("REPLICATION_JOURNAL", "./replication-journal.sqlite"))
+    send.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS)
+    send.add_argument("--level", type=int, default=COMPRESS_LEVEL, help="zlib compression level")
+    send.add_argument("--once", action="store_true", help="send what changed and exit, don't watch")
+    pull = commands.add_parser("pull", help="target side, starts the sender and applies its changes")
+    pull.add_argument("dest", nargs="?", default=str(sorter.DATA_SORTED_DIR))
+    source = pull.add_mutually_exclusive_group(required=True)
+    source.add_argument("--host", help="source host, reached with ssh")
+    source.add_argument("--command", help="sender command to run instead of ssh, e.g. a local 'replication.py send'")
+    pull.add_argument("--source", default="~/data_sorted", help="data_sorted directory on the source host")
+    pull.add_argument("--remote-script", default=REMOTE_SCRIPT, help="replication.py on the source host")
+    pull.add_argument("--state", help="state file (default <dest>.replication-state.json)")
+    pull.add_argument("--once", action="store_true", help="exit once caught up")
+    args = parser.parse_args(argv)
+
+    # stdout carries the protocol when sending, logs go to stderr
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    if args.command == "send":
+        journal = Journal(args.journal, args.source)
+        sender = Sender(args.source, journal, args.debounce, args.level)
+        signal.signal(signal.SIGTERM, sender.stop)
+        signal.signal(signal.SIGINT, sender.stop)
+        try:
+            sender.serve(sys.stdin.buffer, sys.stdout.buffer, once=args.once)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Receiver disconnected")
+        finally:
+            journal.close()
+        return 0
+
+    if args.host:
+        argv = ssh_command(args.host, args.source, args.remote_script)
+        if args.once:
+            argv[-1] += " --once"
+    else:
+        argv = shlex.split(args.command)
+    receiver = Receiver(args.dest, args.state)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    return receiver.run(lambda: CommandConnection(argv), once=args.once)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+import pymysql
+from flask import Response, request, make_response
+
+from db_pool import get_pool
+from pagination import quote_identifier
+
+logger = logging.getLogger(__name__)
+
+# bumped by every write to a table, responses are keyed on the versions they were built from
+VERSIONS_TABLE = "_table_versions"
+# how often a worker re-reads the versions, i.e. the longest a write by another process goes unseen
+VERSION_POLL_INTERVAL = 1.0
+# upper bound for an entry's life even if a writer forgot to bump a version
+CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", 300))
+CACHE_MAX_ENTRIES = 1024
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# responses larger than this are not cached
+CACHE_MAX_ENTRY_BYTES = 32 * 1024 * 1024
+# optional SQLite file shared by all gunicorn workers of this host
+SHARED_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH")
+SHARED_CACHE_MAX_ENTRIES = 10000
+# requests with these parameters are never cached (streamed exports, profiling)
+UNCACHED_PARAMS = {"format", "profile"}
+
+# ER_NO_SUCH_TABLE
+_NO_SUCH_TABLE = 1146
+_versions_table_ready = False
+
+
+def ensure_versions_table(cursor):
+    global _versions_table_ready
+    if not _versions_table_ready:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote_identifier(VERSIONS_TABLE)} ("
+            " table_name VARCHAR(64) NOT NULL PRIMARY KEY,"
+            " version BIGINT UNSIGNED NOT NULL)")
+        _versions_table_ready = True
+
+
+def bump_table_versions(cursor, tables):
+    """Mark `tables` as changed; call inside the writing transaction."""
+    tables = sorted(set(tables))
+    if not tables:
+        return
+    ensure_versions_table(cursor)
+    cursor.executemany(
+        f"INSERT INTO {quote_identifier(VERSIONS_TABLE)} (table_name, version) VALUES (%s, 1) "
+        "ON DUPLICATE KEY UPDATE version = version + 1", [(table,) for table in tables])
+
+
+class TableVersions:
+    """The version counter of every table, re-read at most every `poll_interval` seconds."""
+
+    def __init__(self, poll_interval=VERSION_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self._versions = {}
+        self._checked = float("-inf")
+        self._lock = threading.Lock()
+
+    def get(self):
+        if time.monotonic() - self._checked < self.poll_interval:
+            return self._versions
+        with self._lock:
+            if time.monotonic() - self._checked >= self.poll_interval:
+                self._versions = self._load()
+                self._checked = time.monotonic()
+            return self._versions
+
+    def _load(self):
+        try:
+            with get_pool().connection() as connection:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT table_name, version FROM {quote_identifier(VERSIONS_TABLE)}")
+                    return dict(cursor.fetchall())
+        except pymysql.MySQLError as e:
+            if e.args[0] == _NO_SUCH_TABLE:
+                return {}
+            raise
+
+    def invalidate(self):
+        # re-read on next access, e.g. after this worker wrote
+        self._checked = float("-inf")
+
+
+class MemoryCache:
+    """Thread-safe LRU of responses, bounded by entry count and total bytes, with a TTL."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class SharedCache:
+    """Response store in a local SQLite file, shared by the worker processes of one host."""
+
+    def __init__(self, path, max_entries=SHARED_CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._puts = 0
+        db = self._db()
+        db.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, expires REAL NOT NULL, value BLOB NOT NULL)")
+        db.execute("CREATE INDEX IF NOT EXISTS ix_responses_expires ON responses (expires)")
+
+    def _db(self):
+        # one connection per thread and process
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def get(self, key):
+        try:
+            row = self._db().execute(
+                "SELECT value FROM responses WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Shared response cache unavailable: {e}")
+            return None
+        return pickle.loads(row[0]) if row else None
+
+    def put(self, key, value):
+        try:
+            db = self._db()
+            db.execute("INSERT OR REPLACE INTO responses (key, expires, value) VALUES (?, ?, ?)",
+                       (key, time.time() + self.ttl, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            self._puts += 1
+            if self._puts % 100 == 0:
+                db.execute("DELETE FROM responses WHERE expires <= ?", (time.time(),))
+                db.execute("DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                           "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        except sqlite3.Error as e:
+            logger.warning(f"Shared response cache unavailable: {e}")
+
+
+versions = TableVersions()
+memory = MemoryCache()
+shared = SharedCache(SHARED_CACHE_PATH) if SHARED_CACHE_PATH else None
+
+
+def _cache_key(table_versions):
+    args = sorted(request.args.items(multi=True))
+    raw = repr((request.path, args, table_versions))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def cached(table_arg=None):
+    """Cache successful responses of a GET view.
+
+    The key holds the endpoint, its query parameters and the version of the
+    table named by the view argument `table_arg`, or of all tables if None.
+    A write that bumps a version makes every response built on it unreachable.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if UNCACHED_PARAMS.intersection(request.args.keys()):
+                return view(*args, **kwargs)
+            try:
+                all_versions = versions.get()
+            except Exception as e:
+                logger.warning(f"Table versions unavailable, not caching: {e}")
+                return view(*args, **kwargs)
+            if table_arg is None:
+                table_versions = tuple(sorted(all_versions.items()))
+            else:
+                table_versions = all_versions.get(kwargs[table_arg], 0)
+            key = _cache_key(table_versions)
+
+            hit = memory.get(key)
+            if hit is None and shared is not None:
+                hit = shared.get(key)
+                if hit is not None:
+                    memory.put(key, hit, len(hit[2]))
+            if hit is not None:
+                status, mimetype, body = hit
+                response = Response(body, status=status, mimetype=mimetype)
+                response.headers["X-Cache"] = "HIT"
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                body = response.get_data()
+                if len(body) <= CACHE_MAX_ENTRY_BYTES:
+                    value = (response.status_code, response.mimetype, body)
+                    memory.put(key, value, len(body))
+                    if shared is not None:
+                        shared.put(key, value)
+            response.headers["X-Cache"] = "MISS"
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,262 @@
+import re
+import sys
+import json
+import hashlib
+import logging
+import argparse
+from pathlib import Path
+
+import pymysql
+
+from db_pool import get_pool
+from pagination import quote_identifier
+from search_index import ensure_search_index
+from response_cache import bump_table_versions
+from table_generator import (PRIMARY_KEY_COLUMN, PRIMARY_KEY_TYPE, column_definition, create_table_sql,
+                             index_definition, table_spec)
+
+logger = logging.getLogger(__name__)
+
+SCHEMAS_DIR = Path('./schemas')
+# history of applied migrations, one row per schema save that changed a table
+MIGRATIONS_TABLE = "_schema_migrations"
+
+# DESCRIBE reports the storage type, not the name used in CREATE TABLE
+TYPE_ALIASES = {
+    "boolean": "tinyint(1)",
+    "bool": "tinyint(1)",
+    "integer": "int",
+    "json": "longtext",
+}
+_INT_WIDTH_RE = re.compile(r"^(tinyint|smallint|mediumint|int|bigint)\(\d+\)")
+# characters a string column can hold, to avoid narrowing a column holding data
+_STRING_CAPACITY = {"tinytext": 255, "text": 65535, "mediumtext": 16777215, "longtext": 4294967295}
+_VARCHAR_RE = re.compile(r"^varchar\((\d+)\)$")
+# ER_ALTER_OPERATION_NOT_SUPPORTED, ER_ALTER_OPERATION_NOT_SUPPORTED_REASON
+_NOT_ONLINE_ERRORS = (1845, 1846)
+# ER_DUP_ENTRY: a unique index cannot be built over duplicate values
+_DUPLICATE_ERRORS = (1062,)
+# tried in order for every ALTER TABLE, the last one lets MariaDB choose
+ONLINE_DDL_CLAUSES = (", ALGORITHM=INSTANT", ", ALGORITHM=INPLACE, LOCK=NONE", "")
+
+
+def normalize_type(sql_type):
+    sql_type = " ".join(sql_type.lower().split())
+    sql_type = TYPE_ALIASES.get(sql_type, sql_type)
+    return _INT_WIDTH_RE.sub(r"\1", sql_type)
+
+
+def _string_capacity(sql_type):
+    match = _VARCHAR_RE.match(sql_type)
+    if match:
+        return int(match.group(1))
+    return _STRING_CAPACITY.get(sql_type)
+
+
+def needs_modify(live_type, wanted_type):
+    live_type, wanted_type = normalize_type(live_type), normalize_type(wanted_type)
+    if live_type == wanted_type:
+        return False
+    live_capacity, wanted_capacity = _string_capacity(live_type), _string_capacity(wanted_type)
+    # a string column is never narrowed, it may already hold longer values
+    if live_capacity is not None and wanted_capacity is not None and live_capacity >= wanted_capacity:
+        return False
+    return True
+
+
+def live_columns(cursor, table):
+    # {column: (type, key, extra)} as stored, or None if the table does not exist
+    cursor.execute("SHOW TABLES LIKE %s", (table,))
+    if cursor.fetchone() is None:
+        return None
+    cursor.execute(f"SHOW COLUMNS FROM {quote_identifier(table)}")
+    return {row[0]: (row[1], row[3], row[5]) for row in cursor.fetchall()}
+
+
+def live_indexes(cursor, table):
+    cursor.execute(f"SHOW INDEX FROM {quote_identifier(table)}")
+    return {row[2].lower() for row in cursor.fetchall()}
+
+
+def _alter(table, clauses):
+    return f"ALTER TABLE {quote_identifier(table)} " + ", ".join(clauses)
+
+
+def plan_migration(cursor, table, spec):
+    """Statements that bring `table` to the layout `spec`, without losing any data.
+
+    Returns {"table", "create", "add", "modify", "rename", "indexes",
+    "orphaned", "statements"}. Columns of an older layout are renamed to
+    their path-qualified name; columns no longer in the schema are reported
+    as orphaned and kept, with their data; nothing is ever dropped.
+    """
+    live = live_columns(cursor, table)
+    plan = {"table": table, "create": live is None, "add": [], "modify": [], "rename": [],
+            "indexes": [], "orphaned": [], "statements": []}
+    if live is None:
+        plan["statements"].append(create_table_sql(table, spec))
+        return plan
+
+    # column names are case-insensitive in MariaDB
+    live_by_name = {name.lower(): (name,) + details for name, details in live.items()}
+    wanted = {column.name.lower() for column in spec.columns + spec.generated}
+    wanted.add(PRIMARY_KEY_COLUMN.lower())
+    changes, adds = [], []
+    for column in spec.columns:
+        existing = live_by_name.get(column.name.lower())
+        legacy = live_by_name.get(column.legacy.lower()) if column.legacy else None
+        if existing is None and legacy is not None and legacy[0].lower() not in wanted:
+            # leaf-named column of the previous layout, keep its data under the new name
+            plan["rename"].append({"column": legacy[0], "to": column.name, "type": column.sql_type})
+            changes.append(f"CHANGE COLUMN {quote_identifier(legacy[0])} {column_definition(column)}")
+            wanted.add(legacy[0].lower())
+        elif existing is None:
+            plan["add"].append({"column": column.name, "type": column.sql_type})
+            adds.append(f"ADD COLUMN {column_definition(column)}")
+        elif needs_modify(existing[1], column.sql_type):
+            plan["modify"].append({"column": existing[0], "from": existing[1], "type": column.sql_type})
+            changes.append(f"MODIFY COLUMN {column_definition(column._replace(name=existing[0]))}")
+    generated = []
+    for column in spec.generated:
+        if column.name.lower() not in live_by_name:
+            plan["add"].append({"column": column.name, "type": column.sql_type, "generated": column.expression})
+            generated.append(f"ADD COLUMN {column_definition(column)}")
+    renamed = {change["column"].lower() for change in plan["rename"]}
+    plan["orphaned"] = [name for name in live if name.lower() not in wanted and name.lower() not in renamed]
+
+    if changes:
+        plan["statements"].append(_alter(table, changes))
+    if adds:
+        plan["statements"].append(_alter(table, adds))
+    if generated:
+        plan["statements"].append(_alter(table, generated))
+    if not any(details[1] == "PRI" for details in live.values()):
+        if PRIMARY_KEY_COLUMN.lower() not in live_by_name:
+            plan["add"].append({"column": PRIMARY_KEY_COLUMN, "type": PRIMARY_KEY_TYPE})
+            plan["statements"].append(_alter(table, [
+                f"ADD COLUMN {quote_identifier(PRIMARY_KEY_COLUMN)} {PRIMARY_KEY_TYPE} PRIMARY KEY FIRST"]))
+    existing_indexes = live_indexes(cursor, table)
+    for index in spec.indexes:
+        if index.name.lower() not in existing_indexes:
+            plan["indexes"].append(index.name)
+            # one per statement, so a unique index over duplicates only skips itself
+            plan["statements"].append(_alter(table, [f"ADD {index_definition(index)}"]))
+    return plan
+
+
+def _strict_sql_mode(cursor):
+    cursor.execute("SELECT @@SESSION.sql_mode")
+    modes = [mode for mode in cursor.fetchone()[0].split(",") if mode]
+    if "STRICT_ALL_TABLES" not in modes:
+        modes.append("STRICT_ALL_TABLES")
+    return ",".join(modes)
+
+
+def _execute_online(cursor, statement, sql_mode):
+    if not statement.startswith("ALTER TABLE"):
+        cursor.execute(statement)
+        return statement
+    # in strict mode a conversion that would truncate or mangle stored values fails instead
+    prefix = f"SET STATEMENT sql_mode = '{sql_mode}' FOR "
+    for clause in ONLINE_DDL_CLAUSES:
+        try:
+            cursor.execute(prefix + statement + clause)
+            return statement + clause
+        except pymysql.MySQLError as e:
+            if not clause or e.args[0] not in _NOT_ONLINE_ERRORS:
+                raise
+            logger.info(f"'{clause.strip(', ')}' not possible for {statement}: {e.args[1]}")
+
+
+def ensure_migrations_table(cursor):
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {quote_identifier(MIGRATIONS_TABLE)} ("
+        " id INT AUTO_INCREMENT PRIMARY KEY,"
+        " table_name VARCHAR(64) NOT NULL,"
+        " schema_sha1 CHAR(40) NOT NULL,"
+        " statements LONGTEXT NOT NULL,"
+        " applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,"
+        " KEY ix_table_name (table_name))")
+
+
+def migrate(cursor, table, schema, dry_run=False):
+    """Create or alter `table` to match the parsed JSON `schema`.
+
+    With `dry_run` the plan is only computed. Applied migrations are logged
+    in MIGRATIONS_TABLE together with a hash of the schema.
+    """
+    plan = plan_migration(cursor, table, table_spec(schema))
+    plan["dryRun"] = dry_run
+    plan["skipped"] = []
+    if dry_run or not plan["statements"]:
+        return plan
+
+    sql_mode = _strict_sql_mode(cursor)
+    executed = []
+    for statement in plan["statements"]:
+        logger.info(f'DB QUERY: {statement}')
+        try:
+            executed.append(_execute_online(cursor, statement, sql_mode))
+        except pymysql.MySQLError as e:
+            if e.args[0] not in _DUPLICATE_ERRORS:
+                raise
+            logger.warning(f"Skipped {statement}: {e.args[1]}")
+            plan["skipped"].append({"statement": statement, "error": e.args[1]})
+    plan["statements"] = executed
+    if not executed:
+        return plan
+
+    ensure_migrations_table(cursor)
+    schema_sha1 = hashlib.sha1(json.dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()
+    cursor.execute(
+        f"INSERT INTO {quote_identifier(MIGRATIONS_TABLE)} (table_name, schema_sha1, statements) "
+        "VALUES (%s, %s, %s)", (table, schema_sha1, json.dumps(executed)))
+    bump_table_versions(cursor, [table])
+    return plan
+
+
+def migration_history(cursor, table):
+    cursor.execute("SHOW TABLES LIKE %s", (MIGRATIONS_TABLE,))
+    if cursor.fetchone() is None:
+        return []
+    cursor.execute(
+        f"SELECT id, schema_sha1, statements, applied_at FROM {quote_identifier(MIGRATIONS_TABLE)} "
+        "WHERE table_name = %s ORDER BY id", (table,))
+    return [{"id": row[0], "schemaSha1": row[1], "statements": json.loads(row[2]), "appliedAt": str(row[3])}
+            for row in cursor.fetchall()]
+
+
+def migrate_table(table, schema, dry_run=False):
+    # migrate one table on a pooled connection, keeping its search indexes in step
+    with get_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            plan = migrate(cursor, table, schema, dry_run)
+            if not dry_run:
+                # FULLTEXT indexes used by /api/search
+                ensure_search_index(cursor, table)
+        connection.commit()
+    return plan
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bring the tables in line with the JSON schemas, without dropping data")
+    parser.add_argument("schemas", nargs="*", help=f"schema names, default all in {SCHEMAS_DIR}")
+    parser.add_argument("--dry-run", action="store_true", help="only print the statements")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    names = args.schemas or [path.relative_to(SCHEMAS_DIR).with_suffix('').as_posix()
+                             for path in sorted(SCHEMAS_DIR.glob('**/*.json'))]
+    for name in names:
+        with open(SCHEMAS_DIR / f"{name}.json", "r", encoding="utf-8") as f:
+            schema = json.load(f)
+        plan = migrate_table(name, schema, args.dry_run)
+        for statement in plan["statements"]:
+            print(f"{name}: {statement}")
+        if plan["orphaned"]:
+            print(f"{name}: kept columns no longer in the schema: {', '.join(plan['orphaned'])}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,222 @@
+import re
+import json
+import logging
+
+from pagination import quote_identifier
+from table_generator import PRIMARY_KEY_COLUMN
+
+logger = logging.getLogger(__name__)
+
+# FULLTEXT indexes created by this module are named ft_search, ft_search_1, ...
+SEARCH_INDEX_PREFIX = "ft_search"
+# InnoDB caps the number of key parts of an index
+MAX_FULLTEXT_COLUMNS = 16
+TEXT_TYPES = ("char", "varchar", "tinytext", "text", "mediumtext", "longtext")
+
+DEFAULT_SEARCH_LIMIT = 100
+MAX_SEARCH_LIMIT = 1000
+
+# innodb_ft_min_token_size defaults to 3, shorter words are never indexed
+MIN_TOKEN_SIZE = 3
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# a term that could be part of a number, date or time; those columns are not in the FULLTEXT index
+_SCALAR_TERM_RE = re.compile(r"[\s.:+-]*\d[\d\s.:+-]*")
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def _internal(table):
+    # bookkeeping tables (_table_versions, _schema_migrations, ...) hold no records
+    return table.startswith("_")
+
+
+def table_layout(cursor, tables=None):
+    # all columns, the FULLTEXT-capable ones and the other ("scalar") ones for every data table, in one query
+    query = ("SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS "
+             "WHERE TABLE_SCHEMA = DATABASE()")
+    params = []
+    if tables:
+        query += f" AND TABLE_NAME IN ({', '.join(['%s'] * len(tables))})"
+        params.extend(tables)
+    cursor.execute(query + " ORDER BY TABLE_NAME, ORDINAL_POSITION", params)
+    layout = {}
+    for table, column, data_type in cursor.fetchall():
+        if _internal(table):
+            continue
+        entry = layout.setdefault(table, {"columns": [], "text": [], "scalar": []})
+        entry["columns"].append(column)
+        if data_type.lower() in TEXT_TYPES:
+            entry["text"].append(column)
+        elif column != PRIMARY_KEY_COLUMN:
+            entry["scalar"].append(column)
+    return layout
+
+
+def search_indexes(cursor, tables=None):
+    # {table: [[columns of ft_search], [columns of ft_search_1], ...]}
+    query = ("SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+             "WHERE TABLE_SCHEMA = DATABASE() AND INDEX_TYPE = 'FULLTEXT' AND INDEX_NAME LIKE %s")
+    params = [SEARCH_INDEX_PREFIX + "%"]
+    if tables:
+        query += f" AND TABLE_NAME IN ({', '.join(['%s'] * len(tables))})"
+        params.extend(tables)
+    cursor.execute(query + " ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX", params)
+    indexes = {}
+    for table, index_name, column in cursor.fetchall():
+        if _internal(table):
+            continue
+        indexes.setdefault(table, {}).setdefault(index_name, []).append(column)
+    return {table: list(by_name.values()) for table, by_name in indexes.items()}
+
+
+def ensure_search_index(cursor, table):
+    """Create (or rebuild) the FULLTEXT indexes covering every text column of `table`.
+
+    InnoDB maintains FULLTEXT indexes on every INSERT/UPDATE/DELETE, so once
+    they exist records are searchable as soon as they are ingested.
+    """
+    layout = table_layout(cursor, [table]).get(table)
+    if layout is None:
+        return False
+    wanted = _chunks(layout["text"], MAX_FULLTEXT_COLUMNS)
+    existing = search_indexes(cursor, [table]).get(table, [])
+    if sorted(existing) == sorted(wanted):
+        return False
+
+    cursor.execute(
+        "SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME LIKE %s",
+        (table, SEARCH_INDEX_PREFIX + "%"))
+    for (index_name,) in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {quote_identifier(table)} DROP INDEX {quote_identifier(index_name)}")
+    # InnoDB only builds one FULLTEXT index per ALTER TABLE
+    for i, columns in enumerate(wanted):
+        index_name = SEARCH_INDEX_PREFIX if i == 0 else f"{SEARCH_INDEX_PREFIX}_{i}"
+        cols = ", ".join(quote_identifier(col) for col in columns)
+        query = f"ALTER TABLE {quote_identifier(table)} ADD FULLTEXT INDEX {quote_identifier(index_name)} ({cols})"
+        logger.info(f'DB QUERY: {query}')
+        cursor.execute(query)
+    return True
+
+
+def boolean_query(term):
+    # every word must match, as a prefix; operators in the input are dropped
+    tokens = [token for token in _TOKEN_RE.findall(term) if len(token) >= MIN_TOKEN_SIZE]
+    if not tokens:
+        return None
+    return " ".join(f"+{token}*" for token in tokens)
+
+
+def fulltext_answers(term):
+    # the index only holds whole words of MIN_TOKEN_SIZE or more, a shorter one is never found in it
+    tokens = _TOKEN_RE.findall(term)
+    return bool(tokens) and all(len(token) >= MIN_TOKEN_SIZE for token in tokens)
+
+
+def _match(indexes):
+    return [f"MATCH({', '.join(quote_identifier(col) for col in cols)}) AGAINST (%s IN BOOLEAN MODE)"
+            for cols in indexes]
+
+
+def _json_object(columns):
+    return "JSON_OBJECT(" + ", ".join(
+        f"%s, {quote_identifier(col)}" for col in columns) + ")"
+
+
+def indexed_search(cursor, term, tables=None, limit=DEFAULT_SEARCH_LIMIT, indexes=None, layout=None):
+    """Ranked search over the FULLTEXT indexes of all (or the given) tables.
+
+    Issues a single UNION ALL query; each branch is answered from its
+    table's FULLTEXT index and contributes at most `limit` rows. Tables
+    without a search index are not searched here, see search().
+    """
+    query_text = boolean_query(term)
+    if query_text is None:
+        return None
+    if indexes is None:
+        indexes = search_indexes(cursor, tables)
+    if not indexes:
+        return []
+    if layout is None:
+        layout = table_layout(cursor, list(indexes))
+
+    branches = []
+    params = []
+    for table, table_indexes in sorted(indexes.items()):
+        columns = layout[table]["columns"]
+        matches = _match(table_indexes)
+        branches.append(
+            f"(SELECT %s AS tbl, {' + '.join(matches)} AS score, {_json_object(columns)} AS data "
+            f"FROM {quote_identifier(table)} WHERE {' OR '.join(matches)} "
+            f"ORDER BY score DESC LIMIT %s)")
+        params.append(table)
+        params.extend([query_text] * len(matches))
+        params.extend(columns)
+        params.extend([query_text] * len(matches))
+        params.append(limit)
+
+    query = " UNION ALL ".join(branches) + " ORDER BY score DESC LIMIT %s"
+    params.append(limit)
+    cursor.execute(query, params)
+    return [{"table": table, "score": float(score), "data": json.loads(data)}
+            for table, score, data in cursor.fetchall()]
+
+
+def scan_search(cursor, term, tables=None, limit=DEFAULT_SEARCH_LIMIT, layout=None):
+    # unindexed substring scan, for tables without a search index and terms the FULLTEXT parser ignores
+    if layout is None:
+        layout = table_layout(cursor, tables)
+    results = []
+    for table, entry in sorted(layout.items()):
+        columns = entry["columns"]
+        if len(results) >= limit:
+            break
+        concat = ", ".join(quote_identifier(col) for col in columns)
+        query = (f"SELECT * FROM {quote_identifier(table)} "
+                 f"WHERE CONCAT_WS(' ', {concat}) LIKE %s LIMIT %s")
+        cursor.execute(query, (f"%{term}%", limit - len(results)))
+        for row in cursor.fetchall():
+            results.append({"table": table, "score": 0.0, "data": dict(zip(columns, row))})
+    return results
+
+
+def search(cursor, term, tables=None, limit=DEFAULT_SEARCH_LIMIT):
+    """Search every data table (or the given ones) for `term`.
+
+    Tables with a search index are answered from it, ranked. Tables that
+    have none yet (created before search indexes, or without text columns)
+    are scanned, and their hits follow the ranked ones. So are all tables
+    for a term with words shorter than MIN_TOKEN_SIZE, and tables with
+    number or date columns for a term that could match one of those, as
+    the index holds neither.
+    """
+    layout = table_layout(cursor, tables)
+    if not layout:
+        return []
+    if not fulltext_answers(term):
+        return scan_search(cursor, term, limit=limit, layout=layout)
+    indexes = search_indexes(cursor, list(layout))
+    if _SCALAR_TERM_RE.fullmatch(term):
+        indexes = {table: found for table, found in indexes.items() if not layout[table]["scalar"]}
+    results = indexed_search(cursor, term, limit=limit, indexes=indexes, layout=layout)
+    unindexed = {table: entry for table, entry in layout.items() if table not in indexes}
+    if unindexed and len(results) < limit:
+        results += scan_search(cursor, term, limit=limit - len(results), layout=unindexed)
+    return results
+
+
+if __name__ == "__main__":
+    # backfill the search indexes of all existing tables
+    from db_pool import get_pool
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    with get_pool().connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW TABLES")
+            for (table,) in cursor.fetchall():
+                if _internal(table):
+                    continue
+                if ensure_search_index(cursor, table):
+                    logger.info(f'SEARCH INDEX BUILT FOR {table}')
@@ -0,0 +1,284 @@
+import os
+import re
+import sys
+import json
+import errno
+import codecs
+import shutil
+import logging
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+RAW_DATA_DIR = Path(os.environ.get("NEXTCLOUD_DATA_DIR", "./nextcloud_dir")) / "rawData"
+DATA_SORTED_DIR = Path('./data_sorted')
+SCHEMA_ID_KEY = "SchemaID"
+
+# how a sorted entry refers to its raw file: a symlink (default), a hardlink,
+# or a copy (which shares extents on filesystems with reflinks, e.g. btrfs or XFS)
+SYMLINK = "symlink"
+HARDLINK = "hardlink"
+COPY = "copy"
+LINK_MODES = (SYMLINK, HARDLINK, COPY)
+LINK_MODE = os.environ.get("SORT_LINK_MODE", SYMLINK)
+# hardlinks and copies don't know where they came from, so the raw path is kept next to them
+LOCATION_SUFFIX = ".location"
+
+# the file is read in growing chunks until SchemaID has been found
+READ_CHUNK = 64 * 1024
+# sorting is file system calls and a short parse, threads overlap the waits
+SORT_WORKERS = 8
+SORT_CHUNK_SIZE = 64
+
+_WS_RE = re.compile(r"[ \t\n\r]*")
+_STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_STRUCTURE_RE = re.compile(r'["{}\[\]]')
+_SCALAR_RE = re.compile(r"[^,}\]\s]*")
+_decoder = json.JSONDecoder()
+
+
+class _NeedMore(Exception):
+    # the buffer ends before the answer
+    pass
+
+
+def _skip_ws(buf, pos):
+    return _WS_RE.match(buf, pos).end()
+
+
+def _skip_string(buf, pos):
+    match = _STRING_RE.match(buf, pos)
+    if match is None:
+        raise _NeedMore()
+    return match.end()
+
+
+def _skip_value(buf, pos):
+    # end of the JSON value at `pos`, without building it
+    if pos >= len(buf):
+        raise _NeedMore()
+    char = buf[pos]
+    if char == '"':
+        return _skip_string(buf, pos)
+    if char in "{[":
+        depth = 0
+        while True:
+            match = _STRUCTURE_RE.search(buf, pos)
+            if match is None:
+                raise _NeedMore()
+            char = match.group()
+            if char == '"':
+                pos = _skip_string(buf, match.start())
+                continue
+            depth += 1 if char in "{[" else -1
+            pos = match.end()
+            if depth == 0:
+                return pos
+    end = _SCALAR_RE.match(buf, pos).end()
+    if end == len(buf):
+        # a number may go on in the next chunk
+        raise _NeedMore()
+    return end
+
+
+def _find_key(buf, key):
+    """Value of top-level `key` in the JSON text `buf`, or None if the object has none.
+
+    Raises _NeedMore if `buf` ends first and ValueError if it is not a JSON object.
+    """
+    pos = _skip_ws(buf, 0)
+    if pos >= len(buf):
+        raise _NeedMore()
+    if buf[pos] != "{":
+        raise ValueError("not a JSON object")
+    pos += 1
+    while True:
+        pos = _skip_ws(buf, pos)
+        if pos >= len(buf):
+            raise _NeedMore()
+        if buf[pos] == "}":
+            return None
+        if buf[pos] != '"':
+            raise ValueError(f"expected a key at offset {pos}")
+        end = _skip_string(buf, pos)
+        name = json.loads(buf[pos:end])
+        pos = _skip_ws(buf, end)
+        if pos >= len(buf):
+            raise _NeedMore()
+        if buf[pos] != ":":
+            raise ValueError(f"expected ':' at offset {pos}")
+        pos = _skip_ws(buf, pos + 1)
+        if name == key:
+            end = _skip_value(buf, pos)
+            return _decoder.decode(buf[pos:end])
+        pos = _skip_ws(buf, _skip_value(buf, pos))
+        if pos >= len(buf):
+            raise _NeedMore()
+        if buf[pos] == "}":
+            return None
+        if buf[pos] != ",":
+            raise ValueError(f"expected ',' at offset {pos}")
+        pos += 1
+
+
+def read_schema_id(path, chunk_size=READ_CHUNK):
+    """SchemaID of a raw record, reading only as much of the file as it takes.
+
+    Values before SchemaID are skipped over, not parsed; the rest of the
+    document is not read at all. Returns None if the record has no SchemaID.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buf = ""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            buf += decoder.decode(chunk, final=not chunk)
+            try:
+                return _find_key(buf, SCHEMA_ID_KEY)
+            except _NeedMore:
+                if not chunk:
+                    raise ValueError("unexpected end of file")
+            # fewer restarts on large documents
+            chunk_size *= 2
+
+
+def _valid_schema_id(schema_id):
+    # the id names a directory, it must not point anywhere else
+    return schema_id not in (".", "..") and "/" not in schema_id and os.sep not in schema_id and "\0" not in schema_id
+
+
+def _copy(source, target):
+    # copy_file_range lets the file system share extents instead of copying bytes
+    if hasattr(os, "copy_file_range"):
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(), 1 << 30):
+                    pass
+                return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                    raise
+    shutil.copyfile(source, target)
+
+
+def _write_location(target, location):
+    path = Path(str(target) + LOCATION_SUFFIX)
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(location)
+    os.replace(tmp, path)
+
+
+def _remove_location(target):
+    try:
+        os.unlink(str(target) + LOCATION_SUFFIX)
+    except FileNotFoundError:
+        pass
+
+
+def link_sorted(source, target, mode=LINK_MODE):
+    """Make `target` refer to the raw file `source` without rewriting it."""
+    location = os.path.realpath(source)
+    # build next to the target and rename, so readers never see half an entry
+    tmp = target.with_name(f".{target.name}.tmp")
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    if mode == HARDLINK:
+        try:
+            os.link(source, tmp)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            logger.warning(f"Cannot hardlink {source} ({e}), using a symlink")
+            mode = SYMLINK
+    if mode == COPY:
+        _copy(source, tmp)
+    if mode == SYMLINK:
+        os.symlink(location, tmp)
+        _remove_location(target)
+    else:
+        # before the entry appears, so ingestion always finds it
+        _write_location(target, location)
+    os.replace(tmp, target)
+
+
+def document_location(path):
+    # absolute path of the raw file a sorted entry stands for, None if unknown
+    path = Path(path)
+    if path.is_symlink():
+        return os.path.realpath(path)
+    try:
+        with open(str(path) + LOCATION_SUFFIX, "r", encoding="utf-8") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def sort_file(path, sorted_dir=DATA_SORTED_DIR, mode=LINK_MODE):
+    """Link a raw record into sorted_dir/<SchemaID>/.
+
+    Returns the sorted path, or None if the file has no usable SchemaID.
+    """
+    path = Path(path)
+    try:
+        schema_id = read_schema_id(path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Skipping {path}: {e}")
+        return None
+    if not schema_id:
+        logger.warning(f"No schema_id found in {path}")
+        return None
+    schema_id = str(schema_id)
+    if not _valid_schema_id(schema_id):
+        logger.warning(f"Skipping {path}: invalid schema_id '{schema_id}'")
+        return None
+
+    subfolder = Path(sorted_dir) / schema_id
+    subfolder.mkdir(parents=True, exist_ok=True)
+    target = subfolder / path.name
+    link_sorted(path, target, mode)
+    return target
+
+
+def sort_files(paths, sorted_dir=DATA_SORTED_DIR, mode=LINK_MODE, workers=SORT_WORKERS):
+    # sorted paths (None for skipped files) in the order of `paths`
+    paths = list(paths)
+    if workers <= 1 or len(paths) < SORT_CHUNK_SIZE:
+        return [sort_file(path, sorted_dir, mode) for path in paths]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda path: sort_file(path, sorted_dir, mode), paths))
+
+
+def remove_sorted(name, sorted_dir=DATA_SORTED_DIR):
+    # the raw file is gone, so its SchemaID is unknown: look in every schema folder
+    removed = []
+    for subfolder in Path(sorted_dir).iterdir():
+        target = subfolder / name
+        # lexists: the symlink of a deleted raw file dangles
+        if subfolder.is_dir() and os.path.lexists(target):
+            target.unlink()
+            _remove_location(target)
+            removed.append(target)
+    return removed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sort raw records into data_sorted/<SchemaID>/ once")
+    parser.add_argument("source", nargs="?", default=str(RAW_DATA_DIR))
+    parser.add_argument("--sorted", default=str(DATA_SORTED_DIR), help="data_sorted directory")
+    parser.add_argument("--link", choices=LINK_MODES, default=LINK_MODE, help="how sorted entries refer to raw files")
+    parser.add_argument("--workers", type=int, default=SORT_WORKERS)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    paths = [os.path.join(root, name) for root, _, files in os.walk(args.source)
+             for name in files if name.endswith(".json")]
+    sorted_paths = sort_files(paths, args.sorted, args.link, args.workers)
+    logger.info(f"Sorted {sum(1 for path in sorted_paths if path)} of {len(paths)} files")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import io
+import csv
+import json
+import logging
+
+from flask import Response
+
+from db_pool import TimedSSCursor, get_pool
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_ROWS = 1000
+
+STREAM_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _ndjson_chunk(columns, rows):
+    return "".join(
+        json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
+
+
+def _csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+def _generate(query, params, fmt, chunk_rows):
+    pool = get_pool()
+    entry = pool.acquire()
+    finished = False
+    try:
+        # SSCursor leaves the result set on the server and reads it off the
+        # socket as we go, so only one chunk is ever held in memory
+        cursor = entry.conn.cursor(TimedSSCursor)
+        cursor.execute(query, params)
+        columns = [desc[0] for desc in cursor.description]
+        if fmt == "csv":
+            yield _csv_chunk([columns])
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield _ndjson_chunk(columns, rows) if fmt == "ndjson" else _csv_chunk(rows)
+        cursor.close()
+        finished = True
+    except Exception as e:
+        logger.error(f'Error while streaming query results: {e}')
+        raise
+    finally:
+        # If the client went away mid-stream the rest of the result set is
+        # still pending on the connection; draining it could take minutes,
+        # so drop the connection instead of returning it to the pool.
+        pool.release(entry, discard=not finished)
+
+
+def stream_query(query, params, fmt, filename, chunk_rows=STREAM_CHUNK_ROWS):
+    """Stream the rows of `query` as NDJSON or CSV while they arrive from MariaDB."""
+    generator = _generate(query, params, fmt, chunk_rows)
+    # run the query up to the first chunk now, so SQL errors still produce a
+    # proper error response instead of a truncated 200
+    first = next(generator, "")
+
+    def body():
+        yield first
+        yield from generator
+
+    response = Response(body(), mimetype=STREAM_FORMATS[fmt])
+    response.call_on_close(generator.close)
+    response.headers["Content-Disposition"] = f'attachment; filename="{filename}.{fmt}"'
+    response.headers["X-Accel-Buffering"] = "no"  # let nginx pass chunks through
+    return response
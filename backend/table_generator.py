@@ -0,0 +1,188 @@
+import re
+import json
+import hashlib
+from collections import namedtuple
+from pathlib import Path
+
+from pagination import quote_identifier
+
+SCHEMAS_DIR = Path('./schemas')
+
+# surrogate key added to every table
+PRIMARY_KEY_COLUMN = "_id"
+PRIMARY_KEY_TYPE = "BIGINT UNSIGNED NOT NULL AUTO_INCREMENT"
+# every table gets the location of its source document
+DOCUMENT_LOCATION_COLUMN = "documentlocation"
+# records are upserted and deleted by this field, so it gets a unique index
+IDENTIFIER_FIELD = "Identifier"
+# nested properties are named parent_child
+PATH_SEPARATOR = "_"
+MAX_IDENTIFIER_LENGTH = 64
+
+DEFAULT_STRING_LENGTH = 255
+# longer strings are stored as TEXT, which does not count against the row size limit
+MAX_VARCHAR_LENGTH = 1024
+# column widths for string formats without maxLength
+FORMAT_LENGTHS = {
+    "date": 10,
+    "time": 32,
+    "date-time": 64,
+    "email": 320,
+    "hostname": 255,
+    "ipv4": 15,
+    "ipv6": 45,
+    "uuid": 36,
+    "uri": 2048,
+    "iri": 2048,
+}
+# TEXT/BLOB columns can only be indexed on a prefix
+INDEX_PREFIX_LENGTH = 255
+
+# schema annotations
+INDEX_KEYWORD = "x-index"
+UNIQUE_KEYWORD = "x-unique"
+# on a JSON (object/array) property: {"column": {"path": "$.a.b", "type": "string", "x-index": true}}
+GENERATED_KEYWORD = "x-generated-columns"
+
+# JSON paths accepted in generated columns, e.g. $.sample.weight or $.items[0]
+_JSON_PATH_RE = re.compile(r"^\$(\.[A-Za-z_][A-Za-z0-9_]*|\[\d+\])+$")
+
+Column = namedtuple("Column", ["name", "sql_type", "path", "legacy"])
+GeneratedColumn = namedtuple("GeneratedColumn", ["name", "sql_type", "expression"])
+Index = namedtuple("Index", ["name", "columns", "unique"])
+TableSpec = namedtuple("TableSpec", ["columns", "generated", "indexes"])
+
+
+def column_name(path):
+    # path-qualified name that fits MariaDB's identifier limit
+    name = PATH_SEPARATOR.join(path)
+    if len(name) > MAX_IDENTIFIER_LENGTH:
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+        name = name[:MAX_IDENTIFIER_LENGTH - 9] + "_" + digest
+    return name
+
+
+def index_name(prefix, column):
+    return column_name([prefix, column])
+
+
+def _string_type(details):
+    if "enum" in details and all(isinstance(value, str) for value in details["enum"]):
+        length = max([len(value) for value in details["enum"]] + [1])
+    elif isinstance(details.get("maxLength"), int):
+        length = details["maxLength"]
+    else:
+        length = FORMAT_LENGTHS.get(details.get("format"), DEFAULT_STRING_LENGTH)
+    if length > MAX_VARCHAR_LENGTH:
+        return "TEXT"
+    return f"VARCHAR({max(length, 1)})"
+
+
+def _integer_type(details):
+    minimum = details.get("minimum", 0)
+    maximum = details.get("maximum", 0)
+    if not isinstance(minimum, (int, float)) or not isinstance(maximum, (int, float)):
+        return "INT"
+    if minimum < -2 ** 31 or maximum > 2 ** 31 - 1:
+        return "BIGINT"
+    return "INT"
+
+
+def map_json_type_to_sql(details):
+    json_type = details.get("type", "string")
+    if json_type == "string":
+        return _string_type(details)
+    if json_type == "integer":
+        return _integer_type(details)
+    type_mapping = {
+        "number": "FLOAT",
+        "boolean": "BOOLEAN",
+        "file upload(string)": "VARCHAR(255)",
+        "object": "JSON",
+        "array": "JSON"
+    }
+    return type_mapping.get(json_type, "VARCHAR(255)")
+
+
+def extract_properties(properties, parent_path=()):
+    # [(path, details)] of the leaf properties; objects with properties are flattened
+    items = []
+    for key, value in properties.items():
+        path = parent_path + (key,)
+        if value.get('type') == 'object' and 'properties' in value:
+            items.extend(extract_properties(value['properties'], path))
+        else:
+            items.append((path, value))
+    return items
+
+
+def _indexed_key(column, sql_type):
+    key = quote_identifier(column)
+    sql_type = sql_type.upper()
+    width = re.match(r"VARCHAR\((\d+)\)", sql_type)
+    # InnoDB keys are limited to 3072 bytes, 4 bytes per utf8mb4 character
+    if "TEXT" in sql_type or "BLOB" in sql_type or (width and int(width.group(1)) > 768):
+        key += f"({INDEX_PREFIX_LENGTH})"
+    return key
+
+
+def table_spec(schema):
+    """Physical layout of the table for a parsed JSON schema.
+
+    Leaf properties become typed columns named by their path, annotated
+    properties get indexes, and JSON properties can expose paths as
+    indexed virtual columns. The auto-increment primary key is not part of
+    `columns`, it is added by create_table_sql().
+    """
+    columns = []
+    generated = []
+    indexes = []
+    for path, details in extract_properties(schema.get("properties", {})):
+        name = column_name(path)
+        sql_type = map_json_type_to_sql(details)
+        columns.append(Column(name, sql_type, path, path[-1] if len(path) > 1 else None))
+        if path == (IDENTIFIER_FIELD,) or details.get(UNIQUE_KEYWORD):
+            indexes.append(Index(index_name("ux", name), (_indexed_key(name, sql_type),), True))
+        elif details.get(INDEX_KEYWORD):
+            indexes.append(Index(index_name("ix", name), (_indexed_key(name, sql_type),), False))
+        if sql_type == "JSON":
+            for gen_name, gen in (details.get(GENERATED_KEYWORD) or {}).items():
+                if not _JSON_PATH_RE.match(str(gen.get('path', ''))):
+                    raise ValueError(f"Invalid JSON path for generated column '{gen_name}': {gen.get('path')}")
+                gen_name = column_name(path + (gen_name,))
+                gen_type = map_json_type_to_sql(gen)
+                # JSON_VALUE returns the scalar at the path, or NULL
+                expression = f"JSON_VALUE({quote_identifier(name)}, '{gen['path']}')"
+                generated.append(GeneratedColumn(gen_name, gen_type, expression))
+                if gen.get(INDEX_KEYWORD, True):
+                    indexes.append(Index(index_name("ix", gen_name), (_indexed_key(gen_name, gen_type),), False))
+    columns.append(Column(DOCUMENT_LOCATION_COLUMN, "VARCHAR(255)", (DOCUMENT_LOCATION_COLUMN,), None))
+    return TableSpec(columns, generated, indexes)
+
+
+def column_definition(column):
+    if isinstance(column, GeneratedColumn):
+        return f"{quote_identifier(column.name)} {column.sql_type} AS ({column.expression}) VIRTUAL"
+    return f"{quote_identifier(column.name)} {column.sql_type}"
+
+
+def index_definition(index):
+    kind = "UNIQUE INDEX" if index.unique else "INDEX"
+    return f"{kind} {quote_identifier(index.name)} ({', '.join(index.columns)})"
+
+
+def create_table_sql(table, spec):
+    parts = [f"{quote_identifier(PRIMARY_KEY_COLUMN)} {PRIMARY_KEY_TYPE} PRIMARY KEY"]
+    parts += [column_definition(column) for column in spec.columns]
+    parts += [column_definition(column) for column in spec.generated]
+    parts += [index_definition(index) for index in spec.indexes]
+    return f"CREATE TABLE IF NOT EXISTS {quote_identifier(table)} ({', '.join(parts)})"
+
+
+def load_table_spec(table, schemas_dir=SCHEMAS_DIR):
+    # layout of a table from its saved schema file, or None
+    try:
+        with open(Path(schemas_dir) / f"{table}.json", "r", encoding="utf-8") as f:
+            return table_spec(json.load(f))
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,99 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+from werkzeug.datastructures import MultiDict
+
+import analytics
+
+pytestmark = pytest.mark.skipif(not analytics.available(), reason="pyarrow is not installed")
+
+# SHOW COLUMNS rows of a table as table_generator creates it: (Field, Type, ...)
+COLUMNS = [
+    ("identifier", "varchar(255)"),
+    ("approved", "tinyint(1)"),
+    ("temperature", "decimal(10,2)"),
+    ("count", "int(11)"),
+    ("recorded", "datetime"),
+]
+ROWS = [
+    ("a", 1, Decimal("20.50"), 3, datetime.datetime(2024, 1, 1, 12, 0)),
+    ("b", 0, Decimal("21.00"), 5, datetime.datetime(2024, 1, 2, 12, 0)),
+    ("c", None, None, None, None),
+    ("d", 1, Decimal("19.25"), 7, datetime.datetime(2024, 1, 3, 12, 0)),
+]
+
+
+class FakeCursor:
+    # the parts of a pymysql cursor write_snapshot uses, with pymysql's value types
+
+    def __init__(self):
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        if query.startswith("SHOW COLUMNS"):
+            self._rows = [(name, sql_type, "YES", "", None, "") for name, sql_type in COLUMNS]
+        else:
+            self._rows = list(ROWS)
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchmany(self, size):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+
+    def cursor(self, cursor_class=None):
+        return FakeCursor()
+
+
+class FakeEntry:
+    conn = FakeConnection()
+
+
+class FakePool:
+
+    def __init__(self):
+        self.released = []
+
+    def acquire(self):
+        return FakeEntry()
+
+    def release(self, entry, discard=False):
+        self.released.append(discard)
+
+
+def test_snapshot_of_table_with_boolean_column(tmp_path):
+    pool = FakePool()
+    # chunks smaller than the table, so several row groups are written
+    assert analytics.write_snapshot("experiments", pool, tmp_path, chunk_rows=3) == len(ROWS)
+    assert pool.released == [False]
+
+    snapshot, _ = analytics.load_snapshot("experiments", tmp_path)
+    assert str(snapshot.schema.field("approved").type) == "bool"
+    assert snapshot.column("approved").to_pylist() == [True, False, None, True]
+    assert snapshot.column("temperature").to_pylist() == [20.5, 21.0, None, 19.25]
+
+    result = analytics.query("experiments", MultiDict([
+        ("group_by", "approved"), ("agg", "count"), ("agg", "mean:temperature")]), tmp_path)
+    groups = {group["approved"]: group for group in result["groups"]}
+    assert groups[True]["count"] == 2
+    assert groups[True]["mean:temperature"] == pytest.approx(19.875)
+    assert groups[False]["count"] == 1
+
+    result = analytics.query("experiments", MultiDict([("filter", "approved:true"), ("agg", "sum:count")]), tmp_path)
+    assert result["rows"] == 2
+    assert result["totals"]["sum:count"] == 10
@@ -0,0 +1,89 @@
+import os
+import runpy
+
+import pymysql
+import pytest
+
+import db_pool
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+        self.fail_rollback = False
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise pymysql.err.OperationalError(2006, "MySQL server has gone away")
+        self.rollbacks += 1
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(db_pool.ConnectionPool, "_open", lambda self: db_pool._PooledConnection(FakeConnection()))
+    pool = db_pool.ConnectionPool({}, max_size=2, timeout=0.05)
+    yield pool
+    pool.close()
+
+
+def test_connections_are_reused_and_rolled_back(pool):
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert second is first
+    # no transaction is handed over to the next user
+    assert first.rollbacks == 2
+    assert (pool.size, pool.idle) == (1, 1)
+
+
+def test_exhausted_pool_times_out(pool):
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(db_pool.PoolExhaustedError):
+        pool.acquire()
+    pool.release(held.pop())
+    assert pool.acquire().conn is not None
+
+
+def test_broken_connections_are_discarded(pool):
+    with pytest.raises(pymysql.err.OperationalError):
+        with pool.connection() as conn:
+            raise pymysql.err.OperationalError(2013, "Lost connection")
+    assert conn.closed and pool.size == 0
+
+    entry = pool.acquire()
+    entry.conn.fail_rollback = True
+    pool.release(entry)
+    assert entry.conn.closed and pool.size == 0
+
+
+def test_expired_connections_are_replaced(pool):
+    pool.max_lifetime = 0
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        pass
+    assert second is not first and first.closed
+    assert pool.size == 1
+
+
+def test_gevent_pools_share_the_connection_budget(monkeypatch):
+    monkeypatch.setenv("ADAMANT_WORKER_CLASS", "gevent")
+    monkeypatch.setenv("GUNICORN_WORKERS", "4")
+    monkeypatch.setenv("DB_CONNECTION_BUDGET", "100")
+    for key in ("POOL_SIZE", "POOL_TIMEOUT"):
+        # set first, so the value the config file sets is removed afterwards
+        monkeypatch.setenv(key, "")
+        monkeypatch.delenv(key)
+    runpy.run_path(os.path.join(BACKEND_DIR, "gunicorn.conf.py"))
+    assert os.environ["POOL_SIZE"] == "25"
@@ -0,0 +1,31 @@
+from form_fields import FormExtractor, conf_keywords
+
+URI = "data:image/png;base64,iVBORw0KGgo="
+
+
+def keys(data):
+    return [attachment["key"] for attachment in FormExtractor().extract(data).attachments]
+
+
+def test_list_entries_get_their_index():
+    assert keys({"files": [URI, "text", URI]}) == ["files_0", "files_2"]
+    assert keys({"runs": [{"files": [URI]}, {"files": [URI]}]}) == ["files_0_0", "files_1_0"]
+
+
+def test_repeated_keys_stay_unique():
+    assert keys({"x": {"a": URI}, "y": {"a": URI}, "z": {"a": URI}}) == ["a", "a_1", "a_2"]
+
+
+def test_numbered_name_already_taken():
+    # "a_1" exists as a key of its own, the second "a" must skip it
+    names = keys({"x": {"a": URI}, "a_1": URI, "y": {"a": URI}})
+    assert names == ["a", "a_1", "a_2"]
+    names = keys({"x": {"a": URI}, "a_2": URI, "y": {"a": URI}, "z": {"a": URI}})
+    assert len(set(names)) == len(names) == 4
+
+
+def test_keywords_outside_lists():
+    conf = {"confList": [{"requesterEmailKeyword": "email", "operatorNameKeyword": "operator"}]}
+    extractor = FormExtractor(conf_keywords(conf))
+    fields = extractor.extract({"meta": {"email": "a@b.c"}, "operator": ["ignored"], "list": [{"operator": "x"}]})
+    assert fields.values == {"email": "a@b.c", "operator": ["ignored"]}
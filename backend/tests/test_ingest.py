@@ -0,0 +1,146 @@
+import os
+import json
+from contextlib import contextmanager
+
+import ingest
+import registry
+import validation
+from manifest import Manifest
+
+# SHOW COLUMNS rows: (Field, Type, Null, Key, Default, Extra)
+COLUMNS = [
+    ("_id", "bigint(20)", "NO", "PRI", None, "auto_increment"),
+    ("Identifier", "varchar(255)", "YES", "UNI", None, ""),
+    ("sample_mass", "double", "YES", "", None, ""),
+    ("documentlocation", "text", "YES", "", None, ""),
+]
+
+
+class FakeCursor:
+
+    def __init__(self, log):
+        self.log = log
+        self.rowcount = 0
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.log.append((query, params))
+        if query.startswith("SHOW TABLES"):
+            self._rows = [(params[0],)] if params[0] == "samples" else []
+        elif query.startswith("SHOW COLUMNS"):
+            self._rows = list(COLUMNS)
+        elif query.startswith("DELETE"):
+            self.rowcount = len(params)
+
+    def executemany(self, query, rows):
+        self.log.append((query, list(rows)))
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return self._rows
+
+
+class FakeConnection:
+
+    def __init__(self, log):
+        self.log = log
+
+    def cursor(self):
+        return FakeCursor(self.log)
+
+    def commit(self):
+        self.log.append(("COMMIT", None))
+
+    def rollback(self):
+        self.log.append(("ROLLBACK", None))
+
+
+class FakePool:
+
+    def __init__(self):
+        self.log = []
+
+    @contextmanager
+    def connection(self):
+        yield FakeConnection(self.log)
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data))
+
+
+def statements(pool, prefix):
+    return [params for query, params in pool.log if query.startswith(prefix)]
+
+
+def test_read_row_follows_key_paths_and_links(tmp_path):
+    raw = tmp_path / "raw.json"
+    write(raw, {"Identifier": "s1", "sample": {"mass": 1.5}, "flag": True})
+    entry = tmp_path / "samples" / "s1.json"
+    entry.parent.mkdir()
+    os.symlink(raw, entry)
+    columns = ("Identifier", "sample_mass", "documentlocation", "flag")
+    row = ingest.read_row(entry, columns, key_paths=(None, ("sample", "mass"), None, None))
+    assert row == ("s1", 1.5, str(raw), 1)
+
+
+def test_sync_directory_upserts_changes_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    data_dir = tmp_path / "data_sorted"
+    write(data_dir / "samples" / "s1.json", {"Identifier": "s1", "sample_mass": 1.5})
+    write(data_dir / "samples" / "s2.json", {"Identifier": "s2"})
+    write(data_dir / "unknown" / "u1.json", {"Identifier": "u1"})
+    pool = FakePool()
+    ingester = ingest.Ingester(pool=pool, workers=1)
+    manifest = Manifest(tmp_path / "manifest.sqlite")
+
+    assert ingester.sync_directory(data_dir, manifest) == 2
+    upserts = statements(pool, "INSERT INTO `samples`")
+    assert len(upserts) == 1
+    # one batched upsert, the auto-increment key is left to MariaDB
+    assert sorted(row[:2] for row in upserts[0]) == [("s1", 1.5), ("s2", None)]
+    assert statements(pool, "INSERT INTO `_table_versions`") == [[("samples",)]]
+    # files of a table that doesn't exist yet are not recorded, the rest is
+    assert len(manifest) == 2
+
+    pool.log.clear()
+    assert ingester.sync_directory(data_dir, manifest) == 0
+    assert statements(pool, "INSERT INTO `samples`") == []
+
+    (data_dir / "samples" / "s2.json").unlink()
+    ingester.sync_directory(data_dir, manifest)
+    assert statements(pool, "DELETE FROM `samples`") == [["s2"]]
+    assert len(manifest) == 1
+
+
+def test_quarantined_files_load_once_fixed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    validator = validation.compile_schema(
+        {"$id": "samples", "properties": {"sample_mass": {"type": "number"}}})
+    monkeypatch.setattr(validation, "VALIDATION_MODE", validation.REJECT)
+    monkeypatch.setattr(registry.validators, "get", lambda: {"samples": validator})
+    data_dir = tmp_path / "data_sorted"
+    bad = data_dir / "samples" / "s1.json"
+    write(bad, {"Identifier": "s1", "sample_mass": "heavy"})
+    pool = FakePool()
+    ingester = ingest.Ingester(pool=pool, workers=1)
+    manifest = Manifest(tmp_path / "manifest.sqlite")
+
+    assert ingester.sync_directory(data_dir, manifest) == 0
+    assert validation.is_quarantined(bad, "samples")
+    # not recorded as processed, so the next run tries it again
+    assert len(manifest) == 0
+
+    write(bad, {"Identifier": "s1", "sample_mass": 1.5})
+    assert ingester.sync_directory(data_dir, manifest) == 1
+    assert not validation.is_quarantined(bad, "samples")
+    assert len(manifest) == 1
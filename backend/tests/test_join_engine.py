@@ -0,0 +1,71 @@
+from werkzeug.datastructures import MultiDict
+
+import join_engine
+from pagination import decode_cursor
+
+DESCRIBE = {
+    "runs": [("sample", "varchar(255)"), ("temperature", "double"), ("note", "text")],
+    "samples": [("_id", "bigint(20)"), ("Identifier", "varchar(255)"), ("mass", "double")],
+}
+
+
+class FakeCursor:
+
+    def __init__(self, indexes):
+        # SHOW INDEX rows per table: (Table, Non_unique, Key_name, Seq_in_index, Column_name)
+        self.indexes = indexes
+        self.queries = []
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+        if query.startswith("DESCRIBE"):
+            self._rows = DESCRIBE[query.split("`")[1]]
+        elif query.startswith("SHOW INDEX"):
+            self._rows = self.indexes.get(query.split("`")[1], [])
+        elif query.startswith("SELECT 1"):
+            self._rows = [(1,)]
+        else:
+            self._rows = [("s1", 20.0, None, 1, "s1", 1.5)]
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+def page(db_cursor, **args):
+    return join_engine.join_page(db_cursor, "runs", "samples", "sample", "Identifier", MultiDict(args))
+
+
+def join_sql(cursor):
+    return next((query, params) for query, params in cursor.queries if query.startswith("SELECT a."))
+
+
+def test_page_without_primary_key_has_a_total_order():
+    cursor = FakeCursor({})
+    result = page(cursor, limit="1")
+    query, params = join_sql(cursor)
+    # the join column alone is not unique, every column of the left table breaks ties
+    assert "ORDER BY `sample`, `temperature`, `note` LIMIT %s OFFSET %s" in query
+    assert query.endswith("ORDER BY a.`sample`, a.`temperature`, a.`note`")
+    assert params == [1, 0]
+    assert decode_cursor(result["next_cursor"]) == {"o": 1}
+
+    cursor = FakeCursor({})
+    page(cursor, limit="1", cursor=result["next_cursor"])
+    assert join_sql(cursor)[1] == [1, 1]
+
+
+def test_page_with_primary_key_seeks_after_the_last_key():
+    runs_key = [("runs", 0, "PRIMARY", 1, "sample"), ("runs", 1, "ix_join_sample", 1, "sample")]
+    cursor = FakeCursor({"runs": runs_key})
+    result = page(cursor, limit="1")
+    assert decode_cursor(result["next_cursor"]) == {"k": ["s1"]}
+
+    cursor = FakeCursor({"runs": runs_key})
+    page(cursor, limit="1", cursor=result["next_cursor"])
+    query, params = join_sql(cursor)
+    assert "WHERE" in query and "ORDER BY `sample` LIMIT %s)" in query
+    assert params == ["s1", 1]
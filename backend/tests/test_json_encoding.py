@@ -0,0 +1,29 @@
+import json
+import datetime
+from decimal import Decimal
+
+from flask import Flask, jsonify
+
+import json_encoding
+
+COLUMNS = ["identifier", "recorded", "day", "temperature", "note"]
+ROWS = [
+    ("a", datetime.datetime(2024, 1, 1, 12, 30), datetime.date(2024, 1, 1), Decimal("20.50"), "Grüße"),
+    ("b", None, None, None, None),
+]
+
+
+def test_records_match_jsonify():
+    payload = {"limit": 2, "columns": COLUMNS}
+    payload.update(json_encoding.shape_rows(COLUMNS, ROWS, json_encoding.RECORDS))
+    app = Flask(__name__)
+    with app.app_context():
+        expected = jsonify(payload).get_data()
+    assert json_encoding.json_response(payload).get_data() == expected
+
+
+def test_columnar_uses_iso_dates():
+    payload = {"columns": COLUMNS}
+    payload.update(json_encoding.shape_rows(COLUMNS, ROWS, json_encoding.COLUMNAR))
+    body = json.loads(json_encoding.json_response(payload, shape=json_encoding.COLUMNAR).get_data())
+    assert body["rows"][0][:4] == ["a", "2024-01-01T12:30:00", "2024-01-01", 20.5]
@@ -0,0 +1,105 @@
+import smtplib
+from email.message import EmailMessage
+
+import pytest
+
+import mail_queue
+
+
+class FakeSMTP:
+
+    def __init__(self, fail=None):
+        # recipient -> exception raised when sending to it
+        self.fail = fail or {}
+        self.sent = []
+
+    def send_message(self, msg):
+        if msg["To"] in self.fail:
+            raise self.fail[msg["To"]]
+        self.sent.append(msg["To"])
+
+
+class FakeSMTPPool:
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.discarded = False
+
+    def get(self, host):
+        return self.smtp
+
+    def put_back(self, host, smtp):
+        pass
+
+    def discard(self, smtp):
+        self.discarded = True
+
+    def close_idle(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def message(to):
+    msg = EmailMessage()
+    msg["To"] = to
+    msg["Subject"] = "Job request"
+    msg.set_content("body")
+    return msg
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return str(tmp_path / "mail-queue.sqlite")
+
+
+def worker(queue, smtp):
+    worker = mail_queue.MailWorker(queue)
+    worker.smtp = FakeSMTPPool(smtp)
+    return worker
+
+
+def statuses(job_id, queue):
+    return [m["status"] for m in mail_queue.job_status(job_id, queue)["messages"]]
+
+
+def test_queued_job_is_sent_by_a_worker(queue):
+    job_id = mail_queue.enqueue("smtp.example.org", [message("a@example.org"), message("b@example.org")], queue)
+    status = mail_queue.job_status(job_id, queue)
+    assert status["status"] == mail_queue.QUEUED
+    # nothing delivers the queue yet
+    assert "warning" in status
+    assert mail_queue.queue_stats(queue)[0] == 2
+
+    smtp = FakeSMTP()
+    assert worker(queue, smtp).run_once() == 2
+    assert smtp.sent == ["a@example.org", "b@example.org"]
+    status = mail_queue.job_status(job_id, queue)
+    assert status["status"] == mail_queue.SENT and "warning" not in status
+    assert mail_queue.queue_stats(queue)[0] == 0
+    assert mail_queue.job_status("unknown", queue) is None
+
+
+def test_refused_recipient_fails_only_its_message(queue, monkeypatch):
+    monkeypatch.setattr(mail_queue, "MAX_ATTEMPTS", 1)
+    job_id = mail_queue.enqueue("smtp.example.org", [message("bad@example.org"), message("a@example.org")], queue)
+    refused = smtplib.SMTPRecipientsRefused({"bad@example.org": (550, b"unknown")})
+    smtp = FakeSMTP({"bad@example.org": refused})
+    pool_worker = worker(queue, smtp)
+    pool_worker.run_once()
+    assert statuses(job_id, queue) == [mail_queue.FAILED, mail_queue.SENT]
+    assert not pool_worker.smtp.discarded
+
+
+def test_lost_connection_retries_the_rest_later(queue):
+    job_id = mail_queue.enqueue("smtp.example.org", [message("a@example.org"), message("b@example.org")], queue)
+    smtp = FakeSMTP({"a@example.org": smtplib.SMTPServerDisconnected("gone")})
+    pool_worker = worker(queue, smtp)
+    pool_worker.run_once()
+    assert pool_worker.smtp.discarded
+    status = mail_queue.job_status(job_id, queue)
+    assert statuses(job_id, queue) == [mail_queue.QUEUED, mail_queue.QUEUED]
+    assert [m["attempts"] for m in status["messages"]] == [1, 1]
+    # backed off, not due again yet
+    assert pool_worker.run_once() == 0
@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+import subprocess
+
+import pytest
+
+import metrics
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def busy(seconds=0.3):
+    until = time.time() + seconds
+    while time.time() < until:
+        sum(range(1000))
+
+
+def test_profiler_samples_the_calling_thread():
+    profiler = metrics.SamplingProfiler(interval=0.001).start()
+    busy()
+    folded = profiler.stop()
+    assert "busy (test_metrics.py:" in folded
+    # the sampler has exited, nothing is added after stop()
+    samples = dict(profiler.samples)
+    time.sleep(0.01)
+    assert profiler.samples == samples
+
+
+def test_profiler_under_gevent():
+    pytest.importorskip("gevent")
+    script = (
+        "from gevent import monkey; monkey.patch_all()\n"
+        "import metrics\n"
+        "from tests.test_metrics import busy\n"
+        "profiler = metrics.SamplingProfiler(interval=0.001).start()\n"
+        "busy()\n"
+        "print(profiler.stop())\n"
+    )
+    result = subprocess.run([sys.executable, "-c", script], cwd=BACKEND_DIR,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert "busy (test_metrics.py:" in result.stdout
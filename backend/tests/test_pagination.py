@@ -0,0 +1,44 @@
+import base64
+import datetime
+from decimal import Decimal
+
+import pytest
+
+import pagination
+
+
+def token(raw):
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def test_cursor_round_trips_key_types():
+    key = [datetime.datetime(2024, 1, 1, 12, 30, 0, 5), datetime.date(2024, 1, 1),
+           datetime.timedelta(hours=1, microseconds=7), Decimal("20.50"), b"\x00\xff", "s1", 3, None]
+    assert pagination.decode_cursor(pagination.encode_cursor({"k": key})) == {"k": key}
+
+
+@pytest.mark.parametrize("raw", ["1", "[]", '"k"', "null", "not json", '{"k": {"$date": 5}}'])
+def test_malformed_cursor_is_rejected(raw):
+    with pytest.raises(pagination.PaginationError):
+        pagination.decode_cursor(token(raw))
+
+
+@pytest.mark.parametrize("offset", ["10", -1, True, 1.5])
+def test_malformed_offset_is_rejected(offset):
+    with pytest.raises(pagination.PaginationError):
+        pagination.cursor_offset({"o": offset})
+
+
+def test_seek_clause_after_key():
+    assert pagination.seek_clause(["a", "_id"], [1, 5], False) == (
+        "(`a` > %s OR (`a` = %s AND `_id` > %s))", [1, 1, 5])
+    # NULLs come last descending
+    assert pagination.seek_clause(["a", "_id"], [1, 5], True) == (
+        "(`a` < %s OR (`a` = %s AND `_id` < %s) OR `a` IS NULL)", [1, 1, 5])
+
+
+def test_seek_clause_after_null():
+    # NULLs come first ascending, every non-NULL value follows
+    assert pagination.seek_clause(["a", "_id"], [None, 5], False) == (
+        "((`a` IS NULL AND `_id` > %s) OR `a` IS NOT NULL)", [5])
+    assert pagination.seek_clause(["a", "_id"], [None, 5], True) == ("(`a` IS NULL AND `_id` < %s)", [5])
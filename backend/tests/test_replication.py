@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import shlex
+import subprocess
+
+import pytest
+
+import replication
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(BACKEND_DIR, "replication.py")
+
+
+@pytest.fixture
+def dirs(tmp_path):
+    source, dest = tmp_path / "source", tmp_path / "dest"
+    source.mkdir()
+    return source, dest, tmp_path / "journal.sqlite"
+
+
+def send_command(source, journal):
+    return [sys.executable, SCRIPT, "send", str(source), "--journal", str(journal), "--once"]
+
+
+def pull(source, dest, journal):
+    # the receiver CLI with a local sender, as bin/syncscript.sh runs it over ssh
+    result = subprocess.run(
+        [sys.executable, SCRIPT, "pull", str(dest), "--once",
+         "--command", shlex.join(send_command(source, journal))],
+        cwd=BACKEND_DIR, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert "Fatal Python error" not in result.stderr
+    return result.stderr
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+def tree(root):
+    return {path.relative_to(root).as_posix(): path.read_bytes()
+            for path in root.rglob("*.json") if not path.name.startswith(".")}
+
+
+def test_create_and_delete(dirs):
+    source, dest, journal = dirs
+    write(source / "a" / "one.json", b'{"n": 1}')
+    write(source / "b" / "two.json", b'{"n": 2}')
+    pull(source, dest, journal)
+    assert tree(dest) == tree(source)
+
+    (source / "a" / "one.json").unlink()
+    write(source / "b" / "three.json", b'{"n": 3}')
+    pull(source, dest, journal)
+    assert tree(dest) == {"b/two.json": b'{"n": 2}', "b/three.json": b'{"n": 3}'}
+
+
+def test_chunked_file_resumes(dirs, monkeypatch):
+    source, dest, journal = dirs
+    big = os.urandom(2 * replication.CHUNK_BYTES + 1000)
+    write(source / "a" / "big.json", big)
+
+    # the connection drops after the first chunk reached the disk
+    apply_chunk = replication.Receiver._apply_chunk
+
+    def apply_then_drop(self, payload):
+        apply_chunk(self, payload)
+        raise ConnectionError("connection lost")
+
+    monkeypatch.setattr(replication.Receiver, "_apply_chunk", apply_then_drop)
+    receiver = replication.Receiver(dest)
+    assert receiver.run(lambda: replication.CommandConnection(send_command(source, journal)), once=True) == 1
+    assert not (dest / "a" / "big.json").exists()
+    assert receiver.state["partial"]["o"] == replication.CHUNK_BYTES
+
+    log = pull(source, dest, journal)
+    assert f"Resuming a/big.json at byte {replication.CHUNK_BYTES}" in log
+    assert (dest / "a" / "big.json").read_bytes() == big
+    with open(f"{dest}.replication-state.json") as f:
+        assert json.load(f)["partial"] is None
+
+
+def test_new_journal_transfers_everything(dirs):
+    source, dest, journal = dirs
+    write(source / "a" / "one.json", b'{"n": 1}')
+    write(source / "a" / "two.json", b'{"n": 2}')
+    pull(source, dest, journal)
+
+    # a file deleted while the journal was lost leaves no tombstone behind
+    (source / "a" / "two.json").unlink()
+    os.remove(journal)
+    write(source / "a" / "three.json", b'{"n": 3}')
+    log = pull(source, dest, journal)
+    assert "New source journal, transferring everything" in log
+    assert tree(dest) == tree(source)
@@ -0,0 +1,68 @@
+import pytest
+from flask import Flask
+
+import response_cache
+
+
+@pytest.fixture
+def app(monkeypatch):
+    table_versions = {"runs": 1}
+    calls = []
+    monkeypatch.setattr(response_cache.versions, "get", lambda: table_versions)
+    monkeypatch.setattr(response_cache, "memory", response_cache.MemoryCache())
+    monkeypatch.setattr(response_cache, "shared", None)
+    app = Flask(__name__)
+
+    @app.route("/api/data/<string:table>")
+    @response_cache.cached(table_arg="table")
+    def data(table):
+        calls.append(table)
+        return {"table": table, "calls": len(calls)}
+
+    app.table_versions, app.calls = table_versions, calls
+    return app
+
+
+def test_responses_are_cached_until_the_table_version_moves(app):
+    client = app.test_client()
+    first = client.get("/api/data/runs")
+    assert first.headers["X-Cache"] == "MISS"
+    second = client.get("/api/data/runs")
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.get_data() == first.get_data()
+
+    # another table and other parameters are other entries
+    assert client.get("/api/data/other").headers["X-Cache"] == "MISS"
+    assert client.get("/api/data/runs?limit=5").headers["X-Cache"] == "MISS"
+
+    app.table_versions["runs"] = 2
+    assert client.get("/api/data/runs").headers["X-Cache"] == "MISS"
+    assert app.calls == ["runs", "other", "runs", "runs"]
+
+
+def test_exports_are_not_cached(app):
+    client = app.test_client()
+    client.get("/api/data/runs?format=csv")
+    assert "X-Cache" not in client.get("/api/data/runs?format=csv").headers
+    assert len(app.calls) == 2
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = response_cache.MemoryCache(max_entries=2, max_bytes=10, ttl=60)
+    cache.put("a", "A", 4)
+    cache.put("b", "B", 4)
+    cache.get("a")
+    cache.put("c", "C", 4)
+    # over 10 bytes and 2 entries: "b" was used longest ago
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("A", None, "C")
+
+    cache.ttl = -1
+    cache.put("d", "D", 1)
+    assert cache.get("d") is None
+
+
+def test_shared_cache_round_trip(tmp_path):
+    cache = response_cache.SharedCache(str(tmp_path / "cache.sqlite"), ttl=60)
+    cache.put("key", (200, "application/json", b"{}"))
+    assert cache.get("key") == (200, "application/json", b"{}")
+    assert cache.get("other") is None
@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+import api
+import schema_migration
+from table_generator import table_spec
+
+SCHEMA = {
+    "$id": "runs",
+    "properties": {
+        "Identifier": {"type": "string"},
+        "run": {"type": "object", "properties": {"mass": {"type": "number"}}},
+        "note": {"type": "string"},
+    },
+}
+
+
+class FakeCursor:
+
+    def __init__(self, columns=None, indexes=()):
+        # SHOW COLUMNS rows: (Field, Type, Null, Key, Default, Extra), None if the table is missing
+        self.columns = columns
+        self.indexes = indexes
+        self._rows = []
+
+    def execute(self, query, params=None):
+        if query.startswith("SHOW TABLES"):
+            self._rows = [] if self.columns is None else [("runs",)]
+        elif query.startswith("SHOW COLUMNS"):
+            self._rows = self.columns
+        elif query.startswith("SHOW INDEX"):
+            self._rows = [("runs", 0, name) for name in self.indexes]
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+def column(name, sql_type, key="", extra=""):
+    return (name, sql_type, "YES", key, None, extra)
+
+
+def test_missing_table_is_created():
+    plan = schema_migration.plan_migration(FakeCursor(), "runs", table_spec(SCHEMA))
+    assert plan["create"]
+    assert plan["statements"][0].startswith("CREATE TABLE IF NOT EXISTS `runs`")
+
+
+def test_existing_table_is_altered_without_dropping():
+    cursor = FakeCursor([
+        column("_id", "bigint(20) unsigned", "PRI", "auto_increment"),
+        column("Identifier", "varchar(255)"),
+        column("mass", "float"),
+        column("note", "text"),
+        column("old", "int(11)"),
+    ], indexes=["PRIMARY", "ux_Identifier"])
+    plan = schema_migration.plan_migration(cursor, "runs", table_spec(SCHEMA))
+    # the leaf-named column of the old layout keeps its data under the path name
+    assert plan["rename"] == [{"column": "mass", "to": "run_mass", "type": "FLOAT"}]
+    assert plan["add"] == [{"column": "documentlocation", "type": "VARCHAR(255)"}]
+    # text already holds more than varchar(255), it is not narrowed
+    assert plan["modify"] == []
+    assert plan["orphaned"] == ["old"]
+    assert plan["indexes"] == []
+    assert not any("DROP" in statement for statement in plan["statements"])
+
+
+def test_up_to_date_table_needs_nothing():
+    cursor = FakeCursor([
+        column("_id", "bigint(20) unsigned", "PRI", "auto_increment"),
+        column("Identifier", "varchar(255)"),
+        column("run_mass", "float"),
+        column("note", "varchar(255)"),
+        column("documentlocation", "varchar(255)"),
+    ], indexes=["PRIMARY", "ux_Identifier"])
+    assert schema_migration.plan_migration(cursor, "runs", table_spec(SCHEMA))["statements"] == []
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "schemas").mkdir()
+    (tmp_path / "schemas" / "runs.json").write_text("old")
+    return api.app.test_client()
+
+
+def test_failed_migration_keeps_the_schema_file(client, tmp_path, monkeypatch):
+    def fail(table, schema, dry_run=False):
+        raise RuntimeError("migration failed")
+
+    monkeypatch.setattr(api, "migrate_table", fail)
+    response = client.post("/api/save_schema", json={"schemaName": "runs", "schema": json.dumps(SCHEMA)})
+    assert response.status_code == 500
+    assert [path.name for path in (tmp_path / "schemas").iterdir()] == ["runs.json"]
+    assert (tmp_path / "schemas" / "runs.json").read_text() == "old"
+
+
+def test_schema_file_is_written_after_migration(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(api, "migrate_table", lambda table, schema, dry_run=False: {"statements": []})
+    response = client.post("/api/save_schema", json={"schemaName": "runs", "schema": json.dumps(SCHEMA)})
+    assert response.status_code == 200
+    saved = json.loads((tmp_path / "schemas" / "runs.json").read_text())
+    assert saved["properties"]["SchemaID"]["enum"] == ["runs"]
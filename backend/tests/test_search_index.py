@@ -0,0 +1,60 @@
+import search_index
+
+# information_schema.COLUMNS rows: (TABLE_NAME, COLUMN_NAME, DATA_TYPE)
+COLUMNS = [
+    ("notes", "_id", "bigint"), ("notes", "Identifier", "varchar"), ("notes", "body", "text"),
+    ("runs", "_id", "bigint"), ("runs", "Identifier", "varchar"), ("runs", "temperature", "double"),
+    ("runs", "recorded", "datetime"),
+]
+# information_schema.STATISTICS rows: (TABLE_NAME, INDEX_NAME, COLUMN_NAME)
+INDEXES = [
+    ("notes", "ft_search", "Identifier"), ("notes", "ft_search", "body"),
+    ("runs", "ft_search", "Identifier"),
+]
+
+
+class FakeCursor:
+
+    def __init__(self):
+        self.queries = []
+        self._rows = []
+
+    def execute(self, query, params=None):
+        self.queries.append(query)
+        if "information_schema.COLUMNS" in query:
+            self._rows = COLUMNS
+        elif "information_schema.STATISTICS" in query:
+            self._rows = INDEXES
+        else:
+            self._rows = []
+
+    def fetchall(self):
+        return self._rows
+
+
+def searched(term):
+    cursor = FakeCursor()
+    search_index.search(cursor, term)
+    matched = [query for query in cursor.queries if "MATCH(" in query]
+    scanned = [query.split("`")[1] for query in cursor.queries if "CONCAT_WS" in query]
+    return matched, scanned
+
+
+def test_words_are_answered_from_the_index():
+    matched, scanned = searched("buffer")
+    assert len(matched) == 1 and "FROM `notes`" in matched[0] and "FROM `runs`" in matched[0]
+    assert scanned == []
+
+
+def test_short_words_are_scanned():
+    for term in ("buffer pH", "2024-01-05"):
+        matched, scanned = searched(term)
+        assert matched == []
+        assert scanned == ["notes", "runs"]
+
+
+def test_numbers_and_dates_scan_tables_holding_them():
+    for term in ("2024", "1013"):
+        matched, scanned = searched(term)
+        assert scanned == ["runs"]
+        assert len(matched) == 1 and "FROM `notes`" in matched[0] and "FROM `runs`" not in matched[0]
@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import time
+import subprocess
+
+import sorter
+import watcher
+import validation
+from manifest import Manifest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def sort_once(tmp_path, raw, sorted_dir):
+    result = subprocess.run(
+        [sys.executable, os.path.join(BACKEND_DIR, "watcher.py"), "sort", "--once", "--source", str(raw),
+         "--sorted", str(sorted_dir), "--checkpoint", str(tmp_path / "sort.checkpoint"),
+         "--manifest", str(tmp_path / "sort.manifest.sqlite")],
+        cwd=tmp_path, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+
+
+def test_sort_once_catches_up_and_exits(tmp_path):
+    raw, sorted_dir = tmp_path / "rawData", tmp_path / "data_sorted"
+    write(raw / "user" / "one.json", '{"title": "x", "SchemaID": "alpha", "n": 1}')
+    write(raw / "user" / "two.json", '{"SchemaID": "beta"}')
+    sort_once(tmp_path, raw, sorted_dir)
+    one = sorted_dir / "alpha" / "one.json"
+    assert one.is_symlink()
+    assert sorter.document_location(one) == str((raw / "user" / "one.json").resolve())
+    assert (sorted_dir / "beta" / "two.json").exists()
+
+    # the next run only handles what changed since
+    (raw / "user" / "two.json").unlink()
+    write(raw / "user" / "three.json", '{"SchemaID": "alpha"}')
+    sort_once(tmp_path, raw, sorted_dir)
+    assert not os.path.lexists(sorted_dir / "beta" / "two.json")
+    assert (sorted_dir / "alpha" / "three.json").exists()
+
+
+def test_queue_coalesces_and_debounces():
+    queue = watcher.EventQueue(debounce=0.2)
+    queue.put("a.json", watcher.UPSERT)
+    queue.put("b.json", watcher.UPSERT)
+    queue.put("a.json", watcher.DELETE)
+    assert queue.take_ready(timeout=0) == []
+    time.sleep(0.25)
+    # only the latest action per path, oldest first
+    assert queue.take_ready(timeout=0) == [("b.json", watcher.UPSERT), ("a.json", watcher.DELETE)]
+
+
+class FailingStage:
+    # fails any batch containing a path in `bad`
+
+    name = "ingest"
+
+    def __init__(self, bad):
+        self.bad = set(bad)
+        self.done = []
+
+    def process(self, upserts, deletes):
+        if self.bad.intersection(upserts + deletes):
+            raise ValueError("bad record")
+        self.done.extend(upserts + deletes)
+
+
+def test_bad_file_is_retried_alone_then_quarantined(tmp_path, monkeypatch):
+    monkeypatch.setattr(watcher, "RETRY_SECONDS", 0)
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / "data_sorted"
+    for name in ("good1", "bad", "good2"):
+        write(source / "samples" / f"{name}.json", "{}")
+    paths = [str(source / "samples" / f"{name}.json") for name in ("good1", "bad", "good2")]
+    stage = FailingStage([paths[1]])
+    manifest = Manifest(tmp_path / "manifest.sqlite")
+    w = watcher.Watcher(source, stage, watcher.Checkpoint(tmp_path / "checkpoint"), manifest, debounce=0)
+
+    assert w.run_once() is False
+    # the good files went through despite the bad one, which was tried MAX_ATTEMPTS times
+    assert stage.done == [paths[0], paths[2]]
+    assert len(manifest) == 2
+    report = json.loads((tmp_path / validation.QUARANTINE_DIR / "samples" / "bad.json").read_text())
+    assert f"failed {watcher.MAX_ATTEMPTS} times" in report["error"]
+    assert json.loads((tmp_path / "checkpoint").read_text())["pending"] == []
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from collections import OrderedDict
+
+# fastjsonschema is optional: without it records are not validated
+try:
+    import fastjsonschema
+except ImportError:
+    fastjsonschema = None
+
+logger = logging.getLogger(__name__)
+
+# reject: refuse invalid submissions and quarantine invalid records
+# warn: log them and carry on as before (the default); off: don't validate
+REJECT = "reject"
+WARN = "warn"
+OFF = "off"
+VALIDATION_MODE = os.environ.get("VALIDATION_MODE", WARN)
+# a report per rejected record, under <table>/
+QUARANTINE_DIR = Path(os.environ.get("QUARANTINE_DIR", "./quarantine"))
+# compiled validators kept per process, keyed by schema id and content hash
+CACHE_SIZE = 256
+# added to records by the pipeline, not by the form; ignored unless a schema declares them
+PIPELINE_KEYS = ("SchemaID", "documentlocation")
+
+
+def available():
+    return fastjsonschema is not None
+
+
+def _no_remote_refs(uri):
+    # schemas come from users: never fetch a $ref from the network or the file system
+    raise ValueError(f"remote $ref '{uri}' is not allowed")
+
+
+_REF_HANDLERS = {scheme: _no_remote_refs for scheme in ("http", "https", "ftp", "file", "data")}
+_UNKNOWN_FORMAT = "Unknown format: "
+
+
+def _prepare(schema):
+    # the form stores files as data URIs, which are not plain base64: attachments.py checks those
+    if isinstance(schema, dict):
+        return {key: _prepare(value) for key, value in schema.items() if key != "contentEncoding"}
+    if isinstance(schema, list):
+        return [_prepare(value) for value in schema]
+    return schema
+
+
+def _generate(schema):
+    # formats the schema's draft doesn't define are accepted as they are, like validators do by default
+    formats = {}
+    while True:
+        try:
+            return fastjsonschema.compile(schema, handlers=_REF_HANDLERS, formats=formats)
+        except fastjsonschema.JsonSchemaDefinitionException as e:
+            message = str(e)
+            if not message.startswith(_UNKNOWN_FORMAT) or message[len(_UNKNOWN_FORMAT):] in formats:
+                raise
+            formats[message[len(_UNKNOWN_FORMAT):]] = lambda value: True
+
+
+class Validator:
+    """Generated validation function of one schema."""
+
+    __slots__ = ("schema_id", "digest", "_validate", "_ignored")
+
+    def __init__(self, schema, digest):
+        self.schema_id = schema.get("$id") or schema.get("id")
+        self.digest = digest
+        # compiled to Python source once, a call is plain attribute and type checks
+        self._validate = _generate(_prepare(schema))
+        declared = schema.get("properties") or {}
+        self._ignored = tuple(key for key in PIPELINE_KEYS if key not in declared)
+
+    def error(self, record):
+        # message of the first violation, or None if `record` is valid
+        if isinstance(record, dict) and any(key in record for key in self._ignored):
+            record = {key: value for key, value in record.items() if key not in self._ignored}
+        try:
+            self._validate(record)
+        except fastjsonschema.JsonSchemaValueException as e:
+            return e.message
+        return None
+
+
+_validators = OrderedDict()  # (schema id, digest) -> Validator, or None if the schema did not compile
+_validators_lock = threading.Lock()
+
+
+def compile_schema(schema):
+    """Cached Validator for `schema`, None if it can't be validated against."""
+    if fastjsonschema is None or VALIDATION_MODE == OFF or not isinstance(schema, dict):
+        return None
+    digest = hashlib.sha256(json.dumps(schema, sort_keys=True).encode("utf-8")).hexdigest()
+    key = (schema.get("$id") or schema.get("id"), digest)
+    with _validators_lock:
+        if key in _validators:
+            _validators.move_to_end(key)
+            return _validators[key]
+    try:
+        validator = Validator(schema, digest)
+    except (fastjsonschema.JsonSchemaDefinitionException, ValueError, TypeError, KeyError) as e:
+        logger.warning(f"Schema '{key[0] or schema.get('title')}' cannot be compiled, not validating against it: {e}")
+        validator = None
+    with _validators_lock:
+        _validators[key] = validator
+        while len(_validators) > CACHE_SIZE:
+            _validators.popitem(last=False)
+    return validator
+
+
+def validate(validator, record, source):
+    """Error message if `record` is invalid and VALIDATION_MODE rejects it, else None."""
+    if validator is None or VALIDATION_MODE == OFF:
+        return None
+    error = validator.error(record)
+    if error is not None and VALIDATION_MODE == WARN:
+        logger.warning(f"{source} does not match its schema: {error}")
+        return None
+    return error
+
+
+def _report_path(path, table, quarantine_dir):
+    return Path(quarantine_dir) / table / Path(path).name
+
+
+def quarantine(path, table, error, quarantine_dir=QUARANTINE_DIR):
+    # record why a file was not ingested; the file itself stays where it is
+    path = Path(path)
+    target = _report_path(path, table, quarantine_dir)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"path": str(path), "location": os.path.realpath(path), "table": table,
+                   "error": error, "quarantinedAt": time.time()}, f)
+    os.replace(tmp, target)
+    logger.warning(f"Quarantined {path}: {error}")
+
+
+def is_quarantined(path, table, quarantine_dir=QUARANTINE_DIR):
+    # quarantined files are kept out of the manifests, so they are tried again on the next run
+    return _report_path(path, table, quarantine_dir).exists()
+
+
+def release(path, table, quarantine_dir=QUARANTINE_DIR):
+    # the file was ingested after all, e.g. once its schema was fixed
+    try:
+        os.remove(_report_path(path, table, quarantine_dir))
+    except FileNotFoundError:
+        pass
+
@@ -0,0 +1,457 @@
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+
+import sorter
+import validation
+from manifest import Manifest
+import metrics
+
+logger = logging.getLogger(__name__)
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+# a path is processed once no event arrived for it during this many seconds
+DEBOUNCE_SECONDS = 1.0
+# paths processed together, e.g. rows of one bulk insert
+MAX_BATCH = 1000
+# event producers block once this many paths are waiting
+MAX_PENDING = 50000
+# tolerance when comparing file mtimes against the checkpoint
+CLOCK_SKEW_SECONDS = 2.0
+# pause before the files that failed are retried
+RETRY_SECONDS = 5.0
+# a file that failed this many times on its own is quarantined (upserts) or dropped (deletes)
+MAX_ATTEMPTS = 3
+
+
+class EventQueue:
+    """Coalescing, debounced queue of file events.
+
+    Only the latest action per path is kept, so a burst of CREATE/MODIFY/
+    DELETE events for one file collapses into a single unit of work. A path
+    becomes ready once it has been quiet for `debounce` seconds. When
+    `max_pending` paths are waiting, put() blocks the producer.
+    """
+
+    def __init__(self, debounce=DEBOUNCE_SECONDS, max_pending=MAX_PENDING):
+        self.debounce = debounce
+        self.max_pending = max_pending
+        self._pending = {}  # path -> (action, last event time), in insertion order
+        self._first_seen = {}  # path -> time of its first event since it was last taken
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, path, action):
+        with self._cond:
+            while len(self._pending) >= self.max_pending and path not in self._pending and not self._closed:
+                self._cond.wait()
+            # re-insert so the dict stays ordered by last event time
+            self._pending.pop(path, None)
+            self._pending[path] = (action, time.monotonic())
+            self._first_seen.setdefault(path, time.monotonic())
+            self._cond.notify_all()
+
+    def take_ready(self, max_batch=MAX_BATCH, timeout=None):
+        """Remove and return up to `max_batch` settled (path, action) pairs."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                batch = []
+                wait = None
+                for path, (action, stamp) in self._pending.items():
+                    if now - stamp < self.debounce:
+                        # everything after this one is even younger
+                        wait = self.debounce - (now - stamp)
+                        break
+                    batch.append((path, action))
+                    if len(batch) >= max_batch:
+                        break
+                if batch:
+                    for path, _ in batch:
+                        del self._pending[path]
+                        self._first_seen.pop(path, None)
+                    self._cond.notify_all()
+                    return batch
+                if self._closed:
+                    return []
+                if deadline is not None:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        return []
+                    wait = remaining if wait is None else min(wait, remaining)
+                self._cond.wait(wait)
+
+    def requeue(self, batch):
+        # put back a failed batch without overriding newer events for its paths
+        with self._cond:
+            for path, action in batch:
+                if path not in self._pending:
+                    self._pending[path] = (action, time.monotonic())
+                    self._first_seen.setdefault(path, time.monotonic())
+            self._cond.notify_all()
+
+    def lag(self):
+        # seconds since the event of the longest-waiting path, 0 if empty
+        with self._cond:
+            if not self._first_seen:
+                return 0.0
+            return time.monotonic() - min(self._first_seen.values())
+
+    def snapshot(self):
+        with self._cond:
+            return [(path, action) for path, (action, _) in self._pending.items()]
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+class Checkpoint:
+    """Persisted watcher progress, written atomically.
+
+    Holds the wall-clock time up to which events have been fully processed
+    and the paths that were queued or in flight, so a restart replays those
+    and only looks at files modified since instead of re-processing the tree.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable checkpoint {self.path}: {e}")
+            return None
+
+    def save(self, processed_until, pending):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump({"processed_until": processed_until, "pending": pending}, f)
+        os.replace(tmp, self.path)
+
+
+class _QueueingHandler(FileSystemEventHandler):
+
+    def __init__(self, queue, suffix=".json"):
+        self.queue = queue
+        self.suffix = suffix
+
+    def _put(self, path, action):
+        if path.endswith(self.suffix):
+            self.queue.put(path, action)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self._put(event.src_path, UPSERT)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._put(event.src_path, UPSERT)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self._put(event.src_path, DELETE)
+            self._put(event.dest_path, UPSERT)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self._put(event.src_path, DELETE)
+
+
+class SortStage:
+    """rawData -> data_sorted/<SchemaID>/, replaces bin/data_preprocessing.sh."""
+
+    name = "sort"
+
+    def __init__(self, sorted_dir, link_mode=sorter.LINK_MODE, workers=sorter.SORT_WORKERS):
+        self.sorted_dir = Path(sorted_dir)
+        self.link_mode = link_mode
+        self.workers = workers
+
+    def process(self, upserts, deletes):
+        for path in deletes:
+            sorter.remove_sorted(Path(path).name, self.sorted_dir)
+        # re-linked even if unchanged, so the ingest watcher sees an event for modified files
+        sorter.sort_files([path for path in upserts if os.path.exists(path)],
+                          self.sorted_dir, self.link_mode, self.workers)
+
+
+class IngestStage:
+    """data_sorted -> MariaDB, replaces bin/insert_data2db.sh."""
+
+    name = "ingest"
+
+    def __init__(self, ingester, snapshots=None):
+        self.ingester = ingester
+        # analytics.SnapshotRefresher, told which tables changed
+        self.snapshots = snapshots
+
+    def process(self, upserts, deletes):
+        # returns the quarantined upserts, which the watcher leaves out of its manifest
+        if deletes:
+            self.ingester.delete_files(deletes)
+        existing = [path for path in upserts if os.path.exists(path)]
+        if existing:
+            self.ingester.ingest_files(existing)
+        if self.snapshots is not None:
+            self.snapshots.mark_dirty({Path(path).parent.name for path in upserts + deletes})
+        return [path for path in existing if validation.is_quarantined(path, Path(path).parent.name)]
+
+
+class Watcher:
+    """Watches `source_dir` and feeds coalesced batches of changes to `stage`."""
+
+    def __init__(self, source_dir, stage, checkpoint, manifest=None, debounce=DEBOUNCE_SECONDS,
+                 max_batch=MAX_BATCH, max_pending=MAX_PENDING):
+        # absolute, so walked paths, event paths and manifest entries agree
+        self.source_dir = Path(source_dir).resolve()
+        self.stage = stage
+        self.checkpoint = checkpoint
+        self.manifest = manifest
+        self.max_batch = max_batch
+        self.queue = EventQueue(debounce=debounce, max_pending=max_pending)
+        self._stopping = threading.Event()
+        self._processed_until = None
+        self._in_flight = []
+        self._failures = {}  # path -> times it failed on its own
+
+    def _save_checkpoint(self):
+        pending = self._in_flight + self.queue.snapshot()
+        self.checkpoint.save(self._processed_until, pending)
+
+    def _enqueue_existing(self, newer_than=None):
+        count = 0
+        for root, _, files in os.walk(self.source_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                if newer_than is not None:
+                    try:
+                        if os.stat(path).st_mtime < newer_than:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                self.queue.put(path, UPSERT)
+                count += 1
+        return count
+
+    def recover(self):
+        if self.manifest is not None:
+            # the manifest knows exactly what was processed, including files deleted while down
+            state = self.checkpoint.load() or {}
+            self._processed_until = state.get("processed_until")
+            for path, action in state.get("pending", []):
+                self.queue.put(path, action)
+            changed, deleted = self.manifest.diff(self.source_dir)
+            for path in deleted:
+                self.queue.put(path, DELETE)
+            for path in changed:
+                self.queue.put(path, UPSERT)
+            logger.info(f"Reconciled with manifest: {len(changed)} new or changed, {len(deleted)} deleted")
+            return
+        state = self.checkpoint.load()
+        if state is None or state.get("processed_until") is None:
+            count = self._enqueue_existing()
+            logger.info(f"No checkpoint, queued all {count} files in {self.source_dir}")
+            return
+        self._processed_until = state["processed_until"]
+        for path, action in state.get("pending", []):
+            self.queue.put(path, action)
+        since = state["processed_until"] - CLOCK_SKEW_SECONDS
+        count = self._enqueue_existing(newer_than=since)
+        logger.info(f"Resumed from checkpoint: {len(state.get('pending', []))} pending, {count} changed since")
+
+    def publish_metrics(self):
+        metrics.set_gauge("watcher_pending_files", len(self.queue) + len(self._in_flight), stage=self.stage.name)
+        metrics.set_gauge("watcher_lag_seconds", self.queue.lag(), stage=self.stage.name)
+        metrics.flush()
+
+    def _process(self, batch):
+        upserts = [path for path, action in batch if action == UPSERT]
+        deletes = [path for path, action in batch if action == DELETE]
+        held = set(self.stage.process(upserts, deletes) or ())
+        for path, _ in batch:
+            self._failures.pop(path, None)
+        if self.manifest is not None:
+            self.manifest.forget(deletes)
+            self.manifest.record(path for path in upserts if path not in held and os.path.exists(path))
+        return len(upserts), len(deletes)
+
+    def _process_singly(self, batch):
+        # (upserted, deleted, [((path, action), error), ...])
+        upserted = deleted = 0
+        failed = []
+        for item in batch:
+            try:
+                counts = self._process([item])
+            except Exception as e:
+                failed.append((item, e))
+                continue
+            upserted += counts[0]
+            deleted += counts[1]
+        return upserted, deleted, failed
+
+    def _give_up(self, path, action, error):
+        # the file stays out of the manifest, so a restart or its next change tries it again
+        self._failures.pop(path, None)
+        if action == UPSERT:
+            validation.quarantine(path, Path(path).parent.name,
+                                  f"{self.stage.name} failed {MAX_ATTEMPTS} times: {error}")
+        else:
+            logger.error(f"{self.stage.name}: dropping delete of {path} after {MAX_ATTEMPTS} attempts: {error}")
+
+    def process_batch(self, batch):
+        """Hand `batch` to the stage; returns False if a file of it failed.
+
+        A failed batch is retried file by file, so one bad file doesn't hold
+        up the others. A file that fails on its own is requeued, and
+        quarantined or dropped once it failed MAX_ATTEMPTS times.
+        """
+        started = time.time()
+        self._in_flight = batch
+        self._save_checkpoint()
+        try:
+            upserted, deleted = self._process(batch)
+            failed = []
+        except Exception as e:
+            if len(batch) == 1:
+                upserted, deleted, failed = 0, 0, [(batch[0], e)]
+            else:
+                logger.error(f"{self.stage.name}: batch of {len(batch)} failed, retrying file by file: {e}")
+                upserted, deleted, failed = self._process_singly(batch)
+        retry = []
+        for (path, action), error in failed:
+            self._failures[path] = self._failures.get(path, 0) + 1
+            if self._failures[path] >= MAX_ATTEMPTS:
+                self._give_up(path, action, error)
+            else:
+                logger.error(f"{self.stage.name}: {path} failed, retrying in {RETRY_SECONDS}s: {error}")
+                retry.append((path, action))
+        # files to retry stay in the checkpoint until they went through
+        self.queue.requeue(retry)
+        self._in_flight = []
+        if self._processed_until is None or started > self._processed_until:
+            self._processed_until = started
+        self._save_checkpoint()
+        logger.info(f"{self.stage.name}: {upserted} upserted, {deleted} deleted, {len(failed)} failed, "
+                    f"{len(self.queue)} waiting")
+        if retry:
+            self._stopping.wait(RETRY_SECONDS)
+        return not failed
+
+    def run(self):
+        observer = Observer()
+        observer.schedule(_QueueingHandler(self.queue), str(self.source_dir), recursive=True)
+        # watch first, then catch up, so nothing falls between the two
+        observer.start()
+        try:
+            self.recover()
+            while not self._stopping.is_set():
+                batch = self.queue.take_ready(self.max_batch, timeout=1.0)
+                if batch:
+                    self.process_batch(batch)
+                self.publish_metrics()
+        finally:
+            observer.stop()
+            observer.join()
+            self._save_checkpoint()
+
+    def run_once(self):
+        """Catch up with the directory and return, for cron and per-event callers.
+
+        Needs a queue without debounce. Failed files are retried until they
+        go through or are given up; returns False if a file failed.
+        """
+        ok = True
+        try:
+            self.recover()
+            while not self._stopping.is_set():
+                batch = self.queue.take_ready(self.max_batch, timeout=0)
+                if not batch:
+                    break
+                ok = self.process_batch(batch) and ok
+            return ok
+        finally:
+            self.publish_metrics()
+            self._save_checkpoint()
+
+    def stop(self, *_):
+        self._stopping.set()
+        self.queue.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch a data directory and sort or ingest changed records")
+    parser.add_argument("mode", choices=["sort", "ingest"])
+    parser.add_argument("--source", help="directory to watch (rawData for sort, data_sorted for ingest)")
+    parser.add_argument("--sorted", default=str(sorter.DATA_SORTED_DIR), help="data_sorted directory (sort mode)")
+    parser.add_argument("--link", choices=sorter.LINK_MODES, default=sorter.LINK_MODE,
+                        help="how sorted entries refer to raw files (sort mode)")
+    parser.add_argument("--workers", type=int, default=sorter.SORT_WORKERS, help="files sorted in parallel (sort mode)")
+    parser.add_argument("--checkpoint", help="checkpoint file (default ./watcher-<mode>.checkpoint)")
+    parser.add_argument("--manifest", help="file manifest (default ./watcher-<mode>.manifest.sqlite)")
+    parser.add_argument("--no-manifest", action="store_true", help="resume from the checkpoint time only")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING)
+    parser.add_argument("--once", action="store_true", help="process what changed since the last run and exit")
+    parser.add_argument("--snapshots", action="store_true",
+                        help="keep the columnar analytics snapshots of ingested tables up to date (ingest mode)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    snapshots = None
+    if args.mode == "sort":
+        source = args.source or str(sorter.RAW_DATA_DIR)
+        Path(args.sorted).mkdir(parents=True, exist_ok=True)
+        stage = SortStage(args.sorted, args.link, args.workers)
+    else:
+        from ingest import Ingester
+        source = args.source or str(sorter.DATA_SORTED_DIR)
+        if args.snapshots:
+            from analytics import SnapshotRefresher
+            snapshots = SnapshotRefresher()
+            snapshots.start()
+        stage = IngestStage(Ingester(), snapshots)
+
+    manifest = None
+    if not args.no_manifest:
+        manifest = Manifest(args.manifest or f"./watcher-{args.mode}.manifest.sqlite")
+    watcher = Watcher(
+        source, stage, Checkpoint(args.checkpoint or f"./watcher-{args.mode}.checkpoint"), manifest,
+        debounce=0 if args.once else args.debounce, max_batch=args.max_batch, max_pending=args.max_pending)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    signal.signal(signal.SIGINT, watcher.stop)
+    try:
+        if args.once:
+            return 0 if watcher.run_once() else 1
+        watcher.run()
+    finally:
+        if snapshots is not None:
+            snapshots.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
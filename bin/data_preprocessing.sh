@@ -19,57 +19,27 @@ source_dir="${NEXTCLOUD_DATA_DIR:-./nextcloud_dir}/rawData"
 target_dir="./data_sorted"
 echo $source_dir
 
-# Create the target directory if it does not exist
+# Sorting is done by the Python sorter (backend/sorter.py) through the watcher:
+# it reads only the SchemaID of each file and links it into
+# data_sorted/<schema_id>/ instead of copying and rewriting it with jq.
+# SORT_LINK_MODE=symlink|hardlink|copy selects how entries refer to rawData.
+# Without arguments it sorts what changed since the last run and exits, as the
+# hourly cron job and the per-event callers expect; --watch keeps it running.
+BACKEND_DIR="${ADAMANT_BACKEND_DIR:-$SCRIPT_DIR/../backend}"
+lock_file="${SORT_LOCK_FILE:-$target_dir.lock}"
 mkdir -p "$target_dir"
 
-# Function to process JSON files
-process_file() {
-    local file=$1
-    # Extract the schema unique ID from the JSON file
-    schema_id=$(jq -r '.SchemaID' "$file")
-
-    # Check if the schema_id is not null or empty
-    if [ -n "$schema_id" ] && [ "$schema_id" != "null" ]; then
-        # Create a subfolder named after the schema unique ID
-        subfolder="$target_dir/$schema_id"
-        mkdir -p "$subfolder"
-        # Get the absolute path to the JSON file
-        absolute_path=$(realpath "$file")
-
-        # Move the JSON file into the appropriate subfolder
-        cp "$file" "$subfolder/"
-
-        # Add the "documentlocation" parameter with the absolute path
-        jq --arg path "$absolute_path" '. + {documentlocation: $path}' "$file" > "$subfolder/$(basename "$file")"
-    else
-        echo "Warning: No schema_id found in $file"
-    fi
-}
-
-# Function to remove JSON files
-remove_file() {
-    local file=$1
-    # Extract the schema unique ID from the JSON file
-    find "$target_dir" -type f -name "$file" -exec rm -v {} \;
-}
-
-# Process existing JSON files
-find "$source_dir" -type f -name "*.json" | while read -r file; do
-    process_file "$file"
-done
-
-echo "Initial sorting complete."
+# One sorter at a time. A caller that finds one running leaves the work to it,
+# what it misses is picked up by the next event or the next hourly run.
+exec 9>"$lock_file"
+if ! flock -n 9; then
+    echo "Sorting already running, skipping"
+    exit 0
+fi
 
-# Monitor the source directory for new files and deletions
-inotifywait -m -r -e create,delete "$source_dir" | while read -r directory event file; do
-    # Check if the new file is a JSON file
-    if [[ "$file" == *.json ]]; then
-        if [[ "$event" == "CREATE" ]]; then
-            process_file "$directory/$file"
-            echo "Processed new file: $directory/$file"
-        elif [[ "$event" == "DELETE" ]]; then
-            remove_file "$file"
-            echo "Removed file: $directory/$file"
-        fi
-    fi
-done
+once="--once"
+if [ "$1" = "--watch" ]; then
+    once=""
+fi
+exec python3 "$BACKEND_DIR/watcher.py" sort --source "$source_dir" --sorted "$target_dir" \
+    --link "${SORT_LINK_MODE:-symlink}" $once
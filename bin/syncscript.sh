@@ -1,15 +1,14 @@
 #!/bin/bash
 
-# Function to sync directories
-sync_dirs() {
-	rsync -avz --delete adamant:~/data_sorted/ data_sorted
-}
+# Replicate data_sorted from the Nextcloud host as it changes.
+# backend/replication.py keeps one ssh connection open; on the Nextcloud host
+# the same script sends only the files its change journal has seen change,
+# in compressed batches, and a broken connection resumes where it stopped.
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
-# Initial sync
-sync_dirs
-
-#done
-while true; do
-    sync_dirs
-    sleep 1
-done
+# runs until stopped; started again by cron, flock keeps it to one copy
+mkdir -p data_sorted
+exec flock -n "${TMPDIR:-/tmp}/adamant-sync.lock" \
+    python3 "$SCRIPT_DIR/../backend/replication.py" pull data_sorted \
+    --host "${NEXTCLOUD_HOST:-adamant}" \
+    --source "${REMOTE_DATA_DIR:-~/data_sorted}"
@@ -10,6 +10,10 @@ function DataGridPage() {
   const [rows, setRows] = useState([]);
   const [columns, setColumns] = useState([]);
   const [density, setDensity] = useState("compact");
+  const [paginationModel, setPaginationModel] = useState({ page: 0, pageSize: 20 });
+  const [rowCount, setRowCount] = useState(0);
+  // keyset cursor for the start of every page that has been visited
+  const pageCursors = React.useRef({ 0: null });
 
   // Fetch table list from the backend
   useEffect(() => {
@@ -33,28 +37,59 @@ function DataGridPage() {
       });
   }, []);
 
-  // Fetch data and column information of the selected table
+  // Reset paging whenever the table changes
+  useEffect(() => {
+    pageCursors.current = { 0: null };
+    setPaginationModel((model) => ({ ...model, page: 0 }));
+  }, [selectedTable]);
+
+  // Fetch the current page of the selected table
   useEffect(() => {
     if (!selectedTable) {
       setRows([]);
-      setColumns([]);
+      setRowCount(0);
+      return;
+    }
+    const { page, pageSize } = paginationModel;
+    const cursor = pageCursors.current[page];
+    if (cursor === undefined) {
+      // jumped past the pages we have cursors for, restart from the beginning
+      setPaginationModel({ page: 0, pageSize });
       return;
     }
 
-    fetch(`/api/data/${selectedTable}`)
+    const params = new URLSearchParams({ limit: pageSize });
+    if (cursor) {
+      params.set("cursor", cursor);
+    }
+    fetch(`/api/data/${selectedTable}?${params}`)
       .then((response) => response.json())
       .then((data) => {
-        const rowsWithId = data.map((row, index) => ({
-          id: index + 1,
+        const rowsWithId = data.data.map((row, index) => ({
+          id: page * pageSize + index + 1,
           ...row,
         }));
         setRows(rowsWithId);
+        if (data.next_cursor) {
+          pageCursors.current[page + 1] = data.next_cursor;
+        }
+        // the total is an estimate, never let it hide a page we know exists
+        const known = page * pageSize + rowsWithId.length + (data.has_more ? 1 : 0);
+        setRowCount(Math.max(data.total || 0, known));
       })
       .catch((err) => {
         console.error("Error fetching table data:", err);
         setRows([]);
         toast.error("Failed to fetch data for the selected table.");
       });
+  }, [selectedTable, paginationModel]);
+
+  // Fetch column information of the selected table
+  useEffect(() => {
+    if (!selectedTable) {
+      setColumns([]);
+      return;
+    }
 
     fetch(`/api/columns/${selectedTable}`)
       .then((response) => response.json())
@@ -106,7 +141,12 @@ function DataGridPage() {
         </FormControl>
 
         {/* Export Buttons */}
-        <Button variant="contained" onClick={() => gridApiRef.current.exportDataAsCsv()}>
+        {/* CSV export is streamed by the backend, the grid only holds the current page */}
+        <Button
+          variant="contained"
+          disabled={!selectedTable}
+          onClick={() => window.open(`/api/data/${encodeURIComponent(selectedTable)}?format=csv`)}
+        >
           Export as CSV
         </Button>
         <Button variant="contained" onClick={() => gridApiRef.current.exportDataAsExcel()}>
@@ -132,8 +172,18 @@ function DataGridPage() {
         <DataGridPremium
           rows={rows}
           columns={columns}
-          pageSize={10}
-          rowsPerPageOptions={[10, 20, 50]}
+          pagination
+          paginationMode="server"
+          paginationModel={paginationModel}
+          onPaginationModelChange={(model) => {
+            if (model.pageSize !== paginationModel.pageSize) {
+              pageCursors.current = { 0: null };
+              model = { ...model, page: 0 };
+            }
+            setPaginationModel(model);
+          }}
+          rowCount={rowCount}
+          pageSizeOptions={[10, 20, 50, 100]}
           checkboxSelection
           disableSelectionOnClick
           experimentalFeatures={{ newEditingApi: true }}
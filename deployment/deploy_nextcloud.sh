@@ -7,7 +7,8 @@ git clone https://github.com/mohamedatawfik/adamant.git
 cd adamant
 
 echo "Installing Nextcloud Scripts Dependencies..."
-sudo apt update && sudo apt install -y jq inotifywait
+sudo apt update && sudo apt install -y jq inotifywait python3 python3-pip
+pip3 install watchdog==2.1.9
 
 echo "Copying Bash scripts to /home/scripts..."
 mkdir -p /home/user/scripts
@@ -16,6 +17,9 @@ chmod +x /home/user/scripts/data_preprocessing.sh
 cp ../bin/syncscript.sh /home/user/scripts/
 chmod +x /home/user/scripts/syncscript.sh
 
+echo "Copying the backend (sorter and watcher) to /home/user/backend..."
+cp -r ../backend /home/user/backend
+
 echo "Copying .env file to /home/user/scripts/..."
 if [ -f .env ]; then
     cp .env /home/user/scripts/.env
@@ -82,17 +82,36 @@ User=$USER
 Group=www-data
 WorkingDirectory=$(pwd)
 Environment="PATH=$(pwd)/venv/bin"
-ExecStart=$(pwd)/venv/bin/gunicorn -b 0.0.0.0:5000 api:app
+ExecStart=$(pwd)/venv/bin/gunicorn -c gunicorn.conf.py api:app
 
 [Install]
 WantedBy=multi-user.target
 EOF
 
-# Reload systemd and start backend service
+# The backend only queues job request e-mails, this worker sends them
+sudo tee /etc/systemd/system/adamant-mail-worker.service > /dev/null <<EOF
+[Unit]
+Description=Adamant job request mail worker
+After=network.target
+
+[Service]
+User=$USER
+Group=www-data
+WorkingDirectory=$(pwd)
+Environment="PATH=$(pwd)/venv/bin"
+ExecStart=$(pwd)/venv/bin/python mail_queue.py --workers 1
+Restart=always
+RestartSec=5
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+# Reload systemd and start backend services
 sudo systemctl daemon-reexec
 sudo systemctl daemon-reload
-sudo systemctl enable adamant-backend
-sudo systemctl start adamant-backend
+sudo systemctl enable adamant-backend adamant-mail-worker
+sudo systemctl start adamant-backend adamant-mail-worker
 
 
 echo "Setting up Node frontend..."
@@ -123,6 +142,8 @@ echo "Copying Bash scripts to /home/user/scripts..."
 mkdir -p /home/user/scripts
 cp ../bin/insert_data2db.sh /home/user/scripts/
 chmod +x /home/user/scripts/insert_data2db.sh
+# insert_data2db.sh runs the ingester of the backend, with its venv
+ln -sfn "$(pwd)/backend" /home/user/backend
 
 echo "Obtaining SSL with Certbot..."
 # Use SSL configuration from .env file
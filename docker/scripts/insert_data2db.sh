@@ -103,6 +103,9 @@ try:
         
         create_sql = f'CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(columns)})'
         cursor.execute(create_sql)
+        # so the backend's response cache sees the new table
+        cursor.execute('CREATE TABLE IF NOT EXISTS _table_versions (table_name VARCHAR(64) NOT NULL PRIMARY KEY, version BIGINT UNSIGNED NOT NULL)')
+        cursor.execute('INSERT INTO _table_versions (table_name, version) VALUES (%s, 1) ON DUPLICATE KEY UPDATE version = version + 1', ('$table_name',))
         conn.commit()
         print(f'Table {table_name} created successfully')
         
@@ -154,9 +157,14 @@ try:
                 print(f'Record already exists: {data[\"documentlocation\"]}')
                 return
         
+        # DDL commits implicitly, so the versions table is created before the insert
+        cursor.execute('CREATE TABLE IF NOT EXISTS _table_versions (table_name VARCHAR(64) NOT NULL PRIMARY KEY, version BIGINT UNSIGNED NOT NULL)')
+
         # Insert data
         insert_sql = f'INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({placeholders})'
         cursor.execute(insert_sql, values)
+        # bumped in the same transaction, so the backend's response cache sees the new row
+        cursor.execute('INSERT INTO _table_versions (table_name, version) VALUES (%s, 1) ON DUPLICATE KEY UPDATE version = version + 1', ('$table_name',))
         conn.commit()
         print(f'Data inserted successfully into {table_name}')
         
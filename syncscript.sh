@@ -1,15 +1,12 @@
 #!/bin/bash
 
-# Function to sync directories
-sync_dirs() {
-	rsync -avz --delete nextcloud:~/data_sorted/ data_sorted
-}
+# Replicate data_sorted from the Nextcloud host as it changes
+# (see bin/syncscript.sh and backend/replication.py).
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 
-# Initial sync
-sync_dirs
-
-#done
-while true; do
-    sync_dirs
-    sleep 1
-done
+# runs until stopped; started again by cron, flock keeps it to one copy
+mkdir -p data_sorted
+exec flock -n "${TMPDIR:-/tmp}/adamant-sync.lock" \
+    python3 "$SCRIPT_DIR/backend/replication.py" pull data_sorted \
+    --host "${NEXTCLOUD_HOST:-nextcloud}" \
+    --source "${REMOTE_DATA_DIR:-~/data_sorted}"